@@ -0,0 +1,121 @@
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from .cache import LRUCache
+from .geocode import GAZETTEER, normalize_place
+from .regions import island_at
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+FUNFACT_POOL_SIZE = int(os.getenv("FUNFACT_POOL_SIZE", "6"))
+FUNFACT_LOW_WATER = int(os.getenv("FUNFACT_LOW_WATER", "2"))
+
+# Filler words that don't change what is being asked
+STOPWORDS = {
+    "a", "an", "the", "please", "can", "could", "would", "you", "me", "i", "us", "tell", "show",
+    "give", "what", "whats", "is", "was", "are", "were", "of", "for", "in", "on", "at", "to", "about",
+    "hey", "hi", "hello", "aloha", "mahalo", "thanks", "thank",
+}
+
+answer_cache = LRUCache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Reduces a question to its meaningful words, so "What's the rainfall in Hilo?"
+    and "rainfall hilo please" compare equal.
+    """
+    return " ".join(word for word in normalize_place(prompt).split() if word not in STOPWORDS)
+
+
+def answer_key(messages: list[str], params: dict | None) -> str:
+    """
+    Builds the answer cache key from the normalized conversation and the HCDP
+    parameters resolved for it, if any.
+    """
+    payload = json.dumps([[normalize_prompt(message) for message in messages], params], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+# What /funfact accepts, for its error message
+FUNFACT_NAMES = (
+    f"an island ({', '.join(entry['name'] for entry in GAZETTEER.entries if entry['kind'] == 'island')}), "
+    "a county, Hawaii for the whole state, or a town on one of the islands"
+)
+
+
+def funfact_island(island: str) -> str | None:
+    """
+    Returns the gazetteer name of the island, county or state `island` refers
+    to, forgiving aliases and typos, or None if it isn't one. A town or other
+    place resolves to the island it lies on ("Honolulu" -> "Oahu").
+    """
+    entry = GAZETTEER.lookup(island)
+    if entry is None:
+        return None
+    if entry["kind"] in ("island", "county", "state"):
+        return entry["name"]
+    return island_at(entry["lat"], entry["lng"])
+
+
+class FunFactPool:
+    """
+    Small rotating pool of pre-generated fun facts per island.
+
+    Serving a fact removes it from the pool; when a pool drops to the low-water
+    mark it is refilled in the background, so repeated /funfact calls return
+    instantly without showing the same fact over and over. Callers pass
+    names from funfact_island, so every pool costs model calls for a real island.
+    """
+
+    def __init__(self, generate, size=FUNFACT_POOL_SIZE, low_water=FUNFACT_LOW_WATER):
+        self.generate = generate
+        self.size = size
+        self.low_water = low_water
+        self._pools = LRUCache(maxsize=64)
+        self._refills = {}
+
+    async def get(self, island: str) -> str:
+        """
+        Returns a fact about `island`, generating one inline only if the pool is empty.
+        """
+        key = normalize_place(island)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = collections.deque()
+            self._pools.set(key, pool)
+        fact = pool.popleft() if pool else await self.generate(island)
+        if len(pool) <= self.low_water:
+            self._schedule_refill(key, island, pool)
+        return fact
+
+    def _schedule_refill(self, key, island, pool):
+        if key in self._refills:
+            return
+        task = asyncio.create_task(self._refill(island, pool))
+        self._refills[key] = task
+        task.add_done_callback(lambda _: self._refills.pop(key, None))
+
+    async def _refill(self, island, pool):
+        # Bounded, in case the model keeps repeating itself
+        for _ in range(2 * self.size):
+            if len(pool) >= self.size:
+                return
+            try:
+                fact = await self.generate(island)
+            except Exception as e:
+                logger.warning("Error refilling fun facts for %s: %s", island, e)
+                return
+            if fact not in pool:
+                pool.append(fact)
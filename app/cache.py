@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    In-memory least-recently-used cache with an optional time-to-live.
+
+    Entries past their TTL are treated as misses but are kept until evicted, so
+    callers can still fall back to them with `get_stale` when upstream is down.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key, default=None, count=True):
+        """
+        Returns the fresh value stored under `key`, or `default` on a miss.
+        """
+        entry = self._data.get(key)
+        if entry is None or (entry[1] is not None and entry[1] < time.monotonic()):
+            if count:
+                self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        if count:
+            self.hits += 1
+        return entry[0]
+
+    def get_stale(self, key, default=None):
+        """
+        Returns the value stored under `key` even if it has expired.
+        """
+        entry = self._data.get(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores `value` under `key`. `ttl` overrides the cache-wide TTL in seconds.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def discard(self, predicate) -> int:
+        """
+        Removes every entry for which `predicate(key, value)` is true.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        keys = [key for key, (value, _) in self._data.items() if predicate(key, value)]
+        for key in keys:
+            del self._data[key]
+        return len(keys)
+
+    def stats(self):
+        """
+        Returns hit/miss counters and the current size.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
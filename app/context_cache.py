@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+
+class ContextCache:
+    """
+    Keeps a Gemini context cache of a static prompt prefix alive.
+
+    The cache is created on first use and its TTL is extended shortly before
+    it runs out, so requests reference the prefix by name instead of
+    resending (and being billed in full for) it every time. If the cache
+    can't be created, e.g. because the prefix is below the model's minimum
+    cacheable size, callers get None and send the full prompt; creating it is
+    tried again after `retry` seconds.
+    """
+
+    def __init__(self, client, model: str, config: types.CreateCachedContentConfig, ttl: int, retry: float = 300, margin: float = 60):
+        self.client = client
+        self.model = model
+        self.config = config
+        self.ttl = ttl
+        self.retry = retry
+        self.margin = min(margin, ttl / 2)
+        self._name = None
+        self._expires = 0.0
+        self._retry_at = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    async def name(self) -> str | None:
+        """
+        Returns the resource name of the live cache, creating or extending it if needed.
+
+        Returns:
+            str | None: The cache name, or None if the full prompt has to be sent.
+        """
+        if not self.enabled:
+            return None
+        if self._name is not None and time.monotonic() < self._expires - self.margin:
+            return self._name
+        async with self._lock:
+            now = time.monotonic()
+            if self._name is not None and now < self._expires - self.margin:
+                return self._name
+            if self._name is None and now < self._retry_at:
+                return None
+            ttl = f"{self.ttl}s"
+            try:
+                if self._name is not None:
+                    await self.client.aio.caches.update(name=self._name, config=types.UpdateCachedContentConfig(ttl=ttl))
+                else:
+                    cache = await self.client.aio.caches.create(model=self.model, config=self.config.model_copy(update={"ttl": ttl}))
+                    self._name = cache.name
+                    logger.info("Created context cache %s", self._name)
+                self._expires = now + self.ttl
+            except Exception as e:
+                logger.warning("Context cache unavailable, sending the full prompt: %s", e)
+                self.invalidate()
+        return self._name
+
+    def invalidate(self):
+        """
+        Forgets the cache, e.g. after a request referencing it failed, and
+        sends the full prompt for the next `retry` seconds.
+        """
+        self._name = None
+        self._expires = 0.0
+        self._retry_at = time.monotonic() + self.retry
+
+    async def close(self):
+        """
+        Deletes the cache instead of letting it live out its TTL.
+        """
+        name, self._name = self._name, None
+        if name is not None:
+            try:
+                await self.client.aio.caches.delete(name=name)
+            except Exception as e:
+                logger.warning("Error deleting context cache %s: %s", name, e)
@@ -0,0 +1,118 @@
+import base64
+import io
+
+import numpy as np
+
+from .summarize import to_arrays
+
+
+def pack_series(data: dict, period: str) -> tuple[str | None, np.ndarray]:
+    """
+    Lays a date/value series out on a regular axis, one value per period from
+    its first date to its last. Dates without a value become NaN.
+
+    Returns:
+        tuple[str | None, np.ndarray]: The first date (YYYY-MM-DD), or None for
+                                       an empty series, and the float32 values.
+    """
+    if not data:
+        return None, np.empty(0, dtype=np.float32)
+    unit = "datetime64[M]" if period == "month" else "datetime64[D]"
+    keys = list(data)
+    # HCDP series are usually already complete and in order: check that cheaply
+    # (distinct sorted dates sharing one suffix, as many as the periods they
+    # span) and skip parsing every date
+    suffix = 7 if period == "month" else 10
+    first, last = np.datetime64(keys[0][:10]).astype(unit), np.datetime64(keys[-1][:10]).astype(unit)
+    if (
+        int((last - first).astype(np.int64)) + 1 == len(keys)
+        and len({key[suffix:] for key in keys}) == 1
+        and keys == sorted(keys)
+    ):
+        values = np.array([np.nan if value is None else value for value in data.values()], dtype=np.float32)
+        return str(first.astype("datetime64[D]")), values
+    dates, values = to_arrays(data)
+    steps = dates.astype(unit)
+    index = (steps - steps[0]).astype(np.int64)
+    packed = np.full(int(index[-1]) + 1, np.nan, dtype=np.float32)
+    packed[index] = values
+    return str(steps[0].astype("datetime64[D]")), packed
+
+
+def series_dates(start: str, length: int, period: str) -> np.ndarray:
+    """
+    Returns the datetime64[D] axis of a packed series.
+    """
+    unit = "M" if period == "month" else "D"
+    first = np.datetime64(start, unit)
+    return np.arange(first, first + length).astype("datetime64[D]")
+
+
+def encode_series(data: dict, period: str) -> dict:
+    """
+    Encodes a date/value series compactly. Float32 keeps about 7 significant
+    digits, more than the 4 decimals HCDP values carry.
+
+    Returns:
+        dict: {"start", "period", "length", "dtype", "values"}, values being
+              base64 little-endian float32 with NaN for missing dates.
+    """
+    start, packed = pack_series(data or {}, period)
+    return {
+        "start": start,
+        "period": period,
+        "length": len(packed),
+        "dtype": "float32",
+        "values": base64.b64encode(packed.astype("<f4").tobytes()).decode("ascii"),
+    }
+
+
+def decode_series(encoded: dict) -> dict:
+    """
+    Turns a compact series back into date/value pairs like /raster/timeseries.
+    """
+    values = np.frombuffer(base64.b64decode(encoded["values"]), dtype="<f4")
+    if not len(values):
+        return {}
+    dates = series_dates(encoded["start"], len(values), encoded["period"])
+    return {f"{date}T00:00:00.000Z": round(float(value), 4) for date, value in zip(dates, values) if np.isfinite(value)}
+
+
+def encode_percentiles(percentiles: dict, period: str) -> dict:
+    """
+    Encodes date/percentile dicts as one compact series per percentile.
+    """
+    names = next(iter(percentiles.values()), {})
+    return {name: encode_series({date: values.get(name) for date, values in percentiles.items()}, period) for name in names}
+
+
+def encode_extra_params(extra_params: dict | None, encoding: str) -> dict | None:
+    """
+    Encodes the series of the extra_params sent to the frontend, including
+    those of every entry of "series", leaving the other fields as they are.
+    """
+    if extra_params is None or encoding == "dict":
+        return extra_params
+    period = extra_params.get("period")
+    encoded = dict(extra_params)
+    if extra_params.get("data") is not None:
+        encoded["data"] = encode_series(extra_params["data"], period)
+    if extra_params.get("percentiles"):
+        encoded["percentiles"] = encode_percentiles(extra_params["percentiles"], period)
+    if extra_params.get("series"):
+        encoded["series"] = [encode_extra_params(series, encoding) for series in extra_params["series"]]
+    encoded["encoding"] = encoding
+    return encoded
+
+
+def series_npy(data: dict, period: str) -> tuple[bytes, str | None]:
+    """
+    Serializes a series as a NumPy .npy float32 array, one value per period.
+
+    Returns:
+        tuple[bytes, str | None]: The .npy file and the date of its first value.
+    """
+    start, packed = pack_series(data or {}, period)
+    buffer = io.BytesIO()
+    np.save(buffer, packed.astype("<f4"), allow_pickle=False)
+    return buffer.getvalue(), start
@@ -0,0 +1,154 @@
+import asyncio
+import collections
+import logging
+import os
+import random
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+from dotenv import load_dotenv
+
+from .hcdp import (
+    BASE_URL,
+    CONNECT_TIMEOUT,
+    HEADERS,
+    HTTP_RETRY_BACKOFF,
+    RETRY_STATUSES,
+    endpoint_label,
+    open_session,
+    post_genzip_instant_splitlink,
+)
+from .metrics import EXPORT_BUFFERED, UPSTREAM_BYTES, UPSTREAM_LATENCY, UPSTREAM_REQUESTS, UPSTREAM_RETRIES, stage
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Parts downloaded at the same time, and how much of each is buffered ahead of
+# the client: an export never holds more than EXPORT_WINDOW * EXPORT_PART_BUFFER bytes
+EXPORT_WINDOW = int(os.getenv("EXPORT_WINDOW", "4"))
+EXPORT_PART_BUFFER = int(os.getenv("EXPORT_PART_BUFFER", str(8 * 2**20)))
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", str(256 * 2**10)))
+# Times a part is resumed after its download breaks, and how long a read may stall
+EXPORT_PART_RETRIES = int(os.getenv("EXPORT_PART_RETRIES", "3"))
+EXPORT_READ_TIMEOUT = float(os.getenv("EXPORT_READ_TIMEOUT", "60"))
+
+
+def part_headers(url: str) -> dict:
+    # Only sends the API token to the HCDP host
+    return dict(HEADERS) if urlsplit(url).netloc == urlsplit(BASE_URL).netloc else {}
+
+
+async def download_part(url: str, queue: asyncio.Queue):
+    """
+    Downloads one part into `queue` chunk by chunk, waiting while the queue is
+    full. A broken download resumes where it stopped with a Range request;
+    if the server ignores the range, the bytes already queued are skipped.
+
+    Raises:
+        aiohttp.ClientError, asyncio.TimeoutError: If the part still fails after EXPORT_PART_RETRIES retries.
+    """
+    endpoint = endpoint_label(url)
+    session = await open_session()
+    timeout = aiohttp.ClientTimeout(total=None, connect=CONNECT_TIMEOUT, sock_read=EXPORT_READ_TIMEOUT)
+    offset = 0
+    for attempt in range(EXPORT_PART_RETRIES + 1):
+        last = attempt == EXPORT_PART_RETRIES
+        headers = part_headers(url)
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        status = "error"
+        received = 0
+        start = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers, timeout=timeout) as response:
+                status = response.status
+                if status not in RETRY_STATUSES or last:
+                    response.raise_for_status()
+                    skip = offset if status != 206 else 0
+                    async for chunk in response.content.iter_chunked(EXPORT_CHUNK_SIZE):
+                        received += len(chunk)
+                        if skip:
+                            chunk, skip = chunk[skip:], max(0, skip - len(chunk))
+                            if not chunk:
+                                continue
+                        offset += len(chunk)
+                        await queue.put(chunk)
+                        # Only once queued: a put cancelled while waiting holds nothing
+                        EXPORT_BUFFERED.inc(len(chunk))
+                    return
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+            if last:
+                raise
+            logger.info("Resuming export part %s at byte %d after %s", endpoint, offset, type(e).__name__)
+        finally:
+            UPSTREAM_REQUESTS.inc(service="hcdp", endpoint=endpoint, status=status)
+            UPSTREAM_LATENCY.observe(time.perf_counter() - start, service="hcdp", endpoint=endpoint)
+            UPSTREAM_BYTES.observe(received, service="hcdp", endpoint=endpoint)
+        UPSTREAM_RETRIES.inc(service="hcdp", endpoint=endpoint)
+        await asyncio.sleep(random.uniform(0, HTTP_RETRY_BACKOFF * 2 ** attempt))
+
+
+async def _fill(url: str, queue: asyncio.Queue):
+    # Ends the part with None, or with the error that stopped it
+    try:
+        await download_part(url, queue)
+        await queue.put(None)
+    except Exception as e:
+        await queue.put(e)
+
+
+async def stream_parts(links: list[str], window: int = EXPORT_WINDOW):
+    """
+    Yields the bytes of the parts in order while up to `window` of them
+    download concurrently, each buffering at most EXPORT_PART_BUFFER bytes
+    ahead of the consumer.
+
+    Raises:
+        aiohttp.ClientError, asyncio.TimeoutError: If a part can't be downloaded.
+    """
+    links = iter(links)
+    pending = collections.deque()
+
+    def start_next():
+        link = next(links, None)
+        if link is not None:
+            queue = asyncio.Queue(maxsize=max(1, EXPORT_PART_BUFFER // EXPORT_CHUNK_SIZE))
+            pending.append((asyncio.create_task(_fill(link, queue)), queue))
+
+    for _ in range(max(1, window)):
+        start_next()
+    try:
+        while pending:
+            _, queue = pending[0]
+            while (chunk := await queue.get()) is not None:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                EXPORT_BUFFERED.dec(len(chunk))
+                yield chunk
+            pending.popleft()
+            start_next()
+    finally:
+        for task, queue in pending:
+            task.cancel()
+            while not queue.empty():
+                chunk = queue.get_nowait()
+                if isinstance(chunk, bytes):
+                    EXPORT_BUFFERED.dec(len(chunk))
+
+
+async def export_links(email: str, data: list[dict]) -> list[str]:
+    """
+    Has HCDP generate the zip of `data` split in parts.
+
+    Returns:
+        list[str]: The links of the ordered parts.
+    """
+    with stage("export_links"):
+        links = await post_genzip_instant_splitlink(email, data)
+    if not isinstance(links, list) or not all(isinstance(link, str) for link in links):
+        raise aiohttp.ClientPayloadError(f"Unexpected /genzip/instant/splitlink response: {str(links)[:200]}")
+    logger.info("Exporting %d parts", len(links))
+    return links
@@ -0,0 +1,213 @@
+import datetime
+import os
+import re
+
+from dotenv import load_dotenv
+
+from .geocode import GAZETTEER, normalize_place
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Questions scoring at least this much skip the LLM extraction call; above 1 disables the fast path
+FAST_EXTRACT_CONFIDENCE = float(os.getenv("FAST_EXTRACT_CONFIDENCE", "0.8"))
+
+# Explicit word forms: open-ended stems would take "rainbow" or "hotel" for climate questions
+DATATYPES = [
+    ("rainfall", r"rain(?:fall|s|y|ed|ing|ier|iest)?|precip(?:itation)?|wet(?:ter|test)?|drought|dry|drier|driest|showers?"),
+    ("temperature", r"temp(?:erature)?s?|hot(?:ter|test)?|heat|warm(?:er|est|th)?|cold(?:er|est)?|cool(?:er|est)?|degrees?"),
+]
+AGGREGATIONS = [
+    ("max", r"max(?:imum|ima)?|highest|hottest|warmest|highs?"),
+    ("min", r"min(?:imum|ima)?|lowest|coldest|coolest|lows?"),
+    ("mean", r"mean|average|avg"),
+]
+PERIODS = [
+    ("day", r"daily|per day|each day|every day|day by day"),
+    ("month", r"monthly|per month|each month|every month"),
+]
+# Phrasing that asks for data to look at rather than an explanation
+DATA_INTENT = r"show|plot|graph|chart|trend|how much|how many|what was|what were|history|historical|data|compare|over|average|total"
+# Phrasing that asks for an explanation the LLM should handle
+EXPLANATION = r"why|explain\w*|cause[sd]?|how does|how do|tell me about|fun fact|should i|what does|mean by"
+COMPARISON = r"compare|comparison|versus|vs\.?|difference between"
+# HCDP only has observations; forecasts need the LLM (and search)
+FORECAST = r"tomorrow|tonight|forecast|next (?:week|month|year)|will it|going to"
+
+MONTHS = {
+    name: number
+    for number, names in enumerate(
+        [("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"),
+         ("may",), ("jun", "june"), ("jul", "july"), ("aug", "august"),
+         ("sep", "sept", "september"), ("oct", "october"), ("nov", "november"), ("dec", "december")],
+        start=1,
+    )
+    for name in names
+}
+_MONTH = "|".join(sorted(MONTHS, key=len, reverse=True))
+_UNITS = {"day": 1, "days": 1, "week": 7, "weeks": 7, "month": 30.44, "months": 30.44, "year": 365.25, "years": 365.25, "decade": 3652.5, "decades": 3652.5}
+_NUMBERS = {"a": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "twenty": 20, "thirty": 30}
+
+
+def _matches(patterns, text):
+    """
+    Returns the labels of every (label, regex) pair found in `text`.
+    """
+    return [label for label, pattern in patterns if re.search(rf"\b(?:{pattern})\b", text)]
+
+
+def _first(patterns, text):
+    """
+    Returns the label of the first (label, regex) pair found in `text`.
+    """
+    labels = _matches(patterns, text)
+    return labels[0] if labels else None
+
+
+def _month_end(year: int, month: int) -> datetime.date:
+    return datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+
+
+def parse_date_range(text: str, today: datetime.date) -> tuple[str, str] | None:
+    """
+    Parses the time range of a question, e.g. "last 5 years", "since 2010",
+    "from 2000 to 2010", "March 2020" or "in 2015".
+
+    Returns:
+        tuple[str, str] | None: ISO-8601 start and end dates, or None if no range was found.
+    """
+    match = re.search(rf"\b(?:last|past|previous)\s+(\d+|{'|'.join(_NUMBERS)})?\s*(days?|weeks?|months?|years?|decades?)\b", text)
+    if match:
+        count, unit = match.groups()
+        if count is None and unit in ("year", "month") and text[match.start():].startswith("last"):
+            # "last year" / "last month" mean the previous calendar period
+            if unit == "year":
+                return f"{today.year - 1}-01-01", f"{today.year - 1}-12-31"
+            previous = today.replace(day=1) - datetime.timedelta(days=1)
+            return previous.replace(day=1).isoformat(), previous.isoformat()
+        count = int(count) if count and count.isdigit() else _NUMBERS.get(count, 1)
+        start = today - datetime.timedelta(days=round(count * _UNITS[unit]))
+        return start.isoformat(), today.isoformat()
+
+    if re.search(r"\bthis year\b", text):
+        return f"{today.year}-01-01", today.isoformat()
+
+    match = re.search(rf"\b({_MONTH})\.?\s+(\d{{4}})\b", text)
+    if match:
+        month, year = MONTHS[match.group(1)], int(match.group(2))
+        return datetime.date(year, month, 1).isoformat(), _month_end(year, month).isoformat()
+
+    match = re.search(r"\b(?:from|between)?\s*((?:19|20)\d{2})\s*(?:to|and|until|through|thru)?\s*((?:19|20)\d{2})\b", text)
+    if match:
+        first, last = sorted(int(year) for year in match.groups())
+        return f"{first}-01-01", f"{last}-12-31"
+
+    match = re.search(r"\b(?:since|after|from)\s+((?:19|20)\d{2})\b", text)
+    if match:
+        return f"{match.group(1)}-01-01", today.isoformat()
+
+    # Decades, e.g. "in the 1990s" or "since the 2000s"
+    match = re.search(r"\b(since|after|from)?\s*(?:the\s+)?((?:19|20)\d)0'?s\b", text)
+    if match:
+        since, decade = match.group(1), int(match.group(2)) * 10
+        end = today.isoformat() if since else min(f"{decade + 9}-12-31", today.isoformat())
+        return f"{decade}-01-01", end
+
+    match = re.search(r"\b(?:before|until)\s+((?:19|20)\d{2})\b", text)
+    if match:
+        return "1990-01-01", f"{int(match.group(1)) - 1}-12-31"
+
+    match = re.search(r"\b((?:19|20)\d{2})\b", text)
+    if match:
+        return f"{match.group(1)}-01-01", f"{match.group(1)}-12-31"
+    return None
+
+
+def _locations(text: str) -> list[dict]:
+    """
+    Finds the places a question is about, dropping qualifiers such as the
+    island in "Lahaina, Maui" or the state in "Hilo, Hawaii".
+    """
+    found = GAZETTEER.find_in_text(text)
+    specific = [entry for entry in found if entry["kind"] not in ("state", "island", "county")]
+    counties = {entry["county"] for entry in specific}
+    return [
+        entry for entry in found
+        if entry in specific
+        or (entry["kind"] != "state" and entry["county"] not in counties)
+        or (entry["kind"] == "state" and len(found) == 1)
+    ]
+
+
+def extract_parameters(prompt: str, today: datetime.date | None = None) -> tuple[dict, float]:
+    """
+    Extracts get_api_parameters arguments from a question without calling the LLM.
+
+    Recognizes the variable, temperature aggregation, period, a place from the
+    gazetteer and common date expressions, and scores how sure it is that the
+    question is a plain data request it fully understood.
+
+    Args:
+        prompt (str): The user question.
+        today (datetime.date | None): Reference date for relative expressions.
+
+    Returns:
+        tuple[dict, float]: The function call arguments and a confidence in [0, 1].
+    """
+    today = today or datetime.date.today()
+    text = normalize_place(prompt)
+    args = {}
+    confidence = 0.0
+
+    datatype = _first(DATATYPES, text)
+    if datatype:
+        args["datatype"] = datatype
+        confidence += 0.5
+        if datatype == "temperature":
+            args["aggregation"] = _first(AGGREGATIONS, text) or "mean"
+
+    period = _first(PERIODS, text)
+    if period:
+        args["period"] = period
+
+    locations = _locations(prompt)
+    if locations:
+        entry = locations[0]
+        args["location"] = entry["name"]
+        args["is_region"] = entry["kind"] in ("state", "island", "county", "district")
+        confidence += 0.3
+
+    date_range = parse_date_range(text, today)
+    if date_range:
+        args["time_start"], args["time_end"] = date_range
+        confidence += 0.1
+    data_intent = re.search(rf"\b(?:{DATA_INTENT})\b", text) is not None
+    if data_intent:
+        confidence += 0.1
+    # A variable word and a place alone ("cool places to hike on Maui") don't make a data request
+    if not (data_intent or date_range):
+        confidence = min(confidence, 0.5)
+
+    if re.search(rf"\b(?:{EXPLANATION}|{FORECAST})\b", text):
+        confidence -= 0.4
+    # Comparisons, several places or several variables need more than one series; leave them to the LLM
+    if asks_for_several_series(prompt, locations):
+        confidence = min(confidence, 0.5)
+    return args, round(max(0.0, min(1.0, confidence)), 2)
+
+
+def asks_for_several_series(prompt: str, locations: list[dict] | None = None) -> bool:
+    """
+    Tells whether a question needs more than one series: it names several
+    places or variables, both min and max, or asks for a comparison.
+    `locations` saves finding the places again when they are known.
+    """
+    text = normalize_place(prompt)
+    if locations is None:
+        locations = _locations(prompt)
+    return (
+        len(locations) > 1
+        or len(_matches(DATATYPES, text)) > 1
+        or len(_matches(AGGREGATIONS[:2], text)) > 1
+        or re.search(rf"\b(?:{COMPARISON})\b", text) is not None
+    )
@@ -0,0 +1,232 @@
+import difflib
+import json
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+
+from dotenv import load_dotenv
+
+from .cache import LRUCache
+
+# Load environment variables from .env file
+load_dotenv()
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(__file__), "data", "hawaii_places.json")
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", ".cache/geocode.sqlite3")
+GEOCODE_LRU_SIZE = int(os.getenv("GEOCODE_LRU_SIZE", "4096"))
+GEOCODE_FUZZY_CUTOFF = float(os.getenv("GEOCODE_FUZZY_CUTOFF", "0.85"))
+
+# Trailing qualifiers users add to place names that don't help the lookup
+_SUFFIXES = ("hawaii", "hi", "usa", "us", "united states", "state of hawaii")
+# Trailing words that don't change which place a name means ("Hilo town")
+_GENERIC_WORDS = {"town", "city", "village", "area", "downtown"}
+_REGION_KINDS = ("state", "island", "county")
+_OKINA = str.maketrans("", "", "ʻʼ‘’'`")
+
+
+def _ascii(text: str) -> str:
+    """
+    Strips the ʻokina and kahakō so "Kauaʻi" and "Kauai" compare equal.
+    """
+    text = unicodedata.normalize("NFKD", text.translate(_OKINA))
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def normalize_place(name: str) -> str:
+    """
+    Normalizes a place name for lookup: ASCII, lowercase, single-spaced words.
+    """
+    return re.sub(r"[^a-z0-9]+", " ", _ascii(name).lower()).strip()
+
+
+def county_from_display_name(display_name: str) -> str | None:
+    """
+    Extracts the county from a Nominatim display name,
+    e.g. "Hilo, Hawaiʻi County, Hawaii, United States" -> "Hawaii".
+    """
+    parts = [part.strip() for part in display_name.split(",")]
+    for part in parts:
+        if part.endswith(" County") or part.startswith("City and County of "):
+            return _ascii(part.replace("City and County of ", "").replace(" County", ""))
+    return _ascii(parts[1]) if len(parts) > 1 else None
+
+
+class Gazetteer:
+    """
+    Local index of Hawaii place names with their coordinates and county.
+
+    Every name and alias is indexed under its normalized form, so exact matches
+    are a dict lookup; anything else falls back to difflib fuzzy matching.
+    """
+
+    def __init__(self, entries: list[dict]):
+        self.entries = entries
+        self._index = {}
+        for entry in entries:
+            for name in [entry["name"], *entry.get("aliases", [])]:
+                self._index.setdefault(normalize_place(name), entry)
+        self._names = list(self._index)
+        self._regions = {key for key, entry in self._index.items() if entry["kind"] in _REGION_KINDS}
+        self._max_words = max(len(name.split()) for name in self._names)
+
+    @classmethod
+    def from_file(cls, path: str) -> "Gazetteer":
+        with open(path, "r") as file:
+            return cls(json.load(file))
+
+    def _candidates(self, name: str):
+        """
+        Yields progressively looser spellings of `name` to try against the index.
+        """
+        for part in [name, *name.split(",")[:1]]:
+            key = normalize_place(part)
+            if not key:
+                continue
+            yield key
+            if key.startswith("the "):
+                key = key[4:]
+                yield key
+            for suffix in _SUFFIXES:
+                if key.endswith(" " + suffix):
+                    yield key[: -len(suffix) - 1]
+
+    def lookup(self, name: str) -> dict | None:
+        """
+        Returns the gazetteer entry best matching `name`, or None.
+        """
+        candidates = list(self._candidates(name))
+        for key in candidates:
+            if key in self._index:
+                return self._index[key]
+        # "Lahaina Maui", "Hilo town": a place followed by its island or county
+        # or a generic word. Other names starting with a known one ("Waimea
+        # Bay", "Hawaii Volcanoes") may be elsewhere, so they go to Nominatim
+        for key in candidates:
+            words = key.split()
+            for size in range(len(words) - 1, 0, -1):
+                entry = self._index.get(" ".join(words[:size]))
+                rest = words[size:]
+                if entry is not None and entry["kind"] not in _REGION_KINDS and (
+                    " ".join(rest) in self._regions or all(word in _GENERIC_WORDS for word in rest)
+                ):
+                    return entry
+        for key in candidates:
+            matches = difflib.get_close_matches(key, self._names, n=1, cutoff=GEOCODE_FUZZY_CUTOFF)
+            if matches:
+                return self._index[matches[0]]
+        return None
+
+    def find_in_text(self, text: str) -> list[dict]:
+        """
+        Finds every distinct gazetteer place mentioned in free text, preferring
+        the longest name at each position ("Hawaii Kai" over "Hawaii").
+
+        Returns:
+            list[dict]: Matching entries in order of appearance.
+        """
+        words = normalize_place(text).split()
+        found = []
+        i = 0
+        while i < len(words):
+            for size in range(min(self._max_words, len(words) - i), 0, -1):
+                entry = self._index.get(" ".join(words[i:i + size]))
+                if entry is not None:
+                    if entry not in found:
+                        found.append(entry)
+                    i += size
+                    break
+            else:
+                i += 1
+        return found
+
+
+def gazetteer_result(entry: dict) -> dict:
+    """
+    Formats a gazetteer entry like a Nominatim search result, plus a county.
+    """
+    county = entry.get("county")
+    if entry["kind"] in ("island", "county", "state") or county is None:
+        display_name = f"{entry['name']}, Hawaii, United States"
+    else:
+        display_name = f"{entry['name']}, {county} County, Hawaii, United States"
+    return {
+        "lat": entry["lat"],
+        "lon": entry["lng"],
+        "display_name": display_name,
+        "county": county,
+        "kind": entry["kind"],
+        "source": "gazetteer",
+    }
+
+
+class GeocodeStore:
+    """
+    On-disk SQLite tier for locations that had to be resolved remotely.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode (query TEXT PRIMARY KEY, results TEXT NOT NULL, created REAL NOT NULL)"
+            )
+        return self._conn
+
+    def get(self, query: str) -> list[dict] | None:
+        row = self._connect().execute("SELECT results FROM geocode WHERE query = ?", (query,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, query: str, results: list[dict]):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO geocode (query, results, created) VALUES (?, ?, ?)",
+            (query, json.dumps(results), time.time()),
+        )
+        conn.commit()
+
+
+GAZETTEER = Gazetteer.from_file(GAZETTEER_PATH)
+location_cache = LRUCache(maxsize=GEOCODE_LRU_SIZE)
+location_store = GeocodeStore(GEOCODE_CACHE_PATH)
+
+
+def lookup_location(location: str) -> list[dict] | None:
+    """
+    Resolves a location without touching the network.
+
+    Tries the in-memory LRU, then the bundled gazetteer, then the on-disk store
+    of earlier remote lookups.
+
+    Returns:
+        list[dict] | None: Nominatim-style results, or None if the location has
+                           to be resolved remotely.
+    """
+    key = normalize_place(location)
+    results = location_cache.get(key)
+    if results is not None:
+        return results
+    entry = GAZETTEER.lookup(location)
+    results = [gazetteer_result(entry)] if entry else location_store.get(key)
+    if results is not None:
+        location_cache.set(key, results)
+    return results
+
+
+def remember_location(location: str, results: list[dict]):
+    """
+    Stores remotely resolved results in the memory and disk tiers.
+    """
+    for result in results:
+        result.setdefault("county", county_from_display_name(result.get("display_name", "")))
+    key = normalize_place(location)
+    location_cache.set(key, results)
+    if results:
+        location_store.put(key, results)
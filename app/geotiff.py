@@ -0,0 +1,171 @@
+import struct
+import zlib
+
+import numpy as np
+
+# Minimal single-band GeoTIFF reader for HCDP data maps: classic TIFF, strips
+# or tiles, no/LZW/Deflate compression, horizontal and floating point predictors.
+
+_TYPES = {1: "B", 2: "s", 3: "H", 4: "I", 5: "II", 6: "b", 7: "B", 8: "h", 9: "i", 10: "ii", 11: "f", 12: "d", 16: "Q"}
+_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 16: 8}
+_DTYPES = {(1, 8): "u1", (1, 16): "u2", (1, 32): "u4", (2, 8): "i1", (2, 16): "i2", (2, 32): "i4", (3, 32): "f4", (3, 64): "f8"}
+
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+SAMPLE_FORMAT = 339
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+GDAL_NODATA = 42113
+
+
+def _read_tags(data: bytes) -> tuple[str, dict]:
+    """
+    Reads the tags of the first image file directory.
+    """
+    order = {b"II": "<", b"MM": ">"}.get(data[:2])
+    if order is None:
+        raise ValueError("Not a TIFF file")
+    magic, offset = struct.unpack(order + "HI", data[2:8])
+    if magic != 42:
+        raise ValueError("Only classic TIFF files are supported")
+    (count,) = struct.unpack(order + "H", data[offset:offset + 2])
+    tags = {}
+    for i in range(count):
+        entry = offset + 2 + 12 * i
+        tag, kind, n = struct.unpack(order + "HHI", data[entry:entry + 8])
+        if kind not in _TYPES:
+            continue
+        size = _SIZES[kind] * n
+        start = entry + 8 if size <= 4 else struct.unpack(order + "I", data[entry + 8:entry + 12])[0]
+        raw = data[start:start + size]
+        if kind == 2:
+            tags[tag] = raw.rstrip(b"\0").decode("ascii", "replace")
+        else:
+            fmt = _TYPES[kind] * n
+            values = struct.unpack(order + fmt, raw)
+            if kind in (5, 10):
+                values = tuple(values[j] / values[j + 1] if values[j + 1] else 0.0 for j in range(0, len(values), 2))
+            tags[tag] = values
+    return order, tags
+
+
+def lzw_decode(data: bytes) -> bytes:
+    """
+    Decodes TIFF LZW (MSB-first codes of 9 to 12 bits, with early change).
+    """
+    out = bytearray()
+    table = [bytes([i]) for i in range(256)] + [b"", b""]
+    nbits, mask = 9, 511
+    buffer = bits = 0
+    previous = None
+    for byte in data:
+        buffer = ((buffer << 8) | byte) & 0xFFFFFF
+        bits += 8
+        if bits < nbits:
+            continue
+        bits -= nbits
+        code = (buffer >> bits) & mask
+        if code == 257:
+            break
+        if code == 256:
+            del table[258:]
+            nbits, mask = 9, 511
+            previous = None
+            continue
+        if previous is None:
+            entry = table[code]
+        elif code < len(table):
+            entry = table[code]
+            table.append(previous + entry[:1])
+        else:
+            entry = previous + previous[:1]
+            table.append(entry)
+        out += entry
+        previous = entry
+        if len(table) >= mask and nbits < 12:
+            nbits += 1
+            mask = (1 << nbits) - 1
+    return bytes(out)
+
+
+def _decompress(segment: bytes, compression: int) -> bytes:
+    if compression == 1:
+        return segment
+    if compression in (8, 32946):
+        return zlib.decompress(segment)
+    if compression == 5:
+        return lzw_decode(segment)
+    raise ValueError(f"Unsupported TIFF compression {compression}")
+
+
+def _decode_segment(segment: bytes, shape: tuple[int, int], dtype: np.dtype, predictor: int) -> np.ndarray:
+    """
+    Converts one decompressed strip or tile to a (rows, cols) array, undoing the predictor.
+    """
+    rows, cols = shape
+    if predictor == 3:
+        # Floating point predictor: byte-wise differences over bytes split by significance
+        raw = np.frombuffer(segment, dtype=np.uint8)[: rows * cols * dtype.itemsize].reshape(rows, -1)
+        raw = np.cumsum(raw, axis=1, dtype=np.uint8)
+        raw = raw.reshape(rows, dtype.itemsize, cols).transpose(0, 2, 1)
+        return np.ascontiguousarray(raw).view(dtype.newbyteorder(">")).reshape(rows, cols)
+    array = np.frombuffer(segment, dtype=dtype)[: rows * cols].reshape(rows, cols)
+    if predictor == 2:
+        array = np.cumsum(array, axis=1, dtype=dtype)
+    return array
+
+
+def read_geotiff(data: bytes) -> tuple[np.ndarray, dict]:
+    """
+    Decodes the first band of a GeoTIFF.
+
+    Returns:
+        tuple[np.ndarray, dict]: The (rows, cols) float32 array with nodata as NaN,
+                                 and the georeferencing: xmin, ymax, xres, yres.
+    """
+    order, tags = _read_tags(data)
+    width, height = tags[IMAGE_WIDTH][0], tags[IMAGE_LENGTH][0]
+    bits = tags.get(BITS_PER_SAMPLE, (1,))[0]
+    fmt = tags.get(SAMPLE_FORMAT, (1,))[0]
+    if tags.get(SAMPLES_PER_PIXEL, (1,))[0] != 1:
+        raise ValueError("Only single-band rasters are supported")
+    dtype = np.dtype(_DTYPES[(fmt, bits)]).newbyteorder(order)
+    compression = tags.get(COMPRESSION, (1,))[0]
+    predictor = tags.get(PREDICTOR, (1,))[0]
+
+    image = np.empty((height, width), dtype=dtype.newbyteorder("="))
+    if TILE_OFFSETS in tags:
+        tile_w, tile_h = tags[TILE_WIDTH][0], tags[TILE_LENGTH][0]
+        across = -(-width // tile_w)
+        for i, (offset, size) in enumerate(zip(tags[TILE_OFFSETS], tags[TILE_BYTE_COUNTS])):
+            top, left = (i // across) * tile_h, (i % across) * tile_w
+            tile = _decode_segment(_decompress(data[offset:offset + size], compression), (tile_h, tile_w), dtype, predictor)
+            image[top:top + tile_h, left:left + tile_w] = tile[: height - top, : width - left]
+    else:
+        rows_per_strip = tags.get(ROWS_PER_STRIP, (height,))[0]
+        for i, (offset, size) in enumerate(zip(tags[STRIP_OFFSETS], tags[STRIP_BYTE_COUNTS])):
+            top = i * rows_per_strip
+            rows = min(rows_per_strip, height - top)
+            image[top:top + rows] = _decode_segment(_decompress(data[offset:offset + size], compression), (rows, width), dtype, predictor)
+
+    array = image.astype(np.float32)
+    nodata = tags.get(GDAL_NODATA)
+    if nodata:
+        try:
+            array[array == np.float32(float(nodata))] = np.nan
+        except ValueError:
+            pass
+    xres, yres = tags.get(MODEL_PIXEL_SCALE, (1.0, 1.0))[:2]
+    i, j, _, x, y, _ = tags.get(MODEL_TIEPOINT, (0, 0, 0, 0.0, 0.0, 0.0))
+    return array, {"xmin": x - i * xres, "ymax": y + j * yres, "xres": xres, "yres": yres}
@@ -2,36 +2,332 @@ import datetime
 import aiohttp
 import asyncio
 from dotenv import load_dotenv
+import json
+import logging
 import os
+import random
+import time
+from urllib.parse import urlsplit
+
+from .geocode import lookup_location, remember_location
+from .metrics import (
+    CIRCUIT_OPEN,
+    UPSTREAM_BYTES,
+    UPSTREAM_COALESCED,
+    UPSTREAM_IN_FLIGHT,
+    UPSTREAM_LATENCY,
+    UPSTREAM_REQUESTS,
+    UPSTREAM_RETRIES,
+    UPSTREAM_STALE,
+    stage,
+)
+from .rasters import RASTER_BACKFILL_MAPS, RASTER_DOWNLOAD_CONCURRENCY, cube_name, period_dates, raster_cache
+from .regions import region_aggregate, region_for_location
+from .timeseries import (
+    TIMESERIES_RECENT_TTL,
+    is_recent,
+    normalize_date,
+    series_key,
+    snap_to_grid,
+    timeseries_cache,
+    timeseries_key,
+    timeseries_store,
+    timeseries_ttl,
+)
 
 # Load environment variables from .env file
 load_dotenv()
 
-BASE_URL = "https://api.hcdp.ikewai.org"
+logger = logging.getLogger(__name__)
+
+BASE_URL = os.getenv("HCDP_BASE_URL", "https://api.hcdp.ikewai.org")
 HEADERS = {
     "Authorization": f"Bearer {os.getenv('OAUTH_TOKEN')}"  # Read token from .env file
 }
 
-async def fetch(session, url, method="GET", params=None, json=None):
+# Connection pool shared by every HCDP and Nominatim request
+POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", "120"))
+
+def parse_timeouts(value: str) -> dict:
+    """
+    Parses "endpoint=seconds" pairs separated by commas, e.g. "/raster/timeseries=30,/stations=30".
+    """
+    timeouts = {}
+    for pair in value.split(","):
+        endpoint, _, seconds = pair.partition("=")
+        if endpoint.strip() and seconds.strip():
+            timeouts[endpoint.strip()] = float(seconds)
+    return timeouts
+
+# Total timeout of each endpoint label; endpoints not listed use HTTP_TOTAL_TIMEOUT
+ENDPOINT_TIMEOUTS = parse_timeouts(os.getenv(
+    "HTTP_ENDPOINT_TIMEOUTS", "/raster/timeseries=30,/stations=30,/production/list=15,/search=10"
+))
+# Extra attempts of idempotent GETs after connection errors, timeouts and 429/5xx responses
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+# Base of the exponential backoff between attempts; each wait is drawn uniformly below it
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.5"))
+# Consecutive failures that open a service's circuit; 0 disables the breaker
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "5"))
+# Seconds an open circuit fails fast before letting a probe request through
+CIRCUIT_RESET = float(os.getenv("CIRCUIT_RESET", "30"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session: aiohttp.ClientSession | None = None
+# Identical GETs awaiting a response, so concurrent callers share one request
+_inflight: dict[tuple, asyncio.Future] = {}
+
+NOMINATIM_URL = os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org")
+# Nominatim allows at most one request per second
+NOMINATIM_MIN_INTERVAL = float(os.getenv("NOMINATIM_MIN_INTERVAL", "1.0"))
+_nominatim_lock = asyncio.Lock()
+_nominatim_last_request = 0.0
+
+async def open_session() -> aiohttp.ClientSession:
+    """
+    Returns the app-lifetime HTTP session, creating it on first use.
+
+    The session owns a pooled connector, so consecutive requests to the same
+    host reuse warm TCP/TLS connections instead of handshaking every time.
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=POOL_LIMIT,
+            limit_per_host=POOL_LIMIT_PER_HOST,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=DNS_CACHE_TTL,
+        )
+        timeout = aiohttp.ClientTimeout(total=TOTAL_TIMEOUT, connect=CONNECT_TIMEOUT)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+async def close_session():
+    """
+    Closes the shared HTTP session and its connection pool.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+class UpstreamUnavailable(aiohttp.ClientError):
+    """
+    Raised without sending a request while the circuit of a service is open.
+    """
+
+def upstream_status(error: BaseException) -> int | None:
+    """
+    Maps an upstream failure to the status the API answers with: 503 while the
+    service's circuit is open, 504 after a timeout and 502 for any other
+    upstream error. Returns None for errors that didn't come from upstream.
+    """
+    if isinstance(error, UpstreamUnavailable):
+        return 503
+    if isinstance(error, asyncio.TimeoutError):
+        return 504
+    if isinstance(error, aiohttp.ClientError):
+        return 502
+    return None
+
+class CircuitBreaker:
+    """
+    Fails fast while an upstream service is down.
+
+    After `failures` consecutive failed requests the circuit opens and
+    requests raise UpstreamUnavailable without being sent. Once `reset`
+    seconds have passed a single probe request goes through: its success
+    closes the circuit, its failure keeps it open for another `reset` seconds.
+    Only connection errors, timeouts and 429/5xx responses count as failures.
+    """
+
+    def __init__(self, service: str, failures: int = CIRCUIT_FAILURES, reset: float = CIRCUIT_RESET):
+        self.service = service
+        self.failures = failures
+        self.reset = reset
+        self.count = 0
+        self.opened = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened >= self.reset else "open"
+
+    def allow(self) -> bool:
+        """
+        Tells whether a request may be sent now.
+        """
+        if self.failures <= 0 or self.opened is None:
+            return True
+        if time.monotonic() - self.opened >= self.reset and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record(self, ok: bool | None):
+        """
+        Records the outcome of a request; None for one that was cancelled.
+        """
+        if ok:
+            if self.opened is not None:
+                logger.info("Circuit of %s closed", self.service)
+            self.count = 0
+            self.opened = None
+        elif ok is not None:
+            self.count += 1
+            if self.failures > 0 and self.count >= self.failures:
+                if self.opened is None:
+                    logger.warning("Circuit of %s opened after %d failures", self.service, self.count)
+                self.opened = time.monotonic()
+        self._probing = False
+        CIRCUIT_OPEN.set(int(self.opened is not None), service=self.service)
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+def circuit_breaker(service: str) -> CircuitBreaker:
+    if service not in _breakers:
+        _breakers[service] = CircuitBreaker(service)
+    return _breakers[service]
+
+def endpoint_label(url):
+    """
+    Returns the metrics label of an upstream URL, e.g. "/raster/timeseries".
     """
-    Helper function to make asynchronous HTTP requests.
+    path = urlsplit(url).path
+    if path.startswith("/files/explore/"):
+        return "/files/explore"
+    return path or "/"
+
+async def _send(url, method, params, json, headers, service, raise_for_status, decode_json, retry):
     """
-    async with session.request(method, url, params=params, json=json) as response:
-        return await response.json()
+    Sends one request through the service's circuit breaker, with its endpoint's timeout.
+
+    Returns:
+        tuple[object, bool]: The decoded body, and whether the attempt failed in a way worth retrying.
+    """
+    endpoint = endpoint_label(url)
+    breaker = circuit_breaker(service)
+    if not breaker.allow():
+        raise UpstreamUnavailable(f"{service} is unavailable, retrying in at most {breaker.reset:.0f}s")
+    session = await open_session()
+    timeout = aiohttp.ClientTimeout(total=ENDPOINT_TIMEOUTS.get(endpoint, TOTAL_TIMEOUT), connect=CONNECT_TIMEOUT)
+    status = "error"
+    ok = None
+    start = time.perf_counter()
+    try:
+        with UPSTREAM_IN_FLIGHT.track(service=service):
+            async with session.request(method, url, params=params, json=json, headers=headers, timeout=timeout) as response:
+                status = response.status
+                body = await response.read()
+                UPSTREAM_BYTES.observe(len(body), service=service, endpoint=endpoint)
+                ok = status not in RETRY_STATUSES
+                if not ok and retry:
+                    return None, True
+                if raise_for_status:
+                    response.raise_for_status()
+                return (await response.json() if decode_json else body), False
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+        ok = False
+        raise
+    finally:
+        breaker.record(ok)
+        UPSTREAM_REQUESTS.inc(service=service, endpoint=endpoint, status=status)
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, service=service, endpoint=endpoint)
+
+async def _attempts(url, method, params, json, headers, service, raise_for_status, decode_json, retries):
+    """
+    Sends a request, retrying GETs up to `retries` times with jittered exponential backoff.
+    """
+    retries = retries if method == "GET" else 0
+    for attempt in range(retries + 1):
+        last = attempt == retries
+        try:
+            body, failed = await _send(url, method, params, json, headers, service, raise_for_status, decode_json, retry=not last)
+            if not failed:
+                return body
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if last:
+                raise
+            logger.info("Retrying %s after %s", endpoint_label(url), type(e).__name__)
+        UPSTREAM_RETRIES.inc(service=service, endpoint=endpoint_label(url))
+        await asyncio.sleep(random.uniform(0, HTTP_RETRY_BACKOFF * 2 ** attempt))
+
+def _retrieve(future: asyncio.Future):
+    # Keeps a failure nobody awaits any more from being logged as never retrieved
+    if not future.cancelled():
+        future.exception()
 
-async def get_raster(date, datatype, extent, return_empty_not_found=True):
+async def _request(url, method, params, json, headers, service, raise_for_status, decode_json, retries):
+    if method != "GET":
+        return await _attempts(url, method, params, json, headers, service, raise_for_status, decode_json, retries)
+    key = (service, url, tuple(sorted((k, str(v)) for k, v in (params or {}).items())), raise_for_status, decode_json)
+    future = _inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(
+            _attempts(url, method, params, json, headers, service, raise_for_status, decode_json, retries)
+        )
+        _inflight[key] = future
+        future.add_done_callback(lambda _: _inflight.pop(key, None))
+        future.add_done_callback(_retrieve)
+    else:
+        UPSTREAM_COALESCED.inc(service=service, endpoint=endpoint_label(url))
+    # A caller giving up doesn't cancel the request for the others
+    return await asyncio.shield(future)
+
+async def request_json(
+    url, method="GET", params=None, json=None, headers=HEADERS, service="hcdp", raise_for_status=False, retries=HTTP_RETRIES
+):
+    """
+    Makes a request over the shared session and decodes its JSON body,
+    recording upstream status, latency, size and in-flight metrics.
+
+    Identical GETs in flight at the same time share one request (and one
+    decoded body, which callers must not modify), and GETs are retried after
+    connection errors, timeouts and 429/5xx responses. Every request goes
+    through the circuit breaker of its service.
+
+    Raises:
+        UpstreamUnavailable: If the service's circuit is open.
+    """
+    return await _request(url, method, params, json, headers, service, raise_for_status, True, retries)
+
+async def request_bytes(url, method="GET", params=None, json=None, headers=HEADERS, service="hcdp", retries=HTTP_RETRIES):
+    """
+    Like request_json, for binary bodies such as GeoTIFFs and zip files.
+    Raises aiohttp.ClientResponseError on an error status.
+    """
+    return await _request(url, method, params, json, headers, service, True, False, retries)
+
+async def fetch(url, method="GET", params=None, json=None, headers=HEADERS):
+    """
+    Helper function to make asynchronous HTTP requests over the shared session.
+    """
+    return await request_json(url, method=method, params=params, json=json, headers=headers)
+
+async def get_raster(date, datatype, extent, return_empty_not_found=True, **dataset_params):
     """
     Fetches a raster file from the HCDP API.
+
+    Returns:
+        bytes: The GeoTIFF file.
     """
     url = f"{BASE_URL}/raster"
     params = {
         "date": date,
         "datatype": datatype,
         "extent": extent,
-        "returnEmptyNotFound": str(return_empty_not_found).lower()
+        "returnEmptyNotFound": str(return_empty_not_found).lower(),
+        **dataset_params
     }
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
-        return await fetch(session, url, params=params)
+    return await request_bytes(url, params=params)
 
 async def get_raster_timeseries(start, end, datatype, extent, **location_params):
     """
@@ -45,8 +341,7 @@ async def get_raster_timeseries(start, end, datatype, extent, **location_params)
         "extent": extent,
         **location_params
     }
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
-        return await fetch(session, url, params=params)
+    return await fetch(url, params=params)
 
 async def post_genzip_email(email, data, zip_name=None):
     """
@@ -59,20 +354,22 @@ async def post_genzip_email(email, data, zip_name=None):
     }
     if zip_name:
         payload["zipName"] = zip_name
-    async with aiohttp.ClientSession(headers={**HEADERS, "Content-Type": "application/json"}) as session:
-        return await fetch(session, url, method="POST", json=payload)
+    return await fetch(url, method="POST", json=payload)
 
 async def post_genzip_instant_content(email, data):
     """
     Requests a zip file and returns its content.
+
+    Returns:
+        bytes: The zip file. Use export.stream_parts for large exports
+               instead of holding the whole archive in memory.
     """
     url = f"{BASE_URL}/genzip/instant/content"
     payload = {
         "email": email,
         "data": data
     }
-    async with aiohttp.ClientSession(headers={**HEADERS, "Content-Type": "application/json"}) as session:
-        return await fetch(session, url, method="POST", json=payload)
+    return await request_bytes(url, method="POST", json=payload)
 
 async def post_genzip_instant_link(email, data, zip_name=None):
     """
@@ -85,8 +382,22 @@ async def post_genzip_instant_link(email, data, zip_name=None):
     }
     if zip_name:
         payload["zipName"] = zip_name
-    async with aiohttp.ClientSession(headers={**HEADERS, "Content-Type": "application/json"}) as session:
-        return await fetch(session, url, method="POST", json=payload)
+    return await fetch(url, method="POST", json=payload)
+
+async def post_genzip_instant_splitlink(email, data):
+    """
+    Requests a zip file and returns links to its parts.
+
+    Returns:
+        list[str]: Files API links of the ordered parts; concatenated, they
+                   make up the zip file.
+    """
+    url = f"{BASE_URL}/genzip/instant/splitlink"
+    payload = {
+        "email": email,
+        "data": data
+    }
+    return await request_json(url, method="POST", json=payload, raise_for_status=True)
 
 async def get_raw_list(date, station_id=None, location="hawaii"):
     """
@@ -98,29 +409,34 @@ async def get_raw_list(date, station_id=None, location="hawaii"):
         "station_id": station_id,
         "location": location
     }
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
-        return await fetch(session, url, params=params)
+    return await fetch(url, params=params)
 
 async def get_production_list(data):
     """
     Fetches a list of production data files.
+
+    Args:
+        data (list[dict]): File descriptions as in /genzip/email, e.g.
+            [{"datatype": "rainfall", "production": "new", "period": "month", "extent": "statewide",
+              "range": {"start": "2024-01", "end": "2024-01"}, "files": ["data_map"]}]
     """
     url = f"{BASE_URL}/production/list"
-    params = {"data": data}
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
-        return await fetch(session, url, params=params)
+    params = {"data": json.dumps(data)}
+    return await fetch(url, params=params)
 
 async def get_files_explore(path):
     """
     Explores files in a specific directory or retrieves a file.
     """
     url = f"{BASE_URL}/files/explore/{path}"
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
-        return await fetch(session, url)
+    return await fetch(url)
 
 async def get_files_retrieve_production(date, datatype, extent, file_type="data_map"):
     """
     Retrieves a production file.
+
+    Returns:
+        bytes: The file data.
     """
     url = f"{BASE_URL}/files/retrieve/production"
     params = {
@@ -129,8 +445,7 @@ async def get_files_retrieve_production(date, datatype, extent, file_type="data_
         "extent": extent,
         "file": file_type
     }
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
-        return await fetch(session, url, params=params)
+    return await request_bytes(url, params=params)
 
 async def get_stations(query, limit=10000, offset=0):
     """
@@ -142,20 +457,19 @@ async def get_stations(query, limit=10000, offset=0):
         "limit": limit,
         "offset": offset
     }
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
-        return await fetch(session, url, params=params)
+    return await fetch(url, params=params)
 
 async def get_mesonet_measurements(location="hawaii", **query_params):
     """
-    Fetches mesonet measurements.
+    Fetches one page of mesonet measurements.
+    Use mesonet.iter_mesonet_measurements for ranges that may exceed a page.
     """
     url = f"{BASE_URL}/mesonet/db/measurements"
     params = {
         "location": location,
         **query_params
     }
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
-        return await fetch(session, url, params=params)
+    return await fetch(url, params=params)
 
 async def get_mesonet_stations(location="hawaii", **query_params):
     """
@@ -166,8 +480,7 @@ async def get_mesonet_stations(location="hawaii", **query_params):
         "location": location,
         **query_params
     }
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
-        return await fetch(session, url, params=params)
+    return await fetch(url, params=params)
 
 async def get_mesonet_variables(**query_params):
     """
@@ -175,8 +488,7 @@ async def get_mesonet_variables(**query_params):
     """
     url = f"{BASE_URL}/mesonet/db/variables"
     params = query_params
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
-        return await fetch(session, url, params=params)
+    return await fetch(url, params=params)
 
 # function to get response from already formed request
 # https://api.hcdp.ikewai.org/raster/timeseries?start=1990-01-01&end=2024-01-01&lat=19.5&lng=-155.5&extent=statewide&datatype=rainfall&production=new&period=month\
@@ -185,35 +497,56 @@ async def get_response_from_request(request):
     """
     Fetches a response from the HCDP API based on a pre-formed request.
     """
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
-        response = await fetch(session, request)
-        return response
+    return await fetch(request)
     
 async def get_location(location: str) -> list[dict]:
     """
     Get latitude and longitude for a given location.
 
+    Known Hawaii places resolve from the local gazetteer and earlier remote
+    lookups from the geocode cache; only unknown places reach Nominatim, at most
+    once per NOMINATIM_MIN_INTERVAL seconds as its usage policy requires.
+
     Args:
         location (str): Location name.
 
     Returns:
-        list[dict]: A list of dictionaries with the latitude and longitude of the given location.
+        list[dict]: A list of dictionaries with the latitude, longitude and county of the given location.
                     Returns an empty list if the location cannot be determined.
     """
-    base_url = "https://nominatim.openstreetmap.org/search"
+    global _nominatim_last_request
+    cached = lookup_location(location)
+    if cached is not None:
+        return cached
+
+    base_url = f"{NOMINATIM_URL}/search"
     params = {
         "q": f"{location}, Hawaii",
         "format": "json",
     }
 
     try:
-        async with aiohttp.ClientSession(headers={"User-Agent": "none"}) as session:
-            async with session.get(base_url, params=params) as response:
-                response.raise_for_status()
-                return await response.json()
-    except aiohttp.ClientError as e:
-        print(f"Error fetching location data: {e}")
+        async with _nominatim_lock:
+            # Another request for the same place may have resolved it while this one waited
+            cached = lookup_location(location)
+            if cached is not None:
+                return cached
+            wait = _nominatim_last_request + NOMINATIM_MIN_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                # Retries would bypass the throttle; an unknown place just falls back to the defaults
+                results = await request_json(
+                    base_url, params=params, headers={"User-Agent": "none"}, service="nominatim",
+                    raise_for_status=True, retries=0,
+                )
+            finally:
+                _nominatim_last_request = time.monotonic()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning("Error fetching location data: %s", e)
         return []
+    remember_location(location, results)
+    return results
 
 async def request_from_params(params):
     """
@@ -236,16 +569,14 @@ async def request_from_params(params):
     county = None
     for key, value in params.items():
         if key == "location":
-            location_data = await get_location(value)
+            with stage("geocode"):
+                location_data = await get_location(value)
             if location_data:
                 api_defaults["lat"] = location_data[0]["lat"]
                 api_defaults["lng"] = location_data[0]["lon"]
-
-                # extract the county from the location data
-                county = location_data[0].get("display_name", "").split(",")[1].strip()
-                county = county.replace(" County", "")
+                county = location_data[0].get("county")
             else:
-                print(f"Could not find coordinates for location: {value}")
+                logger.info("Could not find coordinates for location: %s", value)
         api_defaults[key] = value.lower() if isinstance(value, str) else value
     
     api_params = {
@@ -263,20 +594,219 @@ async def request_from_params(params):
     if api_params.get("datatype") == "rainfall":
         api_params["production"] = api_defaults.get("production")
 
+    extra_params = {
+        "county": county,
+        "lat": float(api_defaults.get("lat")),
+        "lng": float(api_defaults.get("lng")),
+        "variable": api_defaults.get("datatype"),
+        "period": api_defaults.get("period"),
+    }
+    # Islands, counties and districts are averaged over their area when the raster cache has the maps
+    region = region_for_location(params["location"]) if params.get("is_region") and params.get("location") else None
+    if region is not None:
+        with stage("region_aggregate"):
+            aggregate = await region_timeseries(api_params, region)
+        if aggregate is not None:
+            data, percentiles, pixels = aggregate
+            extra_params["region"] = {"name": region["name"], "kind": region["kind"], "pixels": pixels}
+            extra_params["percentiles"] = percentiles
+            return {"data": data, "extra_params": extra_params}
+
+    data = await fetch_timeseries(api_params)
+    if data is None:
+        return None
+    return {
+        "data": data,
+        "extra_params": extra_params,
+    }
+
+async def fetch_timeseries(api_params):
+    """
+    Fetches a /raster/timeseries, serving repeated requests from the timeseries cache.
+
+    Dates are truncated to the requested period and statewide coordinates are
+    snapped to their grid cell, so nearby points asking for the same series
+    share one cache entry. On a cache miss the series is read from the local
+    timeseries store, and HCDP is only asked for the dates the store lacks.
+    When the raster cache holds the statewide maps of the range, the series
+    is read from them instead and no request is made at all. If HCDP fails,
+    expired or partial data is served rather than nothing.
+
+    Returns:
+        dict | None: Date/value pairs, or None if HCDP returned an error.
+    """
+    api_params = dict(api_params)
+    period = api_params.get("period")
+    api_params["start"] = normalize_date(api_params["start"], period)
+    api_params["end"] = normalize_date(api_params["end"], period)
+    cell = snap_to_grid(api_params.get("lat"), api_params.get("lng")) if api_params.get("extent") == "statewide" else None
+    if cell is not None:
+        api_params.pop("lat")
+        api_params.pop("lng")
+        api_params["row"], api_params["col"] = cell
+
+    key = timeseries_key(api_params)
+    data = timeseries_cache.get(key)
+    if data is not None:
+        return data
+
+    if cell is not None and raster_cache.serves(api_params):
+        data = raster_timeseries(api_params)
+        if data is not None:
+            timeseries_cache.set(key, data, ttl=timeseries_ttl(api_params["end"]))
+            return data
+
+    series = series_key(api_params)
+    start, end = api_params["start"], api_params["end"]
+    missing = timeseries_store.missing_range(series, start, end, period)
+    if missing is not None:
+        try:
+            fetched = await get_timeseries_upstream({**api_params, "start": missing[0], "end": missing[1]})
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            stale = stale_timeseries(key, series, start, end)
+            if stale is None:
+                raise
+            logger.warning("Serving a stale %s series while HCDP fails: %s", series, str(e) or type(e).__name__)
+            UPSTREAM_STALE.inc(service="hcdp")
+            return stale
+        if fetched is None:
+            return None
+        timeseries_store.merge(series, fetched, period, *missing)
+    data = timeseries_store.read(series, start, end)
+    timeseries_cache.set(key, data, ttl=timeseries_ttl(end))
+    return data
+
+def stale_timeseries(key, series, start, end):
+    """
+    Returns what is known of a series while HCDP can't be reached: an expired
+    cache entry, or else the part of the range the timeseries store holds.
+
+    Returns:
+        dict | None: Date/value pairs, or None if nothing is known.
+    """
+    data = timeseries_cache.get_stale(key)
+    if data is None:
+        data = timeseries_store.read(series, start, end) or None
+    return data
+
+async def get_timeseries_upstream(api_params):
+    """
+    Requests a /raster/timeseries from HCDP.
+
+    Returns:
+        dict | None: Date/value pairs, or None if HCDP returned an error.
+    """
     url = f"{BASE_URL}/raster/timeseries"
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
-        async with session.get(url, params=api_params) as response:
-            print(response)
-            response.raise_for_status()
-            data = await response.json()
-            if "error" in data:
-                print(f"Error fetching data: {data['error']}")
-                return None
-            else:
-                return {
-                    "data": data,
-                    "extra_params": {
-                        "county": county,
-                        "variable": api_defaults.get("datatype"),
-                        }
-                }
\ No newline at end of file
+    data = await request_json(url, params=api_params, raise_for_status=True)
+    if "error" in data:
+        logger.warning("Error fetching data: %s", data["error"])
+        return None
+    return data
+
+_raster_semaphore = asyncio.Semaphore(RASTER_DOWNLOAD_CONCURRENCY)
+_raster_downloads = {}
+# When each map last came back 404, so unpublished months aren't requested on every question
+_raster_unavailable = {}
+
+def raster_dates(api_params):
+    """
+    Lists the stored maps that answer a request, downloading missing ones in the background.
+
+    The cube only answers when it holds every map of the range, except
+    trailing recent periods newer than its latest map, which may simply not
+    be published yet.
+
+    Returns:
+        tuple[RasterCube, list[str]] | None: The cube and the dates to read,
+                                             or None if it can't serve the range yet.
+    """
+    cube = raster_cache.cube(api_params)
+    dates = period_dates(api_params["start"], api_params["end"], api_params["period"])
+    missing = cube.missing(dates)
+    if missing:
+        schedule_raster_downloads(api_params, missing)
+    last = cube.last_date()
+    if last is None or any(date <= last or not is_recent(date) for date in missing):
+        return None
+    return cube, [date for date in dates if date in cube]
+
+def raster_timeseries(api_params):
+    """
+    Reads a statewide grid cell timeseries from the raster cache.
+
+    Returns:
+        dict | None: Date/value pairs, or None if the cube can't serve the range yet.
+    """
+    found = raster_dates(api_params)
+    if found is None:
+        return None
+    cube, dates = found
+    return cube.point_series(api_params["row"], api_params["col"], dates)
+
+async def region_timeseries(api_params, region):
+    """
+    Computes the area mean and percentiles of a region from the raster cache.
+
+    Returns:
+        tuple[dict, dict, int] | None: Date/mean pairs, date/percentile dicts and
+                                       the number of cells averaged, or None if
+                                       the cube can't serve the range yet or
+                                       the region has no cells on the grid.
+    """
+    api_params = {
+        **api_params,
+        "start": normalize_date(api_params["start"], api_params["period"]),
+        "end": normalize_date(api_params["end"], api_params["period"]),
+    }
+    if not raster_cache.serves(api_params):
+        return None
+    found = raster_dates(api_params)
+    if found is None:
+        return None
+    cube, dates = found
+    aggregate = await region_aggregate(cube, region)
+    if not aggregate.pixels:
+        # e.g. Niihau, which lies west of the statewide grid
+        return None
+    # The first reduction of a large region reads every map of the range
+    means, percentiles = await asyncio.to_thread(aggregate.series, dates)
+    return means, percentiles, aggregate.pixels
+
+def schedule_raster_downloads(api_params, dates, limit=RASTER_BACKFILL_MAPS):
+    """
+    Starts background downloads of up to `limit` statewide maps into the raster cache.
+    """
+    name = cube_name(api_params)
+    now = time.monotonic()
+    todo = [
+        date for date in dates
+        if (name, date) not in _raster_downloads
+        and now - _raster_unavailable.get((name, date), -TIMESERIES_RECENT_TTL) >= TIMESERIES_RECENT_TTL
+    ]
+    for date in todo[:max(limit, 0)]:
+        task = asyncio.create_task(download_raster(api_params, date))
+        _raster_downloads[(name, date)] = task
+        task.add_done_callback(lambda _, key=(name, date): _raster_downloads.pop(key, None))
+
+async def download_raster(api_params, date):
+    """
+    Downloads the statewide map of `date` and appends it to its raster cube.
+
+    Returns:
+        bool: Whether the map was stored.
+    """
+    name = cube_name(api_params)
+    dataset = {key: api_params[key] for key in ("period", "production", "aggregation") if api_params.get(key)}
+    try:
+        async with _raster_semaphore:
+            data = await get_raster(date, api_params["datatype"], "statewide", return_empty_not_found=False, **dataset)
+            await asyncio.to_thread(raster_cache.store, api_params, date, data)
+        return True
+    except aiohttp.ClientResponseError as e:
+        if e.status == 404:
+            _raster_unavailable[(name, date)] = time.monotonic()
+        else:
+            logger.warning("Error downloading the %s map of %s: %s", name, date, e)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+        logger.warning("Error downloading the %s map of %s: %s", name, date, e)
+    return False
@@ -1,17 +1,59 @@
+import asyncio
 import datetime
+import functools
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Literal
+import orjson
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from google import genai
 from google.genai import types
 from google.genai.types import HttpOptions
 from dotenv import load_dotenv
 from google.genai.types import FunctionDeclaration, GenerateContentConfig, Tool, GoogleSearch
-from .hcdp import request_from_params
+from .hcdp import request_from_params, open_session, close_session, upstream_status
+from .geocode import location_cache
+from .timeseries import timeseries_cache
+from .summarize import summarize_timeseries
+from .encoding import encode_extra_params, series_npy
+from .extract import FAST_EXTRACT_CONFIDENCE, extract_parameters
+from .answers import FUNFACT_NAMES, FunFactPool, answer_cache, answer_key, funfact_island
+from .prefetch import prefetcher
+from .rasters import raster_cache
+from .regions import region_cache
+from .stations import loaded_station_index, preload_station_index, station_cache
+from .context_cache import ContextCache
+from .sessions import get_session, session_store
+from .export import export_links, stream_parts
+from .metrics import (
+    CACHES,
+    HTTP_IN_FLIGHT,
+    HTTP_LATENCY,
+    HTTP_REQUESTS,
+    MODEL_IN_FLIGHT,
+    MODEL_REQUESTS,
+    log_payload,
+    new_request_id,
+    render_metrics,
+    setup_logging,
+    stage,
+)
 import os
 
 # Load environment variables from .env file
 load_dotenv()
 
+setup_logging()
+logger = logging.getLogger(__name__)
+CACHES.update(
+    geocode=location_cache, timeseries=timeseries_cache, answers=answer_cache, stations=station_cache,
+    regions=region_cache, sessions=session_store,
+)
+
 # Get project ID and location from environment variables
 PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT")
 LOCATION = os.getenv("GOOGLE_CLOUD_LOCATION")
@@ -24,10 +66,58 @@ client = genai.Client(
 )
 model = "gemini-2.0-flash-001"
 
+# Bound concurrent in-flight model calls per worker and how long each may take
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", "16"))
+MODEL_TIMEOUT = float(os.getenv("MODEL_TIMEOUT", "60"))
+# Function calls of one model turn fetched at once, and the most served per question
+CHAT_FANOUT_CONCURRENCY = int(os.getenv("CHAT_FANOUT_CONCURRENCY", "4"))
+CHAT_MAX_FUNCTION_CALLS = int(os.getenv("CHAT_MAX_FUNCTION_CALLS", "8"))
+# Nearest observing stations listed next to gridded values; 0 disables
+CHAT_NEARBY_STATIONS = int(os.getenv("CHAT_NEARBY_STATIONS", "3"))
+# Seconds the Gemini context cache of the extraction prompt (instructions, tools
+# and hcdp_API.txt) is kept alive; 0 disables it and sends the short prompt instead
+MODEL_CONTEXT_CACHE_TTL = int(os.getenv("MODEL_CONTEXT_CACHE_TTL", "0"))
+model_semaphore = asyncio.Semaphore(MODEL_CONCURRENCY)
+
 with open("hcdp_API.txt", "r") as file:
     text = file.read()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Share one pooled HTTP session across every HCDP and Nominatim call
+    await open_session()
+    # Station metadata loads in the background; chat only uses it once it is there
+    station_task = asyncio.create_task(preload_station_index()) if CHAT_NEARBY_STATIONS > 0 else None
+    # Keeps popular series and the latest month warm, yielding to live requests
+    prefetcher.start()
+    yield
+    await prefetcher.stop()
+    await extraction_cache.close()
+    if station_task is not None:
+        station_task.cancel()
+    await close_session()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """
+    Assigns each request an ID for the log lines it produces and records
+    request counts, latency and in-flight gauges.
+    """
+    rid = new_request_id(request.headers.get("X-Request-ID"))
+    path = request.url.path if any(route.path == request.url.path for route in app.routes) else "other"
+    status = 500
+    start = time.perf_counter()
+    try:
+        with HTTP_IN_FLIGHT.track(path=path):
+            response = await call_next(request)
+            status = response.status_code
+    finally:
+        HTTP_REQUESTS.inc(path=path, status=status)
+        HTTP_LATENCY.observe(time.perf_counter() - start, path=path)
+    response.headers["X-Request-ID"] = rid
+    return response
 
 class Message(BaseModel):
     role: str
@@ -35,10 +125,20 @@ class Message(BaseModel):
 
 class ChatRequest(BaseModel):
     messages: list[Message] = []
+    # "compact" sends each series as its first date, period and base64 float32 values
+    series_encoding: Literal["dict", "compact"] = "dict"
+    # Continues a server-side conversation; only the new question has to be sent
+    session_id: str | None = None
 
 class ChatResponse(BaseModel):
     response: str
 
+class ExportRequest(BaseModel):
+    email: str
+    # File descriptions as in /genzip/email
+    data: list[dict]
+    zip_name: str = "hcdp_export"
+
 
 def get_tools():
 
@@ -119,40 +219,497 @@ def get_tools():
 
     return [tools]
 
+async def generate_content(contents, config):
+    """
+    Calls the model through the async SDK so the event loop keeps serving other
+    requests while Gemini responds.
+
+    Raises:
+        HTTPException: 504 if the model does not answer within MODEL_TIMEOUT.
+    """
+    async with model_semaphore:
+        try:
+            with MODEL_IN_FLIGHT.track():
+                response = await asyncio.wait_for(
+                    client.aio.models.generate_content(model=model, contents=contents, config=config),
+                    timeout=MODEL_TIMEOUT,
+                )
+            MODEL_REQUESTS.inc(outcome="ok")
+            return response
+        except asyncio.TimeoutError:
+            MODEL_REQUESTS.inc(outcome="timeout")
+            raise HTTPException(
+                status_code=504, detail="Timed out waiting for a response from the model."
+            )
+        except Exception:
+            MODEL_REQUESTS.inc(outcome="error")
+            raise
+
+async def generate_content_stream(contents, config):
+    """
+    Streams the model answer through the async SDK, yielding text chunks as
+    they arrive. Shares the concurrency limit of generate_content, and each
+    chunk must arrive within MODEL_TIMEOUT.
+    """
+    async with model_semaphore:
+        try:
+            MODEL_IN_FLIGHT.inc()
+            stream = await asyncio.wait_for(
+                client.aio.models.generate_content_stream(model=model, contents=contents, config=config),
+                timeout=MODEL_TIMEOUT,
+            )
+            chunks = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=MODEL_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
+                    text = "".join(part.text for part in chunk.candidates[0].content.parts if part.text)
+                    if text:
+                        yield text
+            MODEL_REQUESTS.inc(outcome="ok")
+        except asyncio.TimeoutError:
+            MODEL_REQUESTS.inc(outcome="timeout")
+            raise HTTPException(
+                status_code=504, detail="Timed out waiting for a response from the model."
+            )
+        except Exception:
+            MODEL_REQUESTS.inc(outcome="error")
+            raise
+        finally:
+            MODEL_IN_FLIGHT.dec()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Endpoint exposing request, stage, upstream, model and cache metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats_endpoint():
+    """
+    Endpoint to report hit/miss counters of the server-side caches.
+    """
+    return {
+        "geocode": location_cache.stats(),
+        "timeseries": timeseries_cache.stats(),
+        "answers": answer_cache.stats(),
+        "stations": station_cache.stats(),
+        "sessions": session_store.stats(),
+        "raster_maps": raster_cache.stats(),
+    }
+
+async def generate_funfact(island):
+    """
+    Asks the model for a fun fact about an island.
+    """
+    response = await generate_content(
+        contents=types.Content(
+            role="user", parts=[types.Part(text=f"Tell me a fun, interesting fact about {island}.")]
+        ),
+        config=funfact_config(island),
+    )
+    if response.candidates and response.candidates[0].content.parts:
+        return response.candidates[0].content.parts[0].text
+    else:
+        raise HTTPException(
+            status_code=500, detail="Failed to get a valid response from the model."
+        )
+
+funfact_pool = FunFactPool(generate_funfact)
+
 # make an endpoint to provide a random interesting fact about the hawaiian island provided by the user
 @app.get("/funfact")
 async def funfact_endpoint(request: Request):
     """
     Endpoint to provide a random interesting fact about the Hawaiian island provided by the user.
+    Facts are served from a per-island pool that is refilled in the background.
     """
     island = request.query_params.get("island")
     if not island:
         raise HTTPException(status_code=400, detail="Please provide an island name.")
+    # Only real islands get a pool (and the model calls that fill it)
+    island = funfact_island(island)
+    if island is None:
+        raise HTTPException(status_code=422, detail=f"Please provide {FUNFACT_NAMES}.")
+
+    return {"response": await funfact_pool.get(island)}
+
+@app.get("/timeseries")
+async def timeseries_endpoint(
+    location: str,
+    datatype: str = "rainfall",
+    period: str = "month",
+    time_start: str | None = None,
+    time_end: str | None = None,
+    aggregation: str | None = None,
+    production: str | None = None,
+    is_region: bool = False,
+    format: Literal["dict", "compact", "npy"] = "dict",
+):
+    """
+    Endpoint returning the series /chat would plot for get_api_parameters
+    arguments, without asking the model.
+
+    Answers with extra_params shaped like those of /chat. `format` selects the
+    encoding: "dict" for date/value pairs, "compact" for the first date,
+    period and base64 float32 values, or "npy" for just the data as a NumPy
+    .npy float32 array with one value per period (NaN where missing), whose
+    first date and period are in the X-Series-Start and X-Series-Period headers.
+    """
+    args = {
+        "location": location,
+        "datatype": datatype,
+        "period": period,
+        "time_start": time_start,
+        "time_end": time_end,
+        "aggregation": aggregation,
+        "production": production,
+        "is_region": is_region,
+    }
+    try:
+        with stage("hcdp_fetch"):
+            hdcp_response = await request_from_params({key: value for key, value in args.items() if value is not None})
+    except Exception as e:
+        raise HTTPException(status_code=upstream_status(e) or 500, detail=str(e) or type(e).__name__)
+    if hdcp_response is None:
+        raise HTTPException(
+            status_code=502, detail="Failed to get a valid response from the HDCP API."
+        )
+    if format == "npy":
+        body, start = series_npy(hdcp_response["data"], period)
+        headers = {"X-Series-Period": period}
+        if start is not None:
+            headers["X-Series-Start"] = start
+        return Response(body, media_type="application/x-npy", headers=headers)
+    # Shaped like the extra_params of /chat
+    extra_params = {**hdcp_response["extra_params"], "data": hdcp_response["data"]}
+    return ORJSONResponse(encode_extra_params(extra_params, format))
+
+@app.post("/export")
+async def export_endpoint(request: ExportRequest):
+    """
+    Endpoint streaming a bulk HCDP export as one zip file.
 
-    response = client.models.generate_content(
-        model=model,
-        contents=types.Content(
-            role="user", parts=[types.Part(text=f"Tell me a fun, interesting fact about {island}.")]
-        ),
-        config=GenerateContentConfig(
-            system_instruction=f"""
+    HCDP generates the zip split in ordered parts; they are downloaded
+    concurrently and sent back in order as they arrive, so the archive is
+    never held in memory as a whole.
+    """
+    try:
+        links = await export_links(request.email, request.data)
+    except Exception as e:
+        raise HTTPException(status_code=upstream_status(e) or 500, detail=str(e) or type(e).__name__)
+    filename = "".join(c for c in request.zip_name if c.isalnum() or c in "-_.") or "hcdp_export"
+    if not filename.endswith(".zip"):
+        filename += ".zip"
+    return StreamingResponse(
+        stream_parts(links), media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+# Tools, instructions and configs are built once and shared by every request;
+# only the date changes, so each config is built once a day. They must not be modified.
+TOOLS = get_tools()
+
+EXTRACTION_INSTRUCTION = """
+        Today is {today}.
+        You are a Hawaii Data Climate Portal API assistant to help query the data.
+        The user will ask questions and your job is to extract the parameters from the user question to generate the request to the Hawaii Data Climate Portal API.
+        If answering needs several series, for example to compare places, variables or temperature aggregations, call get_api_parameters once for each series.
+
+        """
+
+# Static prefix of the extraction prompt kept in the context cache; the date
+# comes with each request instead, so the prefix never changes
+CACHED_EXTRACTION_INSTRUCTION = """
+        You are a Hawaii Data Climate Portal API assistant to help query the data.
+        The user will ask questions and your job is to extract the parameters from the user question to generate the request to the Hawaii Data Climate Portal API.
+        If answering needs several series, for example to compare places, variables or temperature aggregations, call get_api_parameters once for each series.
+        The first message of the conversation gives today's date. The data range goes from 1990 to today.
+        The Hawaii Data Climate Portal API documentation follows.
+        """
+
+COMMENTARY_INSTRUCTION = """
+        Today is {today}.
+        You are a Hawaii Data Climate Portal AI assistant that helps users with hawaii climate information.
+        Make a comment about the data that answers the user question.
+        Base your answer on the information provided mainly from the HCDP. Provide a summary that answers the question.
+        Use the metric system.
+        """
+
+FALLBACK_INSTRUCTION = """
+        Today is {today}.
+        You are a Hawaii Data Climate Portal API assistant that helps users with hawaii climate information.
+        Make a comment about the data that answers the user question.
+        Use the metric system.
+        Only include your answer, do not include any other text.
+        """
+
+FUNFACT_INSTRUCTION = """
             You are a Hawaii Data Climate Portal AI assistant that provides fun facts about the Hawaiian islands.
             Provide a fun fact about {island}. Only return the fact, do not say here is a fun fact.
             Search on the web for updated, interesting facts about the island weather, construction and history, and anything interesting about it.
             Make it one sentences long, no more than 20 words, no line breaks.
-            """,
-            temperature=2,
-            tools=[
-                Tool(google_search=GoogleSearch()),
-            ]                
+            """
+
+extraction_cache = ContextCache(
+    client,
+    model,
+    types.CreateCachedContentConfig(
+        display_name="hcdp-extraction",
+        system_instruction=CACHED_EXTRACTION_INSTRUCTION,
+        contents=[types.Content(role="user", parts=[types.Part(text=text)])],
+        tools=TOOLS,
+    ),
+    ttl=MODEL_CONTEXT_CACHE_TTL,
+)
+
+@functools.lru_cache(maxsize=4)
+def extraction_config(today):
+    """
+    Config of the first model call, which extracts the HCDP request parameters.
+    """
+    return GenerateContentConfig(
+        temperature=0,
+        tools=TOOLS,
+        # system_instruction=f"""
+        # Today is {today}.
+        # You are a Hawaii Data Climate Portal API assistant to help query the data.
+        # The user will ask questions and your job is to generate the API call to the Hawaii Data Climate Portal API.
+        # The API call should be based on the user's question, so the returned data can be used to make a plot.
+        # If the information is not complete for the API request, fill in the missing information with the best guess, including lat/lng.
+        # Include production=new for rainfall and skip it for temperature.
+        # Include the aggregation type for temperature based on the following values: min, max, mean. Infer the aggregation type from the user question.
+        # Do not forget to include the period for the requested data (day or month). If not included, use month.
+        # The data range goes from 1990 to {today}. Time has to be in ISO-8601 format.
+        # If the user does not specify the time range, use the whole range.
+        # All the requests are Hawaii specific, so you can assume the user is asking about Hawaii. Always return extend=statewide, and include lat/lng.
+        # The API documentation is available at: 
+
+        # {text}.
+
+        # The API url always needs to be included: https://api.hcdp.ikewai.org
+        # Reply with the API only, do not include any other text.
+        # """
+        system_instruction=EXTRACTION_INSTRUCTION.format(today=today),
+    )
+
+@functools.lru_cache(maxsize=4)
+def cached_extraction_config(cache_name):
+    """
+    Config of the extraction call when its instructions, tools and the API
+    documentation come from the context cache.
+    """
+    return GenerateContentConfig(temperature=0, cached_content=cache_name)
+
+@functools.lru_cache(maxsize=4)
+def commentary_config(today):
+    """
+    Config of the second model call, which comments on the HCDP data.
+    """
+    return GenerateContentConfig(
+        system_instruction=COMMENTARY_INSTRUCTION.format(today=today),
+    )
+
+@functools.lru_cache(maxsize=4)
+def fallback_config(today):
+    """
+    Config of the model call answering questions that need no HCDP data.
+    """
+    return GenerateContentConfig(
+        tools=[
+            Tool(google_search=GoogleSearch()),
+        ],
+        system_instruction=FALLBACK_INSTRUCTION.format(today=today),
+    )
+
+@functools.lru_cache(maxsize=64)
+def funfact_config(island):
+    """
+    Config of the fun fact calls about one island.
+    """
+    return GenerateContentConfig(
+        system_instruction=FUNFACT_INSTRUCTION.format(island=island),
+        temperature=2,
+        tools=[
+            Tool(google_search=GoogleSearch()),
+        ],
+    )
+
+def current_date():
+    """
+    Today's date as injected into the prompts; a date rather than a timestamp
+    so the configs built from it are reused all day.
+    """
+    return datetime.date.today().isoformat()
+
+async def extract_function_calls(contents, today):
+    """
+    Asks the model for the get_api_parameters calls matching the user question.
+
+    With the context cache enabled the request only carries the date and the
+    question, and falls back to the full prompt if the cache is gone.
+
+    Returns:
+        list[types.FunctionCall]: The function calls, empty if the question needs no HCDP data.
+    """
+    with stage("llm_extract"):
+        cache_name = await extraction_cache.name()
+        request_builder = None
+        if cache_name is not None:
+            dated = [types.Content(role="user", parts=[types.Part(text=f"Today is {today}.")]), *contents]
+            try:
+                request_builder = await generate_content(contents=dated, config=cached_extraction_config(cache_name))
+            except HTTPException:
+                raise
+            except Exception as e:
+                logger.warning("Extraction with context cache %s failed, sending the full prompt: %s", cache_name, e)
+                extraction_cache.invalidate()
+        if request_builder is None:
+            request_builder = await generate_content(contents=contents, config=extraction_config(today))
+    if request_builder.candidates and request_builder.candidates[0].content.parts:
+        parts = request_builder.candidates[0].content.parts
+        return [part.function_call for part in parts if part.function_call][:CHAT_MAX_FUNCTION_CALLS]
+    return []
+
+def local_parameters(prompt):
+    """
+    Returns the get_api_parameters arguments the local extractor is confident
+    about, or None if the model has to extract them.
+    """
+    with stage("local_extract"):
+        args, confidence = extract_parameters(prompt)
+    logger.info("Local extraction confidence %.2f", confidence)
+    return args if confidence >= FAST_EXTRACT_CONFIDENCE else None
+
+def local_function_calls(prompt, session):
+    """
+    Returns the get_api_parameters arguments resolved without the model: the
+    local extractor's when it is confident, or else the session's last calls
+    updated by a follow-up question. None if the model has to extract them.
+    """
+    params = local_parameters(prompt)
+    if params is not None:
+        return [params]
+    with stage("local_extract"):
+        calls = session.follow_up_calls(prompt)
+    if calls is not None:
+        logger.info("Resolved a follow-up from the session: %s", calls)
+    return calls
+
+async def resolve_function_calls(contents, today, calls):
+    """
+    Gets the get_api_parameters calls for the user question, from the locally
+    resolved `calls` when available and from the model otherwise.
+
+    Returns:
+        list[types.FunctionCall]: The function calls, empty if the question needs no HCDP data.
+    """
+    if calls is not None:
+        return [types.FunctionCall(name="get_api_parameters", args=args) for args in calls]
+    return await extract_function_calls(contents, today)
+
+async def fetch_function_data(function_call, session=None):
+    """
+    Runs the function call against HCDP, or cuts its series out of one the
+    session already fetched.
+
+    Returns:
+        tuple[types.Part, dict]: The function response part holding the summarized
+                                 series, and the extra_params for the frontend.
+    """
+    hdcp_response = session.reusable_result(function_call.args or {}) if session is not None else None
+    if hdcp_response is None:
+        with stage("hcdp_fetch"):
+            hdcp_response = await request_from_params(
+                function_call.args
             )
-        )
-    if response.candidates and response.candidates[0].content.parts:
-        return {"response": response.candidates[0].content.parts[0].text}
     else:
+        logger.info("Reusing session data for %s", function_call.args)
+    log_payload("HCDP response", hdcp_response)
+    if hdcp_response is None:
         raise HTTPException(
-            status_code=500, detail="Failed to get a valid response from the model."
+            status_code=502, detail="Failed to get a valid response from the HDCP API."
         )
+    prefetcher.record(function_call.args or {})
+    extra_params = hdcp_response.get("extra_params", None)
+    # Hand the model a compact summary; the frontend still gets every point
+    data = hdcp_response.get("data", None)
+    extra_params["data"] = data
+    with stage("summarize"):
+        summary = summarize_timeseries(data, extra_params["variable"], extra_params["period"])
+    if extra_params.get("region"):
+        summary["region"] = {**extra_params["region"], "statistic": "area mean of the grid cells"}
+    station_index = loaded_station_index()
+    if station_index is not None and CHAT_NEARBY_STATIONS > 0:
+        stations = station_index.nearest(extra_params["lat"], extra_params["lng"], n=CHAT_NEARBY_STATIONS)
+        extra_params["nearby_stations"] = stations
+        summary["nearby_stations"] = [
+            {"name": station["name"], "id": station["id"], "distance_km": station["distance_km"]} for station in stations
+        ]
+    hdcp_response_part = types.Part.from_function_response(
+        name=function_call.name,
+        response={"results": summary},
+    )
+    return hdcp_response_part, extra_params
+
+async def fetch_all_function_data(function_calls, session=None):
+    """
+    Runs every function call of a model turn against HCDP concurrently.
+
+    Identical calls are fetched once and at most CHAT_FANOUT_CONCURRENCY run
+    at a time. Calls that fail are left out unless all of them do.
+
+    Returns:
+        tuple[list[types.Part], dict]: One function response part per call, in
+                                       order, and the extra_params for the
+                                       frontend: those of the first series, plus
+                                       a "series" list of all of them when there
+                                       are several.
+    """
+    semaphore = asyncio.Semaphore(CHAT_FANOUT_CONCURRENCY)
+    keys = [json.dumps(dict(call.args or {}), sort_keys=True, default=str) for call in function_calls]
+    unique = dict(zip(keys, function_calls))
+
+    async def run(function_call):
+        async with semaphore:
+            return await fetch_function_data(function_call, session)
+
+    results = dict(zip(unique, await asyncio.gather(*map(run, unique.values()), return_exceptions=True)))
+    failures = [result for result in results.values() if isinstance(result, BaseException)]
+    if len(failures) == len(results):
+        raise failures[0]
+    for failure in failures:
+        logger.warning("Dropping a failed series: %s", failure)
+
+    parts, series = [], []
+    for key, function_call in zip(keys, function_calls):
+        result = results[key]
+        if isinstance(result, BaseException):
+            parts.append(types.Part.from_function_response(name=function_call.name, response={"error": str(result)}))
+            continue
+        part, extra_params = result
+        parts.append(part)
+        if not any(extra_params is other for other in series):
+            series.append(extra_params)
+    extra_params = dict(series[0])
+    if len(series) > 1:
+        extra_params["series"] = series
+    return parts, extra_params
+
+def remember_turn(session, prompt, calls, result):
+    """
+    Adds an answered question to the session, along with the series it fetched.
+    """
+    extra_params = result["extra_params"]
+    if calls and extra_params:
+        series = extra_params.get("series") or [extra_params]
+        # Series dropped by deduplication or failures can't be matched to their calls
+        if len(series) == len(calls):
+            session.remember(calls, series)
+    session.record(prompt, result["response"], calls)
 
 @app.post("/chat")
 async def chat_endpoint(request: ChatRequest):
@@ -171,118 +728,155 @@ async def chat_endpoint(request: ChatRequest):
             )
 
         prompt = request.messages[-1].content
-        tools = get_tools()
+        today = current_date()
+        session = get_session(request.session_id, request.messages)
 
-        today = datetime.datetime.now().isoformat()
+        calls = local_function_calls(prompt, session)
+        cache_key = answer_key(session.texts() + [prompt], calls)
+        cached = answer_cache.get(cache_key)
+        if cached is not None:
+            remember_turn(session, prompt, *cached)
+            return chat_response(cached[1], request.series_encoding, session.id)
 
-        contents = [
-            types.Content(
-                role="user", parts=[types.Part(text=prompt)]
-            ),
-        ]
+        # Earlier turns come from the session; the client only sends the new question
+        contents = session.contents(prompt)
 
-        request_builder = client.models.generate_content(
-            model=model,
-            contents=contents,
-            config=GenerateContentConfig(
-                temperature=0,
-                tools=tools,
-                # system_instruction=f"""
-                # Today is {today}.
-                # You are a Hawaii Data Climate Portal API assistant to help query the data.
-                # The user will ask questions and your job is to generate the API call to the Hawaii Data Climate Portal API.
-                # The API call should be based on the user's question, so the returned data can be used to make a plot.
-                # If the information is not complete for the API request, fill in the missing information with the best guess, including lat/lng.
-                # Include production=new for rainfall and skip it for temperature.
-                # Include the aggregation type for temperature based on the following values: min, max, mean. Infer the aggregation type from the user question.
-                # Do not forget to include the period for the requested data (day or month). If not included, use month.
-                # The data range goes from 1990 to {today}. Time has to be in ISO-8601 format.
-                # If the user does not specify the time range, use the whole range.
-                # All the requests are Hawaii specific, so you can assume the user is asking about Hawaii. Always return extend=statewide, and include lat/lng.
-                # The API documentation is available at: 
-                
-                # {text}.
-
-                # The API url always needs to be included: https://api.hcdp.ikewai.org
-                # Reply with the API only, do not include any other text.
-                # """
-                system_instruction=f"""
-                Today is {today}.
-                You are a Hawaii Data Climate Portal API assistant to help query the data.
-                The user will ask questions and your job is to extract the parameters from the user question to generate the request to the Hawaii Data Climate Portal API.
-                
-                """
-                ),
-        )
-
-        function_call = request_builder.candidates[0].content.parts[0].function_call if request_builder.candidates and request_builder.candidates[0].content.parts else None
+        function_calls = await resolve_function_calls(contents, today, calls)
 
         extra_params = None
 
-        if function_call:
-            print("Function call detected")
-            hdcp_response = await request_from_params(
-                function_call.args
-            )
-            extra_params = hdcp_response.get("extra_params", None)
-            print("HDCP response:", hdcp_response)
-            if hdcp_response is None:
-                raise HTTPException(
-                    status_code=500, detail="Failed to get a valid response from the HDCP API."
-                )
-            hdcp_response_part = types.Part.from_function_response(
-                name=function_call.name,
-                response={"results": hdcp_response.get("data", None)},
-            )
+        if function_calls:
+            logger.info("Function calls detected: %s", [dict(call.args or {}) for call in function_calls])
+            response_parts, extra_params = await fetch_all_function_data(function_calls, session)
 
-            contents.append(types.Content(role="model", parts=[types.Part(function_call=function_call)]))
-            contents.append(types.Content(role="user", parts=[hdcp_response_part]))
-
-            response = client.models.generate_content(
-                model=model,
-                contents=contents,
-                config=GenerateContentConfig(
-                    tools=tools.append(Tool(google_search=GoogleSearch())),
-                    system_instruction=f"""
-                    Today is {today}.
-                    You are a Hawaii Data Climate Portal AI assistant that helps users with hawaii climate information.
-                    Make a comment about the data that answers the user question.
-                    Base your answer on the information provided mainly from the HCDP. Provide a summary that answers the question.
-                    Use the metric system.
-                    """
-                )
-            )
+            # Every call and its response go back in a single round trip
+            contents.append(types.Content(role="model", parts=[types.Part(function_call=call) for call in function_calls]))
+            contents.append(types.Content(role="user", parts=response_parts))
+
+            with stage("llm_summarize"):
+                response = await generate_content(contents=contents, config=commentary_config(today))
         else:
-            history = "\n".join([f"{msg.role}: {msg.content}" for msg in request.messages])
-            response = client.models.generate_content(
-                model=model,
-                contents=types.Content(
-                    role="user", parts=[types.Part(text=history)]
-                ),
-                config=GenerateContentConfig(
-                    tools=[
-                        Tool(google_search=GoogleSearch()),
-                    ],
-                    system_instruction=f"""
-                    Today is {today}.
-                    You are a Hawaii Data Climate Portal API assistant that helps users with hawaii climate information.
-                    Make a comment about the data that answers the user question.
-                    Use the metric system.
-                    Only include your answer, do not include any other text.
-                    """
+            with stage("llm_fallback"):
+                response = await generate_content(
+                    contents=contents, config=fallback_config(today)
                 )
-            )
 
         if response.candidates and response.candidates[0].content.parts:
-            return {"response": response.candidates[0].content.parts[0].text,
-                    "extra_params": extra_params}
+            result = {"response": response.candidates[0].content.parts[0].text,
+                      "extra_params": extra_params}
+            turn = ([dict(call.args or {}) for call in function_calls], result)
+            answer_cache.set(cache_key, turn)
+            remember_turn(session, prompt, *turn)
+            return chat_response(result, request.series_encoding, session.id)
         else:
             raise HTTPException(
                 status_code=500, detail="Failed to get a valid response from the model."
             )
 
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        # Upstream failures are a bad gateway (or an unavailable one while its circuit is open), not our bug
+        raise HTTPException(status_code=upstream_status(e) or 500, detail=str(e) or type(e).__name__)
+
+def chat_response(result, encoding, session_id):
+    """
+    Serializes a /chat result with orjson, encoding its series as the client asked.
+    Building the response ourselves skips FastAPI's jsonable_encoder pass over every point.
+    """
+    return ORJSONResponse({
+        **result, "extra_params": encode_extra_params(result["extra_params"], encoding), "session_id": session_id
+    })
+
+def sse_event(event, data):
+    """
+    Formats one Server-Sent Event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY).decode()}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    Streaming variant of /chat using Server-Sent Events.
+
+    Events are sent as soon as each stage finishes:
+        session: the session_id to send with the next question
+        params: the arguments of each extracted get_api_parameters call
+        data: the extra_params with the HCDP timeseries, ready to plot, in the requested series_encoding
+        token: a chunk of the model commentary
+        done: the full commentary
+        error: status_code and detail if a stage failed
+    """
+    if model is None:
+        raise HTTPException(
+            status_code=503, detail="Vertex AI integration is not enabled."
+        )
+    if not request.messages:
+        raise HTTPException(
+            status_code=400, detail="Please provide at least one message."
+        )
+
+    async def events():
+        try:
+            prompt = request.messages[-1].content
+            today = current_date()
+            session = get_session(request.session_id, request.messages)
+            yield sse_event("session", {"session_id": session.id})
+
+            calls = local_function_calls(prompt, session)
+            cache_key = answer_key(session.texts() + [prompt], calls)
+            cached = answer_cache.get(cache_key)
+            if cached is not None:
+                remember_turn(session, prompt, *cached)
+                calls, result = cached
+                for args in calls:
+                    yield sse_event("params", {"name": "get_api_parameters", "args": args})
+                if calls:
+                    yield sse_event("data", encode_extra_params(result["extra_params"], request.series_encoding))
+                yield sse_event("token", {"text": result["response"]})
+                yield sse_event("done", {"response": result["response"]})
+                return
+
+            contents = session.contents(prompt)
+
+            extra_params = None
+            function_calls = await resolve_function_calls(contents, today, calls)
+            if function_calls:
+                for call in function_calls:
+                    yield sse_event("params", {"name": call.name, "args": dict(call.args or {})})
+                response_parts, extra_params = await fetch_all_function_data(function_calls, session)
+                yield sse_event("data", encode_extra_params(extra_params, request.series_encoding))
+
+                contents.append(types.Content(role="model", parts=[types.Part(function_call=call) for call in function_calls]))
+                contents.append(types.Content(role="user", parts=response_parts))
+                stream = generate_content_stream(contents=contents, config=commentary_config(today))
+                stage_name = "llm_summarize"
+            else:
+                stream = generate_content_stream(
+                    contents=contents, config=fallback_config(today)
+                )
+                stage_name = "llm_fallback"
+
+            text = []
+            with stage(stage_name):
+                async for chunk in stream:
+                    text.append(chunk)
+                    yield sse_event("token", {"text": chunk})
+            result = {"response": "".join(text), "extra_params": extra_params}
+            turn = ([dict(call.args or {}) for call in function_calls], result)
+            answer_cache.set(cache_key, turn)
+            remember_turn(session, prompt, *turn)
+            yield sse_event("done", {"response": result["response"]})
+        except HTTPException as e:
+            yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            yield sse_event("error", {"status_code": upstream_status(e) or 500, "detail": str(e) or type(e).__name__})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,196 @@
+import asyncio
+import collections
+import datetime
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .hcdp import get_mesonet_measurements
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Records per request; the API caps this at one million
+MESONET_PAGE_SIZE = int(os.getenv("MESONET_PAGE_SIZE", "100000"))
+# Length of the time windows a long range is split into
+MESONET_WINDOW_HOURS = float(os.getenv("MESONET_WINDOW_HOURS", "168"))
+# Windows fetched at the same time, which also bounds how many are held in memory
+MESONET_CONCURRENCY = int(os.getenv("MESONET_CONCURRENCY", "4"))
+
+# Identifier columns kept as strings, so station "0115" doesn't become 115.0
+TEXT_COLUMNS = {"station_id", "variable", "var_id", "station_name", "units", "standard_name", "display_name", "status"}
+
+
+def _parse_datetime(value) -> datetime.datetime:
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time())
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def time_windows(start_date, end_date, hours: float = MESONET_WINDOW_HOURS) -> list[tuple[str, str]]:
+    """
+    Splits [start_date, end_date] into consecutive ISO-8601 windows of `hours`.
+
+    The API includes both ends of a range, so each window stops one second
+    before the next starts and no record is returned twice.
+    """
+    start, end = _parse_datetime(start_date), _parse_datetime(end_date)
+    step = datetime.timedelta(hours=hours)
+    windows = []
+    while start <= end:
+        stop = start + step
+        windows.append((start.isoformat(), min(stop - datetime.timedelta(seconds=1), end).isoformat()))
+        start = stop
+    return windows
+
+
+def parse_timestamps(values: list[str]) -> np.ndarray:
+    """
+    Converts ISO-8601 timestamps to UTC datetime64[ms].
+
+    UTC ("...Z") strings are parsed by NumPy in one pass; strings with an
+    offset (local_tz queries) go through datetime.
+    """
+    values = [value.removesuffix("Z") for value in values]
+    if not any(len(value) > 6 and value[-6] in "+-" and value[-3] == ":" for value in values):
+        return np.array(values, dtype="datetime64[ms]")
+    return np.array(
+        [
+            datetime.datetime.fromisoformat(value).astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            for value in values
+        ],
+        dtype="datetime64[ms]",
+    )
+
+
+def decode_column(name: str, values: list) -> np.ndarray:
+    """
+    Converts one column of an array-mode response to a NumPy array: timestamps
+    to datetime64[ms], identifiers to strings and everything else to float64
+    (missing values become NaN).
+    """
+    if name == "timestamp":
+        return parse_timestamps(values)
+    if name in TEXT_COLUMNS:
+        return np.array(["" if value is None else str(value) for value in values])
+    try:
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    except ValueError:
+        return np.array(["" if value is None else str(value) for value in values])
+
+
+def decode_page(page: dict) -> dict[str, np.ndarray]:
+    """
+    Converts a row_mode=array/wide_array response ({"index": [...], "data": [[...], ...]})
+    to a dict of column arrays.
+    """
+    index, rows = page.get("index", []), page.get("data", [])
+    columns = list(zip(*rows)) if rows else [()] * len(index)
+    return {name: decode_column(name, list(values)) for name, values in zip(index, columns)}
+
+
+def concat_columns(chunks: list[dict[str, np.ndarray]]) -> dict[str, np.ndarray]:
+    """
+    Joins column chunks into one dict of arrays.
+    """
+    chunks = [chunk for chunk in chunks if chunk]
+    if not chunks:
+        return {}
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+async def _fetch_window(location, params, page_size) -> list[dict[str, np.ndarray]]:
+    """
+    Fetches every page of one time window, following offsets until a short page.
+    """
+    pages = []
+    offset = 0
+    while True:
+        page = await get_mesonet_measurements(location, **params, limit=page_size, offset=offset)
+        rows = len(page.get("data", []))
+        if rows:
+            pages.append(decode_page(page))
+        # Wide row modes return fewer rows than records, so any non-empty page may have a successor
+        if rows == 0 or (rows < page_size and not params["row_mode"].startswith("wide")):
+            return pages
+        offset += page_size
+
+
+async def iter_mesonet_measurements(
+    start_date=None,
+    end_date=None,
+    location="hawaii",
+    row_mode="array",
+    page_size=MESONET_PAGE_SIZE,
+    window_hours=MESONET_WINDOW_HOURS,
+    concurrency=MESONET_CONCURRENCY,
+    **query_params,
+):
+    """
+    Streams mesonet measurements as NumPy column chunks, oldest first.
+
+    A range with both ends is split into time windows that are fetched
+    concurrently, at most `concurrency` at a time; each window follows
+    `offset` until it is exhausted, so nothing is silently truncated at the
+    page limit. Chunks are yielded in order as soon as their window is done,
+    and only the windows in flight are held in memory, so arbitrarily long
+    ranges can be consumed with flat memory.
+
+    Args:
+        start_date, end_date: ISO-8601 strings or datetimes bounding the range.
+        location (str): hawaii or american_samoa.
+        row_mode (str): array (one row per record) or wide_array (one row per
+                        station and timestamp, variables as columns).
+        page_size (int): Records per request.
+        window_hours (float): Length of each concurrently fetched window.
+        concurrency (int): Maximum number of windows fetched at once.
+        **query_params: Other /mesonet/db/measurements filters (station_ids, var_ids, flags, ...).
+
+    Yields:
+        dict[str, np.ndarray]: Column arrays keyed by the response index,
+                               e.g. timestamp, station_id, variable, value.
+    """
+    params = {**query_params, "row_mode": row_mode, "reverse": "true"}
+    if start_date is not None and end_date is not None:
+        windows = time_windows(start_date, end_date, window_hours)
+    else:
+        windows = [(start_date, end_date)]
+
+    def schedule(window):
+        window_params = dict(params)
+        if window[0] is not None:
+            window_params["start_date"] = window[0]
+        if window[1] is not None:
+            window_params["end_date"] = window[1]
+        return asyncio.create_task(_fetch_window(location, window_params, page_size))
+
+    pending = collections.deque()
+    remaining = iter(windows)
+    try:
+        for window in remaining:
+            pending.append(schedule(window))
+            if len(pending) >= concurrency:
+                break
+        while pending:
+            pages = await pending.popleft()
+            window = next(remaining, None)
+            if window is not None:
+                pending.append(schedule(window))
+            for chunk in pages:
+                yield chunk
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def read_mesonet_measurements(start_date=None, end_date=None, location="hawaii", **kwargs) -> dict[str, np.ndarray]:
+    """
+    Fetches a whole range of mesonet measurements into one dict of column arrays.
+
+    See iter_mesonet_measurements for the arguments.
+    """
+    chunks = [chunk async for chunk in iter_mesonet_measurements(start_date, end_date, location, **kwargs)]
+    return concat_columns(chunks)
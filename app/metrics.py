@@ -0,0 +1,216 @@
+import contextvars
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Fraction of requests whose full payloads are written to the debug log
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+
+request_id = contextvars.ContextVar("request_id", default="-")
+
+logger = logging.getLogger(__name__)
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Adds the current request ID to every log record.
+    """
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+def setup_logging():
+    """
+    Configures the root logger to prefix every line with the request ID.
+    """
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+
+def new_request_id(incoming: str | None = None) -> str:
+    """
+    Sets and returns the request ID for the current context, reusing the
+    caller's X-Request-ID when provided.
+    """
+    value = incoming or uuid.uuid4().hex[:16]
+    request_id.set(value)
+    return value
+
+
+def log_payload(label: str, payload):
+    """
+    Writes a payload to the debug log for a sample of requests only.
+    """
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_PAYLOAD_SAMPLE_RATE:
+        logger.debug("%s: %.*s", label, LOG_PAYLOAD_MAX_CHARS, payload)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def total(self):
+        """
+        Sums the gauge over all label values.
+        """
+        return sum(self._values.values())
+
+    @contextmanager
+    def track(self, **labels):
+        """
+        Counts the enclosed block as in flight.
+        """
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state["counts"][i] += 1
+        state["sum"] += value
+        state["count"] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, state in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, state["counts"]):
+                labels = _format_labels(self.labels + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labels + ("le",), key + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {state['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {state['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {state['count']}")
+        return lines
+
+
+REGISTRY: list[Metric] = []
+# Caches reported on every scrape, by name
+CACHES = {}
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests served", ("path", "status"))
+HTTP_LATENCY = Histogram("http_request_seconds", "HTTP request latency", ("path",))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being served", ("path",))
+STAGE_LATENCY = Histogram("chat_stage_seconds", "Latency of each chat pipeline stage", ("stage",))
+UPSTREAM_REQUESTS = Counter("upstream_requests_total", "Requests to upstream services", ("service", "endpoint", "status"))
+UPSTREAM_LATENCY = Histogram("upstream_request_seconds", "Upstream request latency", ("service", "endpoint"))
+UPSTREAM_BYTES = Histogram(
+    "upstream_response_bytes", "Upstream response body size", ("service", "endpoint"),
+    buckets=(1e3, 1e4, 1e5, 1e6, 1e7, 1e8),
+)
+UPSTREAM_IN_FLIGHT = Gauge("upstream_requests_in_flight", "Upstream requests awaiting a response", ("service",))
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "Upstream requests sent again after a failure", ("service", "endpoint"))
+UPSTREAM_COALESCED = Counter(
+    "upstream_coalesced_total", "Upstream requests served by an identical request already in flight", ("service", "endpoint")
+)
+UPSTREAM_STALE = Counter("upstream_stale_served_total", "Responses served from stale data while upstream failed", ("service",))
+CIRCUIT_OPEN = Gauge("upstream_circuit_open", "Whether the circuit of an upstream service is open", ("service",))
+EXPORT_BUFFERED = Gauge("export_buffered_bytes", "Bulk export bytes downloaded but not yet sent to the client")
+MODEL_REQUESTS = Counter("model_requests_total", "Gemini calls", ("outcome",))
+MODEL_IN_FLIGHT = Gauge("model_requests_in_flight", "Gemini calls holding a concurrency slot")
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Times one stage of the chat pipeline.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.observe(elapsed, stage=name)
+        logger.debug("stage %s took %.1f ms", name, elapsed * 1000)
+
+
+def render_metrics() -> str:
+    """
+    Renders every metric and cache counter in the Prometheus text format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines += ["# HELP cache_hits_total Cache hits", "# TYPE cache_hits_total counter"]
+    lines += [f'cache_hits_total{{cache="{name}"}} {cache.hits}' for name, cache in CACHES.items()]
+    lines += ["# HELP cache_misses_total Cache misses", "# TYPE cache_misses_total counter"]
+    lines += [f'cache_misses_total{{cache="{name}"}} {cache.misses}' for name, cache in CACHES.items()]
+    lines += ["# HELP cache_hit_ratio Cache hits over lookups", "# TYPE cache_hit_ratio gauge"]
+    lines += [f'cache_hit_ratio{{cache="{name}"}} {cache.stats()["hit_ratio"]}' for name, cache in CACHES.items()]
+    lines += ["# HELP cache_entries Entries held by the cache", "# TYPE cache_entries gauge"]
+    lines += [f'cache_entries{{cache="{name}"}} {len(cache)}' for name, cache in CACHES.items()]
+    return "\n".join(lines) + "\n"
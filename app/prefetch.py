@@ -0,0 +1,230 @@
+import asyncio
+import collections
+import datetime
+import json
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+
+from .answers import answer_cache
+from .geocode import GAZETTEER, normalize_place
+from .hcdp import get_production_list, request_from_params, schedule_raster_downloads
+from .metrics import HTTP_IN_FLIGHT
+from .rasters import raster_cache
+from .timeseries import next_period, normalize_date, series_args, timeseries_cache
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Seconds between prefetch cycles; 0 disables the scheduler
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "3600"))
+PREFETCH_STARTUP_DELAY = float(os.getenv("PREFETCH_STARTUP_DELAY", "5"))
+# Most requested series warmed each cycle, on top of the seed list
+PREFETCH_TOP_N = int(os.getenv("PREFETCH_TOP_N", "20"))
+# Upstream operations the scheduler may start per minute
+PREFETCH_RATE = float(os.getenv("PREFETCH_RATE", "30"))
+# How far back to look for the latest published month on startup
+PREFETCH_PROBE_MONTHS = int(os.getenv("PREFETCH_PROBE_MONTHS", "6"))
+# Distinct series whose request counts are kept for the popularity ranking
+PREFETCH_TRACKED = int(os.getenv("PREFETCH_TRACKED", "500"))
+# Live requests the scheduler still runs alongside, and the longest it waits for fewer
+PREFETCH_BUSY_REQUESTS = int(os.getenv("PREFETCH_BUSY_REQUESTS", "2"))
+PREFETCH_MAX_WAIT = float(os.getenv("PREFETCH_MAX_WAIT", "30"))
+
+# Datasets watched for newly published months
+DATASETS = [
+    {"datatype": "rainfall", "production": "new", "period": "month"},
+    {"datatype": "temperature", "aggregation": "mean", "period": "month"},
+]
+
+
+def outdated_by(dataset: dict, datatype: str | None, production: str | None, end: str | None) -> bool:
+    """
+    Tells whether a series of `datatype` (and rainfall `production`) ending
+    at `end` reaches the newly published month of `dataset`. Missing values
+    take the defaults of request_from_params.
+    """
+    if (datatype or "rainfall") != dataset["datatype"]:
+        return False
+    if dataset["datatype"] == "rainfall" and (production or "new") != dataset.get("production"):
+        return False
+    return end is None or normalize_date(end, "month") >= dataset["month"]
+
+
+def seed_args() -> list[dict]:
+    """
+    Rainfall and mean temperature for every island and county, which cover
+    most first questions.
+    """
+    seeds = []
+    for entry in GAZETTEER.entries:
+        if entry["kind"] in ("island", "county"):
+            seeds.append({"location": entry["name"], "is_region": True, "datatype": "rainfall"})
+            seeds.append({"location": entry["name"], "is_region": True, "datatype": "temperature", "aggregation": "mean"})
+    return seeds
+
+
+class RateBudget:
+    """
+    Token bucket limiting how many upstream operations the scheduler starts.
+    """
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = 0.0
+
+    async def acquire(self):
+        now = time.monotonic()
+        wait = self._next - now
+        self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class Prefetcher:
+    """
+    Background scheduler keeping popular series and the latest month warm.
+
+    Every cycle it checks whether HCDP published a new month of each watched
+    dataset, then refreshes the most requested series (and, on startup or
+    after a new month, the island and county seeds) through the regular
+    request path, so they land in the geocode, timeseries and raster caches.
+    Each upstream operation waits for a rate budget token and for live
+    traffic to drop to a few requests (for at most PREFETCH_MAX_WAIT
+    seconds), so prefetching rarely competes with users.
+    """
+
+    def __init__(self, interval=PREFETCH_INTERVAL, top_n=PREFETCH_TOP_N, rate=PREFETCH_RATE):
+        self.interval = interval
+        self.top_n = top_n
+        self.budget = RateBudget(rate)
+        self.counts = collections.Counter()
+        self.latest = {}
+        self._task = None
+
+    def record(self, args: dict):
+        """
+        Counts a served request towards the popularity ranking, under the
+        gazetteer name of its location so spelling variants count as one.
+        Coordinate-only requests count per grid cell (see series_args).
+        """
+        args = series_args(args)
+        if args.get("location"):
+            entry = GAZETTEER.lookup(args["location"])
+            args["location"] = entry["name"] if entry else normalize_place(args["location"])
+        self.counts[json.dumps(args, sort_keys=True)] += 1
+        if len(self.counts) > 2 * PREFETCH_TRACKED:
+            self.counts = collections.Counter(dict(self.counts.most_common(PREFETCH_TRACKED)))
+
+    def decay(self):
+        """
+        Halves every count, so the ranking follows what is asked lately.
+        """
+        self.counts = collections.Counter({key: count // 2 for key, count in self.counts.items() if count > 1})
+
+    def popular(self) -> list[dict]:
+        return [json.loads(key) for key, _ in self.counts.most_common(self.top_n)]
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        await asyncio.sleep(PREFETCH_STARTUP_DELAY)
+        first = True
+        while True:
+            try:
+                await self.cycle(include_seeds=first)
+            except Exception as e:
+                logger.warning("Prefetch cycle failed: %s", e)
+            first = False
+            await asyncio.sleep(self.interval)
+
+    async def _wait_turn(self):
+        await self.budget.acquire()
+        # Live requests go first, but a server that is never idle still gets prefetched
+        deadline = time.monotonic() + PREFETCH_MAX_WAIT
+        while HTTP_IN_FLIGHT.total() > PREFETCH_BUSY_REQUESTS and time.monotonic() < deadline:
+            await asyncio.sleep(0.5)
+
+    async def _published(self, dataset: dict, month: str) -> bool:
+        await self._wait_turn()
+        data = [{**dataset, "extent": "statewide", "range": {"start": month, "end": month}, "files": ["data_map"]}]
+        files = await get_production_list(data)
+        return bool(files) and not (isinstance(files, dict) and "error" in files)
+
+    async def detect_new_months(self) -> list[dict]:
+        """
+        Checks each watched dataset for a month newer than the latest one seen.
+
+        Returns:
+            list[dict]: The datasets with a newly published month, each with its "month".
+        """
+        updated = []
+        for dataset in DATASETS:
+            name = json.dumps(dataset, sort_keys=True)
+            known = self.latest.get(name)
+            if known is None:
+                # Startup: find the latest published month without counting it as new
+                month = datetime.date.today().strftime("%Y-%m")
+                for _ in range(PREFETCH_PROBE_MONTHS):
+                    if await self._published(dataset, month):
+                        self.latest[name] = month
+                        break
+                    month = (datetime.date.fromisoformat(f"{month}-01") - datetime.timedelta(days=1)).strftime("%Y-%m")
+                continue
+            month = next_period(known, "month")
+            if await self._published(dataset, month):
+                self.latest[name] = month
+                updated.append({**dataset, "month": month})
+        return updated
+
+    async def warm(self, args: dict):
+        await self._wait_turn()
+        try:
+            await request_from_params(dict(args))
+        except Exception as e:
+            logger.warning("Prefetch of %s failed: %s", args, e)
+
+    async def cycle(self, include_seeds: bool = False):
+        """
+        Runs one round of new-month detection and cache warming.
+        """
+        updated = await self.detect_new_months()
+        if updated:
+            logger.info("New months published: %s", [(d["datatype"], d["month"]) for d in updated])
+            for dataset in updated:
+                # Only cached series and answers reaching the new month are outdated; the store fetches their tail
+                series = timeseries_cache.discard(lambda key, _: outdated_by(dataset, key[0], key[3], key[-1]))
+                answers = answer_cache.discard(lambda _, turn: any(
+                    outdated_by(dataset, call.get("datatype"), call.get("production"), call.get("time_end"))
+                    for call in turn[0]
+                ))
+                logger.info("Dropped %d cached series and %d answers for %s", series, answers, dataset["datatype"])
+                api_params = {key: value for key, value in dataset.items() if key != "month"}
+                api_params["extent"] = "statewide"
+                if raster_cache.serves(api_params):
+                    schedule_raster_downloads(api_params, [dataset["month"]])
+
+        targets = self.popular()
+        self.decay()
+        if include_seeds or updated:
+            targets += [seed for seed in seed_args() if seed not in targets]
+        for args in targets:
+            await self.warm(args)
+
+
+prefetcher = Prefetcher()
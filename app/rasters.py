@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .geotiff import read_geotiff
+from .timeseries import GRID_CELLSIZE, GRID_NCOLS, GRID_NROWS, GRID_XMIN, GRID_YMAX, next_period
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Directory of the on-disk raster cubes; empty disables the raster cache
+RASTER_CACHE_DIR = os.getenv("RASTER_CACHE_DIR", "")
+# Periods served from rasters; a statewide map is ~14 MB, so daily cubes grow fast
+RASTER_CACHE_PERIODS = os.getenv("RASTER_CACHE_PERIODS", "month").split(",")
+# Maps downloaded in the background after a request the cubes could not serve; 0 disables
+RASTER_BACKFILL_MAPS = int(os.getenv("RASTER_BACKFILL_MAPS", "120"))
+RASTER_DOWNLOAD_CONCURRENCY = int(os.getenv("RASTER_DOWNLOAD_CONCURRENCY", "2"))
+# Slots added to a cube file each time it fills up
+RASTER_CUBE_GROWTH = int(os.getenv("RASTER_CUBE_GROWTH", "24"))
+
+
+def period_dates(start: str, end: str, period: str) -> list[str]:
+    """
+    Lists every normalized date of `period` from `start` to `end` inclusive.
+    """
+    dates = []
+    date = start
+    while date <= end:
+        dates.append(date)
+        date = next_period(date, period)
+    return dates
+
+
+def series_date_key(date: str) -> str:
+    """
+    Formats a normalized date like the keys of /raster/timeseries responses.
+    """
+    day = f"{date}-01" if len(date) == 7 else date
+    return f"{day}T00:00:00.000Z"
+
+
+def cube_name(api_params: dict) -> str:
+    """
+    Names the cube holding the statewide maps a timeseries request reads, e.g.
+    "rainfall-month-new" or "temperature-day-max".
+    """
+    variant = api_params.get("aggregation") if api_params.get("datatype") == "temperature" else api_params.get("production")
+    return "-".join(str(part) for part in (api_params.get("datatype"), api_params.get("period"), variant))
+
+
+class RasterCube:
+    """
+    Stack of statewide maps of one dataset, stored as an uncompressed,
+    memory-mapped float32 (time, row, col) array.
+
+    Maps are appended in the order they are downloaded and an index maps each
+    date to its slot, so the file only ever grows at the end. Reading a point
+    timeseries touches one pixel per map and an area aggregate only the rows
+    it covers, all through the OS page cache.
+    """
+
+    def __init__(self, path: str, shape: tuple[int, int] = (GRID_NROWS, GRID_NCOLS)):
+        self.path = path
+        self.shape = shape
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._index_path = os.path.join(path, "index.json")
+        self._data_path = os.path.join(path, "cube.f32")
+        self.slots = {}
+        self.capacity = 0
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r") as file:
+                index = json.load(file)
+            if tuple(index["shape"]) == tuple(shape):
+                self.slots, self.capacity = index["slots"], index["capacity"]
+        self._data = self._open()
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, date):
+        return date in self.slots
+
+    def _open(self) -> np.memmap | None:
+        if not self.capacity:
+            return None
+        return np.memmap(self._data_path, dtype=np.float32, mode="r+", shape=(self.capacity, *self.shape))
+
+    def _save_index(self):
+        tmp = self._index_path + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump({"shape": list(self.shape), "capacity": self.capacity, "slots": self.slots}, file)
+        os.replace(tmp, self._index_path)
+
+    def missing(self, dates: list[str]) -> list[str]:
+        """
+        Returns the dates whose maps are not in the cube.
+        """
+        return [date for date in dates if date not in self.slots]
+
+    def last_date(self) -> str | None:
+        return max(self.slots) if self.slots else None
+
+    def append(self, date: str, array: np.ndarray):
+        """
+        Stores the map of `date`, replacing any earlier map of that date.
+        """
+        if array.shape != self.shape:
+            raise ValueError(f"Raster shape {array.shape} does not match the grid {self.shape}")
+        with self._lock:
+            slot = self.slots.get(date, len(self.slots))
+            if slot >= self.capacity:
+                self.capacity += RASTER_CUBE_GROWTH
+                with open(self._data_path, "ab") as file:
+                    file.truncate(self.capacity * self.shape[0] * self.shape[1] * 4)
+                self._data = self._open()
+            self._data[slot] = array
+            self._data.flush()
+            self.slots = {**self.slots, date: slot}
+            self._save_index()
+
+    def point_series(self, row: int, col: int, dates: list[str]) -> dict:
+        """
+        Reads the values of one grid cell for the given (stored) dates.
+
+        Returns:
+            dict: Date/value pairs like /raster/timeseries, leaving out no-data values.
+        """
+        slots = [self.slots[date] for date in dates]
+        values = self._data[slots, row, col] if slots else np.empty(0, dtype=np.float32)
+        return {
+            series_date_key(date): round(float(value), 4)
+            for date, value in zip(dates, values)
+            if np.isfinite(value)
+        }
+
+    def stack(self, dates: list[str], rows: slice = slice(None), cols: slice = slice(None)) -> np.ndarray:
+        """
+        Returns the (time, row, col) block of the given dates within a window of the grid.
+        """
+        slots = [self.slots[date] for date in dates]
+        if not slots:
+            size = len(range(*rows.indices(self.shape[0]))), len(range(*cols.indices(self.shape[1])))
+            return np.empty((0, *size), dtype=np.float32)
+        return np.stack([self._data[slot, rows, cols] for slot in slots])
+
+    def area_mean(self, dates: list[str], rows: slice, cols: slice) -> dict:
+        """
+        Averages the valid pixels of a grid window for each date.
+        """
+        block = self.stack(dates, rows, cols).reshape(len(dates), -1)
+        with np.errstate(invalid="ignore"):
+            means = np.nanmean(block, axis=1) if block.size else np.full(len(dates), np.nan)
+        return {series_date_key(date): round(float(value), 4) for date, value in zip(dates, means) if np.isfinite(value)}
+
+
+class RasterCache:
+    """
+    The raster cubes under RASTER_CACHE_DIR, opened on first use.
+    """
+
+    def __init__(self, directory: str, periods: list[str] = RASTER_CACHE_PERIODS):
+        self.directory = directory
+        self.periods = periods
+        self._cubes = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def serves(self, api_params: dict) -> bool:
+        """
+        Tells whether requests like `api_params` can be answered from the raster cubes.
+        """
+        return self.enabled and api_params.get("extent") == "statewide" and api_params.get("period") in self.periods
+
+    def cube(self, api_params: dict) -> RasterCube:
+        name = cube_name(api_params)
+        if name not in self._cubes:
+            self._cubes[name] = RasterCube(os.path.join(self.directory, name))
+        return self._cubes[name]
+
+    def store(self, api_params: dict, date: str, data: bytes):
+        """
+        Decodes a downloaded statewide GeoTIFF and appends it to its cube.
+        Meant to run in a worker thread: decoding an LZW map takes seconds.
+        """
+        array, geo = read_geotiff(data)
+        if not (
+            abs(geo["xmin"] - GRID_XMIN) < GRID_CELLSIZE / 2
+            and abs(geo["ymax"] - GRID_YMAX) < GRID_CELLSIZE / 2
+            and abs(geo["xres"] - GRID_CELLSIZE) < 1e-6
+        ):
+            raise ValueError(f"Raster georeferencing {geo} does not match the statewide grid")
+        self.cube(api_params).append(date, array)
+
+    def stats(self) -> dict:
+        return {name: len(cube) for name, cube in self._cubes.items()}
+
+
+raster_cache = RasterCache(RASTER_CACHE_DIR)
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import os
+import warnings
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .cache import LRUCache
+from .geocode import GAZETTEER
+from .rasters import RasterCube, series_date_key
+from .timeseries import GRID_CELLSIZE, GRID_NCOLS, GRID_NROWS, GRID_XMIN, GRID_YMAX
+
+# Load environment variables from .env file
+load_dotenv()
+
+REGIONS_PATH = os.path.join(os.path.dirname(__file__), "data", "hawaii_regions.json")
+# Districts have no boundaries in the gazetteer; they cover this radius around their center
+REGION_DISTRICT_RADIUS_KM = float(os.getenv("REGION_DISTRICT_RADIUS_KM", "15"))
+REGION_CACHE_SIZE = int(os.getenv("REGION_CACHE_SIZE", "256"))
+# Maps reduced at once; bounds the memory of an aggregate to a few hundred MB at most
+REGION_BATCH = int(os.getenv("REGION_BATCH", "24"))
+
+PERCENTILES = (10, 50, 90)
+REGION_KINDS = ("state", "county", "island", "district")
+
+with open(REGIONS_PATH, "r") as file:
+    REGIONS = json.load(file)
+ISLANDS = list(REGIONS["islands"])
+
+# Per-date aggregates of each (region, cube), extended as new dates are asked for
+region_cache = LRUCache(maxsize=REGION_CACHE_SIZE)
+_island_labels = None
+
+
+def island_labels() -> np.ndarray:
+    """
+    Labels every statewide grid cell with 1 + the index of its island's box in
+    ISLANDS, or 0 for none. Boxes listed later win where boxes overlap.
+    """
+    global _island_labels
+    if _island_labels is None:
+        lats = GRID_YMAX - (np.arange(GRID_NROWS) + 0.5) * GRID_CELLSIZE
+        lngs = GRID_XMIN + (np.arange(GRID_NCOLS) + 0.5) * GRID_CELLSIZE
+        labels = np.zeros((GRID_NROWS, GRID_NCOLS), dtype=np.int8)
+        for i, (lat_min, lat_max, lng_min, lng_max) in enumerate(REGIONS["islands"].values()):
+            rows = (lats >= lat_min) & (lats <= lat_max)
+            cols = (lngs >= lng_min) & (lngs <= lng_max)
+            labels[np.ix_(rows, cols)] = i + 1
+        _island_labels = labels
+    return _island_labels
+
+
+def island_at(lat: float, lng: float) -> str | None:
+    """
+    Names the island whose box contains a point, with parts such as
+    Kalaupapa reported as their island (Molokai). Boxes listed later win
+    where boxes overlap, like island_labels.
+    """
+    found = None
+    for name, (lat_min, lat_max, lng_min, lng_max) in REGIONS["islands"].items():
+        if lat_min <= lat <= lat_max and lng_min <= lng <= lng_max:
+            found = name
+    for island, parts in REGIONS["island_parts"].items():
+        if found in parts:
+            return island
+    return found
+
+
+def region_for_location(location: str) -> dict | None:
+    """
+    Resolves a place name to the region it denotes, if it is a state, county,
+    island or district in the gazetteer.
+
+    Returns:
+        dict | None: {"name", "kind"} plus the "islands" it covers, or the
+                     "center" and "radius_km" of a district.
+    """
+    entry = GAZETTEER.lookup(location)
+    if entry is None or entry["kind"] not in REGION_KINDS:
+        return None
+    region = {"name": entry["name"], "kind": entry["kind"]}
+    if entry["kind"] == "state":
+        region["islands"] = ISLANDS
+    elif entry["kind"] == "county":
+        region["islands"] = REGIONS["counties"].get(entry["county"], [])
+    elif entry["kind"] == "island":
+        name = entry["name"] if entry["name"] in REGIONS["islands"] else f"{entry['name']} Island"
+        region["islands"] = REGIONS["island_parts"].get(name, [name])
+    else:
+        region["center"] = (entry["lat"], entry["lng"])
+        region["radius_km"] = REGION_DISTRICT_RADIUS_KM
+    return region
+
+
+def region_mask(region: dict, land: np.ndarray) -> np.ndarray:
+    """
+    Selects the land cells of the statewide grid that belong to a region.
+    """
+    labels = island_labels()
+    if "islands" in region:
+        ids = [ISLANDS.index(name) + 1 for name in region["islands"] if name in ISLANDS]
+        return np.isin(labels, ids) & land
+    lat, lng = region["center"]
+    lats = GRID_YMAX - (np.arange(GRID_NROWS) + 0.5) * GRID_CELLSIZE
+    lngs = GRID_XMIN + (np.arange(GRID_NCOLS) + 0.5) * GRID_CELLSIZE
+    km_lat = (lats[:, None] - lat) * 111.32
+    km_lng = (lngs[None, :] - lng) * 111.32 * np.cos(np.radians(lat))
+    disk = km_lat ** 2 + km_lng ** 2 <= region["radius_km"] ** 2
+    # Keep the district on the island of its center
+    row = min(max(int((GRID_YMAX - lat) // GRID_CELLSIZE), 0), GRID_NROWS - 1)
+    col = min(max(int((lng - GRID_XMIN) // GRID_CELLSIZE), 0), GRID_NCOLS - 1)
+    if labels[row, col]:
+        disk &= labels == labels[row, col]
+    return disk & land
+
+
+class RegionAggregate:
+    """
+    Area statistics of one region over one raster cube.
+
+    The region's cells are reduced to a bounding window plus a mask inside it,
+    so each map only reads the rows it covers. Per-date results are kept, so
+    a later question about the same region only reduces the dates not seen yet.
+    """
+
+    def __init__(self, cube: RasterCube, region: dict):
+        self.cube = cube
+        reference = cube.stack([min(cube.slots)])[0]
+        mask = region_mask(region, np.isfinite(reference))
+        rows, cols = np.nonzero(mask)
+        self.pixels = int(len(rows))
+        if self.pixels:
+            self.rows = slice(int(rows.min()), int(rows.max()) + 1)
+            self.cols = slice(int(cols.min()), int(cols.max()) + 1)
+            self.mask = mask[self.rows, self.cols]
+        self.stats = {}
+
+    def _reduce(self, dates: list[str]):
+        for i in range(0, len(dates), REGION_BATCH):
+            batch = dates[i:i + REGION_BATCH]
+            values = self.cube.stack(batch, self.rows, self.cols)[:, self.mask]
+            with warnings.catch_warnings():
+                # All-NaN maps just yield NaN statistics
+                warnings.simplefilter("ignore", RuntimeWarning)
+                if np.isfinite(values).all():
+                    means = values.mean(axis=1)
+                    percentiles = np.percentile(values, PERCENTILES, axis=1)
+                else:
+                    means = np.nanmean(values, axis=1)
+                    percentiles = np.nanpercentile(values, PERCENTILES, axis=1)
+            for j, date in enumerate(batch):
+                self.stats[date] = (float(means[j]), *(float(p) for p in percentiles[:, j]))
+
+    def series(self, dates: list[str]) -> tuple[dict, dict]:
+        """
+        Returns the area mean and the 10th/50th/90th percentiles of each date.
+
+        Returns:
+            tuple[dict, dict]: Date/mean pairs like /raster/timeseries, and date/percentile dicts.
+        """
+        if not self.pixels:
+            return {}, {}
+        todo = [date for date in dates if date not in self.stats]
+        if todo:
+            self._reduce(todo)
+        means, percentiles = {}, {}
+        for date in dates:
+            mean, *values = self.stats[date]
+            if np.isfinite(mean):
+                key = series_date_key(date)
+                means[key] = round(mean, 4)
+                percentiles[key] = {f"p{p}": round(value, 4) for p, value in zip(PERCENTILES, values)}
+        return means, percentiles
+
+
+async def region_aggregate(cube: RasterCube, region: dict) -> RegionAggregate:
+    """
+    Returns the cached aggregate of `region` over `cube`, building its mask on
+    first use in a worker thread, off the event loop.
+    """
+    key = (region["name"], region["kind"], cube.path)
+    aggregate = region_cache.get(key)
+    if aggregate is None:
+        # Masking the full statewide grid takes tens of milliseconds
+        aggregate = await asyncio.to_thread(RegionAggregate, cube, region)
+        region_cache.set(key, aggregate)
+    return aggregate
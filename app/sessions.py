@@ -0,0 +1,202 @@
+import json
+import os
+import re
+import uuid
+
+from dotenv import load_dotenv
+from google.genai import types
+
+from .cache import LRUCache
+from .extract import EXPLANATION, FORECAST, asks_for_several_series, extract_parameters
+from .geocode import normalize_place
+from .timeseries import normalize_date, series_args
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Conversations kept, least recently used evicted first, and how long an idle one lives
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+# Question/answer pairs sent verbatim; older ones are folded into the rolling summary
+SESSION_RECENT_TURNS = int(os.getenv("SESSION_RECENT_TURNS", "4"))
+SESSION_SUMMARY_CHARS = int(os.getenv("SESSION_SUMMARY_CHARS", "1500"))
+
+# Short questions that only change part of the previous request
+FOLLOW_UP = r"what about|how about|same|instead|now|also|then|again"
+FOLLOW_UP_MAX_WORDS = 8
+
+session_store = LRUCache(maxsize=SESSION_MAX, ttl=SESSION_TTL)
+
+
+def first_sentence(text: str, limit: int = 200) -> str:
+    sentence = re.split(r"(?<=[.!?])\s", text.strip(), maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit - 1] + "…"
+
+
+def _range(args: dict, period: str) -> tuple[str, str]:
+    # The defaults of request_from_params
+    start = args.get("time_start") or "1990-01-01"
+    end = args.get("time_end") or "9999-12-31"
+    return normalize_date(start, period), normalize_date(end, period)
+
+
+class Session:
+    """
+    Server-side state of one conversation.
+
+    Keeps the recent questions and answers as structured contents, older ones
+    folded into a short rolling summary, plus the get_api_parameters calls of
+    the last data answer and what they fetched. A follow-up then only sends
+    the model the new question (and new data), and questions about a range
+    already fetched are answered from the session without going to HCDP.
+    """
+
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.turns = []
+        self.summary = ""
+        # (args, extra_params with "data", (start, end) the data covers) of each
+        # series of the last data answer
+        self.series = []
+
+    def contents(self, prompt: str) -> list[types.Content]:
+        """
+        Builds the model contents for a new question: the summary, the recent turns and the question.
+        """
+        contents = []
+        for question, answer in self.turns:
+            contents.append(types.Content(role="user", parts=[types.Part(text=question)]))
+            contents.append(types.Content(role="model", parts=[types.Part(text=answer)]))
+        contents.append(types.Content(role="user", parts=[types.Part(text=prompt)]))
+        if self.summary:
+            contents[0].parts.insert(0, types.Part(text=f"Earlier in this conversation:\n{self.summary}"))
+        return contents
+
+    def texts(self) -> list[str]:
+        """
+        The conversation so far as plain text, for the answer cache key.
+        """
+        texts = [text for turn in self.turns for text in turn]
+        return [self.summary, *texts] if self.summary else texts
+
+    def record(self, question: str, answer: str, calls: list[dict]):
+        """
+        Appends a turn, folding the oldest ones into the summary once there are
+        more than SESSION_RECENT_TURNS.
+        """
+        if calls:
+            # Lets the model resolve references to the data in later questions
+            answer = f"{answer}\n[get_api_parameters: {json.dumps(calls, default=str)}]"
+        self.turns.append((question, answer))
+        while len(self.turns) > SESSION_RECENT_TURNS:
+            old_question, old_answer = self.turns.pop(0)
+            self.summary = f"{self.summary}\n- {first_sentence(old_question)} -> {first_sentence(old_answer)}".strip()
+            if len(self.summary) > SESSION_SUMMARY_CHARS:
+                # Drop the oldest lines
+                cut = self.summary.find("\n", len(self.summary) - SESSION_SUMMARY_CHARS)
+                self.summary = self.summary[cut + 1:] if cut >= 0 else self.summary[-SESSION_SUMMARY_CHARS:]
+
+    def follow_up_calls(self, prompt: str) -> list[dict] | None:
+        """
+        Resolves a short follow-up like "what about 2015?" or "how about Hilo?"
+        against the last data answer: what the question names replaces the
+        arguments of each previous call and everything else carries over.
+
+        Returns:
+            list[dict] | None: The get_api_parameters arguments, or None if the
+                               question isn't a follow-up this can resolve.
+        """
+        if not self.series:
+            return None
+        text = normalize_place(prompt)
+        if len(text.split()) > FOLLOW_UP_MAX_WORDS or re.search(rf"\b(?:{EXPLANATION}|{FORECAST})\b", text):
+            return None
+        # Several series can't be told apart by merging into the previous calls; the model handles them
+        if asks_for_several_series(prompt):
+            return None
+        args, _ = extract_parameters(prompt)
+        if not args or not (re.search(rf"\b(?:{FOLLOW_UP})\b", text) or set(args) <= {"time_start", "time_end", "period"}):
+            return None
+        calls = []
+        for previous, _, _ in self.series:
+            call = {**previous, **args}
+            if "location" in args:
+                # The previous place's coordinates would override the geocode of the new one
+                for key in ("lat", "lng", "row", "col", "is_region"):
+                    if key not in args:
+                        call.pop(key, None)
+            if call.get("datatype") != "temperature":
+                call.pop("aggregation", None)
+            calls.append(call)
+        return calls
+
+    def _covering(self, args: dict) -> tuple | None:
+        # The remembered series `args` asks for part of, if any
+        period = args.get("period") or "month"
+        start, end = _range(args, period)
+        for previous, extra_params, (covered_start, covered_end) in self.series:
+            if series_args(previous) != series_args(args) or (previous.get("period") or "month") != period:
+                continue
+            if covered_start <= start and end <= covered_end:
+                return previous, extra_params, (covered_start, covered_end)
+        return None
+
+    def remember(self, calls: list[dict], series: list[dict]):
+        """
+        Keeps the calls of the last data answer and what each fetched. A call
+        answered from a wider series fetched earlier keeps that whole series,
+        so "what about 2005?" then "and 2007?" still doesn't go to HCDP.
+        """
+        remembered = []
+        for args, extra_params in zip(calls, series):
+            covering = self._covering(args)
+            if covering is not None:
+                extra_params, covered = covering[1], covering[2]
+            else:
+                covered = _range(args, args.get("period") or "month")
+            remembered.append((args, extra_params, covered))
+        self.series = remembered
+
+    def reusable_result(self, args: dict) -> dict | None:
+        """
+        Returns the data of a series fetched earlier in the session, cut to the
+        range of `args`, if it is the same series over a range that covers it.
+
+        Returns:
+            dict | None: A request_from_params-like result, or None.
+        """
+        covering = self._covering(args)
+        if covering is None:
+            return None
+        _, extra_params, _ = covering
+        period = args.get("period") or "month"
+        start, end = _range(args, period)
+        inside = lambda key: start <= normalize_date(key, period) <= end
+        data = {key: value for key, value in extra_params["data"].items() if inside(key)}
+        reused = {
+            key: value for key, value in extra_params.items()
+            if key not in ("data", "nearby_stations", "series")
+        }
+        if reused.get("percentiles"):
+            reused["percentiles"] = {key: value for key, value in reused["percentiles"].items() if inside(key)}
+        return {"data": data, "extra_params": reused}
+
+def get_session(session_id: str | None, messages: list | None = None) -> Session:
+    """
+    Returns the session of `session_id`, or starts one (under that ID if given)
+    seeded with the earlier messages of a client that sends the whole history.
+    """
+    session = session_store.get(session_id) if session_id else None
+    if session is None:
+        session = Session(session_id or uuid.uuid4().hex)
+        question = None
+        # Questions left unanswered are dropped, so user and model turns alternate
+        for message in (messages or [])[:-1]:
+            if message.role == "user":
+                question = message.content
+            elif question is not None:
+                session.record(question, message.content, [])
+                question = None
+    # Refreshes its TTL and LRU position
+    session_store.set(session.id, session)
+    return session
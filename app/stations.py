@@ -0,0 +1,318 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .cache import LRUCache
+from .hcdp import get_stations
+from .timeseries import normalize_date, timeseries_ttl
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+STATION_PAGE_SIZE = int(os.getenv("STATION_PAGE_SIZE", "10000"))
+# Pages requested at once while paging through a query
+STATION_CONCURRENCY = int(os.getenv("STATION_CONCURRENCY", "4"))
+# Station metadata changes rarely; reload it once a day
+STATION_METADATA_TTL = float(os.getenv("STATION_METADATA_TTL", str(24 * 3600)))
+# Side of the spatial index buckets, in degrees
+STATION_INDEX_CELL = float(os.getenv("STATION_INDEX_CELL", "0.1"))
+STATION_CACHE_SIZE = int(os.getenv("STATION_CACHE_SIZE", "1024"))
+
+EARTH_RADIUS_KM = 6371.0
+# Shortest ground distance spanned by one degree across Hawaii (longitude at ~23°N)
+_KM_PER_DEGREE = 2 * math.pi * EARTH_RADIUS_KM / 360 * math.cos(math.radians(23))
+
+station_cache = LRUCache(maxsize=STATION_CACHE_SIZE)
+
+
+def metadata_query() -> dict:
+    """
+    Builds the /stations query for every station metadata document.
+    """
+    return {"name": "hcdp_station_metadata"}
+
+
+def station_value_query(
+    datatype: str,
+    period: str,
+    station_id: str | None = None,
+    start: str | None = None,
+    end: str | None = None,
+    fill: str = "partial",
+    production: str | None = "new",
+    aggregation: str | None = None,
+) -> dict:
+    """
+    Builds a /stations query for station values from typed arguments.
+
+    Rainfall takes a production and temperature an aggregation; `start` and
+    `end` become inclusive $gte/$lte bounds on the date, truncated to the
+    period like the gridded timeseries.
+    """
+    match = {
+        "name": "hcdp_station_value",
+        "value.datatype": datatype,
+        "value.period": period,
+        "value.fill": fill,
+    }
+    if station_id is not None:
+        match["value.station_id"] = station_id
+    if datatype == "rainfall" and production:
+        match["value.production"] = production
+    if datatype == "temperature" and aggregation:
+        match["value.aggregation"] = aggregation
+    clauses = [match]
+    if start is not None:
+        clauses.append({"value.date": {"$gte": normalize_date(start, period)}})
+    if end is not None:
+        clauses.append({"value.date": {"$lte": normalize_date(end, period)}})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def documents(response) -> list[dict]:
+    """
+    Returns the documents of a /stations response.
+    """
+    if isinstance(response, dict):
+        return response.get("result", [])
+    return response or []
+
+
+async def query_stations(query: dict, page_size: int = STATION_PAGE_SIZE, concurrency: int = STATION_CONCURRENCY) -> list[dict]:
+    """
+    Runs a /stations query to exhaustion.
+
+    The first page is requested alone; only if it comes back full are the
+    following pages requested `concurrency` offsets at a time, until the first
+    short page. A query that fits one page costs a single request and larger
+    ones need roughly pages / concurrency more round trips.
+
+    Returns:
+        list[dict]: Every matching document, in offset order, in a new list.
+    """
+    q = json.dumps(query)
+    # Coalesced callers share response bodies, so the first page is copied before it is extended
+    results = list(documents(await get_stations(q, limit=page_size, offset=0)))
+    if len(results) < page_size:
+        return results
+    offset = page_size
+    while True:
+        pages = await asyncio.gather(*(
+            get_stations(q, limit=page_size, offset=offset + i * page_size) for i in range(concurrency)
+        ))
+        for page in pages:
+            docs = documents(page)
+            results.extend(docs)
+            if len(docs) < page_size:
+                return results
+        offset += concurrency * page_size
+
+
+def station_record(value: dict) -> dict | None:
+    """
+    Flattens a station metadata document value to {id, name, lat, lng, ...}.
+    """
+    station_id = value.get(value.get("id_field", "skn")) or value.get("station_id") or value.get("skn")
+    try:
+        lat, lng = float(value["lat"]), float(value["lng"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if station_id is None:
+        return None
+    return {
+        "id": str(station_id),
+        "name": value.get("name"),
+        "lat": lat,
+        "lng": lng,
+        "elevation_m": value.get("elevation_m"),
+        "island": value.get("island"),
+        "station_group": value.get("station_group"),
+    }
+
+
+def haversine_km(lat, lng, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """
+    Great-circle distances in km from one point to arrays of points.
+    """
+    lat, lng, lats, lngs = map(np.radians, (lat, lng, lats, lngs))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class StationIndex:
+    """
+    In-memory spatial index of stations bucketed on a regular lat/lng grid.
+
+    Nearest-station queries scan the buckets in growing rings around the point
+    and stop once no unvisited bucket can hold anything closer, so they touch
+    a handful of stations instead of the whole network.
+    """
+
+    def __init__(self, stations: list[dict], cell: float = STATION_INDEX_CELL):
+        self.stations = stations
+        self.cell = cell
+        self.lats = np.array([station["lat"] for station in stations], dtype=np.float64)
+        self.lngs = np.array([station["lng"] for station in stations], dtype=np.float64)
+        self._buckets = {}
+        for i, station in enumerate(stations):
+            self._buckets.setdefault(self._bucket(station["lat"], station["lng"]), []).append(i)
+        keys = list(self._buckets) or [(0, 0)]
+        rows, cols = zip(*keys)
+        self._extent = (min(rows), max(rows), min(cols), max(cols))
+
+    def __len__(self):
+        return len(self.stations)
+
+    def _bucket(self, lat, lng) -> tuple[int, int]:
+        return math.floor(lat / self.cell), math.floor(lng / self.cell)
+
+    def _ring(self, row, col, radius):
+        if radius == 0:
+            yield row, col
+            return
+        for c in range(col - radius, col + radius + 1):
+            yield row - radius, c
+            yield row + radius, c
+        for r in range(row - radius + 1, row + radius):
+            yield r, col - radius
+            yield r, col + radius
+
+    def nearest(self, lat: float, lng: float, n: int = 5, max_km: float | None = None) -> list[dict]:
+        """
+        Returns up to `n` stations closest to (lat, lng), nearest first, each
+        with its distance_km.
+        """
+        if not self.stations or n <= 0:
+            return []
+        row, col = self._bucket(lat, lng)
+        rmin, rmax, cmin, cmax = self._extent
+        max_radius = max(abs(row - rmin), abs(row - rmax), abs(col - cmin), abs(col - cmax))
+        candidates = []
+        for radius in range(max_radius + 1):
+            for key in self._ring(row, col, radius):
+                candidates.extend(self._buckets.get(key, ()))
+            # Anything not yet visited is at least `radius` buckets away
+            reach = radius * self.cell * _KM_PER_DEGREE
+            if len(candidates) >= n:
+                distances = haversine_km(lat, lng, self.lats[candidates], self.lngs[candidates])
+                if np.partition(distances, n - 1)[n - 1] <= reach:
+                    break
+            if max_km is not None and reach >= max_km:
+                break
+        best = haversine_km(lat, lng, self.lats[candidates], self.lngs[candidates])
+        order = np.argsort(best)[:n]
+        return [
+            {**self.stations[candidates[i]], "distance_km": round(float(best[i]), 2)}
+            for i in order
+            if max_km is None or best[i] <= max_km
+        ]
+
+
+_station_index: StationIndex | None = None
+_station_index_loaded = 0.0
+_station_index_lock = asyncio.Lock()
+_station_index_reload: asyncio.Task | None = None
+
+
+def loaded_station_index() -> StationIndex | None:
+    """
+    Returns the station index if it has been loaded, without fetching it.
+
+    An index older than STATION_METADATA_TTL is still returned, while a
+    reload runs in the background.
+    """
+    global _station_index_reload
+    stale = time.monotonic() - _station_index_loaded >= STATION_METADATA_TTL
+    if _station_index is not None and stale and (_station_index_reload is None or _station_index_reload.done()):
+        _station_index_reload = asyncio.create_task(preload_station_index())
+    return _station_index
+
+
+async def get_station_index() -> StationIndex:
+    """
+    Returns the station index, loading hcdp_station_metadata on first use and
+    again once it is older than STATION_METADATA_TTL.
+    """
+    global _station_index, _station_index_loaded
+    if _station_index is not None and time.monotonic() - _station_index_loaded < STATION_METADATA_TTL:
+        return _station_index
+    async with _station_index_lock:
+        if _station_index is None or time.monotonic() - _station_index_loaded >= STATION_METADATA_TTL:
+            docs = await query_stations(metadata_query())
+            stations = {}
+            for doc in docs:
+                record = station_record(doc.get("value", {}))
+                if record is not None:
+                    stations.setdefault(record["id"], record)
+            _station_index = StationIndex(list(stations.values()))
+            _station_index_loaded = time.monotonic()
+            logger.info("Loaded %d stations into the station index", len(_station_index))
+    return _station_index
+
+
+async def preload_station_index():
+    """
+    Loads the station index in the background, logging instead of raising on failure.
+    """
+    try:
+        await get_station_index()
+    except Exception as e:
+        logger.warning("Error loading station metadata: %s", e)
+
+
+async def nearest_stations(lat: float, lng: float, n: int = 5, max_km: float | None = None) -> list[dict]:
+    """
+    Returns the `n` stations closest to (lat, lng).
+    """
+    index = await get_station_index()
+    return index.nearest(lat, lng, n=n, max_km=max_km)
+
+
+async def get_station_timeseries(
+    station_id: str,
+    datatype: str,
+    period: str,
+    start: str,
+    end: str,
+    fill: str = "partial",
+    production: str | None = "new",
+    aggregation: str | None = None,
+) -> dict:
+    """
+    Fetches the observed values of one station between two dates.
+
+    Returns:
+        dict: Date/value pairs in date order, like /raster/timeseries.
+    """
+    query = station_value_query(datatype, period, station_id, start, end, fill, production, aggregation)
+    key = json.dumps(query, sort_keys=True)
+    data = station_cache.get(key)
+    if data is not None:
+        return data
+    docs = await query_stations(query)
+    values = (doc.get("value", {}) for doc in docs)
+    data = dict(sorted((value["date"], value.get("value")) for value in values if "date" in value))
+    station_cache.set(key, data, ttl=timeseries_ttl(normalize_date(end, period)))
+    return data
+
+
+async def nearest_station_timeseries(lat: float, lng: float, datatype: str, period: str, start: str, end: str, n: int = 3, **kwargs) -> list[dict]:
+    """
+    Fetches the series of the `n` stations closest to (lat, lng) concurrently.
+
+    Returns:
+        list[dict]: The stations, nearest first, each with its "data".
+    """
+    stations = await nearest_stations(lat, lng, n=n)
+    series = await asyncio.gather(*(
+        get_station_timeseries(station["id"], datatype, period, start, end, **kwargs) for station in stations
+    ))
+    return [{**station, "data": data} for station, data in zip(stations, series)]
@@ -0,0 +1,143 @@
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Number of points kept in the downsampled series handed to the model
+SUMMARY_SERIES_POINTS = int(os.getenv("SUMMARY_SERIES_POINTS", "60"))
+
+UNITS = {"rainfall": "mm", "temperature": "°C"}
+# Hawaii's wet season (hoʻoilo) runs November through April
+WET_SEASON_MONTHS = np.array([11, 12, 1, 2, 3, 4])
+PERIODS_PER_YEAR = {"month": 12, "day": 365}
+
+
+def to_arrays(data: dict) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Converts HCDP date/value pairs to sorted datetime64[D] and float64 arrays.
+    Missing values become NaN.
+    """
+    dates = np.array([key[:10] for key in data], dtype="datetime64[D]")
+    values = np.array([np.nan if value is None else value for value in data.values()], dtype=np.float64)
+    order = np.argsort(dates, kind="stable")
+    return dates[order], values[order]
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    Returns:
+        np.ndarray: Indices of the points to keep, always including the first and last.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    edges = (np.arange(threshold - 1) * every).astype(int) + 1
+    edges[-1] = n - 1
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_start, next_stop = stop, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_stop].mean()
+        avg_y = y[next_start:next_stop].mean()
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def _round(value, digits=2):
+    return None if value is None or not np.isfinite(value) else round(float(value), digits)
+
+
+def summarize_timeseries(data: dict, datatype: str, period: str = "month", points: int = SUMMARY_SERIES_POINTS) -> dict:
+    """
+    Reduces an HCDP timeseries to the statistics the model needs to comment on it.
+
+    Produces annual aggregates (totals for rainfall, means for temperature),
+    wet/dry season means, the per-decade trend of complete years, extremes,
+    the latest values against their monthly climatology and an LTTB-downsampled
+    series, instead of every date/value pair.
+
+    Args:
+        data (dict): Date/value pairs as returned by /raster/timeseries.
+        datatype (str): rainfall or temperature.
+        period (str): Time resolution of the series, day or month.
+        points (int): Number of points of the downsampled series.
+
+    Returns:
+        dict: A compact, JSON-serializable summary.
+    """
+    dates, values = to_arrays(data)
+    valid = np.isfinite(values)
+    dates, values = dates[valid], values[valid]
+    summary = {"datatype": datatype, "period": period, "units": UNITS.get(datatype), "count": int(len(values))}
+    if not len(values):
+        return summary
+
+    years = dates.astype("datetime64[Y]").astype(int) + 1970
+    months = dates.astype("datetime64[M]").astype(int) % 12 + 1
+
+    year_ids, year_index = np.unique(years, return_inverse=True)
+    year_counts = np.bincount(year_index)
+    year_sums = np.bincount(year_index, weights=values)
+    annual = year_sums if datatype == "rainfall" else year_sums / year_counts
+    complete = year_counts >= 0.9 * PERIODS_PER_YEAR.get(period, 12)
+
+    month_counts = np.bincount(months, minlength=13)[1:]
+    month_sums = np.bincount(months, weights=values, minlength=13)[1:]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        climatology = month_sums / month_counts
+    wet = np.isin(months, WET_SEASON_MONTHS)
+
+    summary.update({
+        "start": str(dates[0]),
+        "end": str(dates[-1]),
+        "mean": _round(values.mean()),
+        "annual": {
+            "label": "total" if datatype == "rainfall" else "mean",
+            "values": {int(year): _round(value) for year, value in zip(year_ids, annual)},
+            "incomplete_years": [int(year) for year in year_ids[~complete]],
+        },
+        "seasonal_mean": {
+            "wet_nov_apr": _round(values[wet].mean()) if wet.any() else None,
+            "dry_may_oct": _round(values[~wet].mean()) if (~wet).any() else None,
+        },
+        "monthly_climatology": {int(month): _round(value) for month, value in zip(range(1, 13), climatology)},
+        "extremes": {
+            "max": {"date": str(dates[values.argmax()]), "value": _round(values.max())},
+            "min": {"date": str(dates[values.argmin()]), "value": _round(values.min())},
+        },
+    })
+
+    if complete.sum() >= 2:
+        full_years, full_annual = year_ids[complete], annual[complete]
+        slope = np.polyfit(full_years, full_annual, 1)[0]
+        summary["trend_per_decade"] = _round(slope * 10)
+        summary["extremes"]["highest_year"] = {"year": int(full_years[full_annual.argmax()]), "value": _round(full_annual.max())}
+        summary["extremes"]["lowest_year"] = {"year": int(full_years[full_annual.argmin()]), "value": _round(full_annual.min())}
+        summary["latest_complete_year_anomaly"] = {
+            "year": int(full_years[-1]),
+            "value": _round(full_annual[-1] - full_annual.mean()),
+        }
+
+    latest_expected = climatology[months[-1] - 1]
+    summary["latest_anomaly"] = {
+        "date": str(dates[-1]),
+        "value": _round(values[-1]),
+        "anomaly": _round(values[-1] - latest_expected),
+        "percent_of_normal": _round(100 * values[-1] / latest_expected, 1) if latest_expected else None,
+    }
+
+    keep = lttb(dates.astype(np.float64), values, points)
+    summary["series"] = {str(dates[i]): _round(values[i]) for i in keep}
+    return summary
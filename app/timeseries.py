@@ -0,0 +1,225 @@
+import datetime
+import os
+import sqlite3
+
+from dotenv import load_dotenv
+
+from .cache import LRUCache
+
+# Load environment variables from .env file
+load_dotenv()
+
+# HCDP statewide raster grid (250 m, WGS84), upper-left corner and cell size
+GRID_XMIN = float(os.getenv("HCDP_GRID_XMIN", "-159.816144"))
+GRID_YMAX = float(os.getenv("HCDP_GRID_YMAX", "22.269202"))
+GRID_CELLSIZE = float(os.getenv("HCDP_GRID_CELLSIZE", "0.00225"))
+GRID_NCOLS = int(os.getenv("HCDP_GRID_NCOLS", "2288"))
+GRID_NROWS = int(os.getenv("HCDP_GRID_NROWS", "1520"))
+
+TIMESERIES_CACHE_SIZE = int(os.getenv("TIMESERIES_CACHE_SIZE", "2048"))
+# Historical months never change; the trailing ones can still be published or revised
+TIMESERIES_TTL = float(os.getenv("TIMESERIES_TTL", str(7 * 24 * 3600)))
+TIMESERIES_RECENT_TTL = float(os.getenv("TIMESERIES_RECENT_TTL", str(6 * 3600)))
+TIMESERIES_RECENT_DAYS = int(os.getenv("TIMESERIES_RECENT_DAYS", "93"))
+TIMESERIES_STORE_PATH = os.getenv("TIMESERIES_STORE_PATH", ".cache/timeseries.sqlite3")
+
+timeseries_cache = LRUCache(maxsize=TIMESERIES_CACHE_SIZE)
+
+
+def snap_to_grid(lat, lng) -> tuple[int, int] | None:
+    """
+    Snaps a coordinate to the (row, col) of the statewide grid cell containing it.
+
+    Returns:
+        tuple[int, int] | None: The grid cell, or None if the point is off the grid.
+    """
+    try:
+        row = int((GRID_YMAX - float(lat)) // GRID_CELLSIZE)
+        col = int((float(lng) - GRID_XMIN) // GRID_CELLSIZE)
+    except (TypeError, ValueError):
+        return None
+    if 0 <= row < GRID_NROWS and 0 <= col < GRID_NCOLS:
+        return row, col
+    return None
+
+
+def cell_center(row: int, col: int) -> tuple[float, float]:
+    """
+    Returns the (lat, lng) of the center of a statewide grid cell.
+    """
+    return round(GRID_YMAX - (row + 0.5) * GRID_CELLSIZE, 6), round(GRID_XMIN + (col + 0.5) * GRID_CELLSIZE, 6)
+
+
+def normalize_date(value, period: str) -> str:
+    """
+    Truncates an ISO-8601 date to the resolution of `period`, so "now" and
+    "2024-05-17T10:42:00" share a cache key with "2024-05" for monthly data.
+    """
+    try:
+        date = datetime.date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return str(value)
+    return date.strftime("%Y-%m") if period == "month" else date.isoformat()
+
+
+def timeseries_key(api_params: dict) -> tuple:
+    """
+    Builds the cache key of a /raster/timeseries request.
+    """
+    location = ("cell", api_params["row"], api_params["col"]) if "row" in api_params else (
+        "point", str(api_params.get("lat")), str(api_params.get("lng"))
+    )
+    return (
+        api_params.get("datatype"),
+        api_params.get("period"),
+        api_params.get("aggregation"),
+        api_params.get("production"),
+        api_params.get("extent"),
+        *location,
+        api_params.get("start"),
+        api_params.get("end"),
+    )
+
+
+def series_key(api_params: dict) -> str:
+    """
+    Identifies a series independently of its date range, e.g.
+    "rainfall|month|None|new|statewide|cell|324|822".
+    """
+    return "|".join(str(part) for part in timeseries_key(api_params)[:-2])
+
+
+# get_api_parameters arguments that identify a series, regardless of its dates
+SERIES_ARGS = ("location", "is_region", "lat", "lng", "datatype", "aggregation", "period", "production")
+
+
+def series_args(args: dict) -> dict:
+    """
+    Drops the date range (and anything else that doesn't identify a series) from
+    function call arguments. Coordinates are snapped to the center of their
+    grid cell, since every point of a cell has the same series.
+    """
+    series = {key: args[key] for key in SERIES_ARGS if args.get(key) is not None}
+    cell = snap_to_grid(series["lat"], series["lng"]) if "lat" in series and "lng" in series else None
+    if cell is not None:
+        series["lat"], series["lng"] = cell_center(*cell)
+    return series
+
+
+def next_period(date: str, period: str) -> str:
+    """
+    Returns the period following a normalized date ("2024-12" -> "2025-01").
+    """
+    if period == "month":
+        year, month = int(date[:4]), int(date[5:7])
+        return f"{year + month // 12:04d}-{month % 12 + 1:02d}"
+    return (datetime.date.fromisoformat(date) + datetime.timedelta(days=1)).isoformat()
+
+
+def is_recent(date: str) -> bool:
+    """
+    Tells whether a normalized date falls in the trailing window where HCDP may
+    still publish or revise data.
+    """
+    try:
+        value = datetime.date.fromisoformat(f"{date}-01" if len(date) == 7 else date[:10])
+    except ValueError:
+        return True
+    return value >= datetime.date.today() - datetime.timedelta(days=TIMESERIES_RECENT_DAYS)
+
+
+def timeseries_ttl(end: str) -> float:
+    """
+    Returns how long a timeseries ending at `end` may be served from cache.
+    """
+    return TIMESERIES_RECENT_TTL if is_recent(end) else TIMESERIES_TTL
+
+
+class TimeseriesStore:
+    """
+    Append-only on-disk store of timeseries points, one series per grid cell,
+    datatype, period, aggregation and production.
+
+    Besides the points it records the date span that has already been fetched,
+    so a request only goes upstream for the part of its range not yet covered,
+    normally just the months published since the last stored point.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS points (
+                    series TEXT NOT NULL, date TEXT NOT NULL, key TEXT NOT NULL, value REAL,
+                    PRIMARY KEY (series, date)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS spans (
+                    series TEXT PRIMARY KEY, start TEXT NOT NULL, end TEXT NOT NULL
+                );
+                """
+            )
+        return self._conn
+
+    def span(self, series: str) -> tuple[str, str] | None:
+        return self._connect().execute("SELECT start, end FROM spans WHERE series = ?", (series,)).fetchone()
+
+    def last_date(self, series: str) -> str | None:
+        row = self._connect().execute("SELECT MAX(date) FROM points WHERE series = ?", (series,)).fetchone()
+        return row[0] if row else None
+
+    def missing_range(self, series: str, start: str, end: str, period: str) -> tuple[str, str] | None:
+        """
+        Returns the (start, end) range that still has to be fetched to serve
+        [start, end], or None if the store already covers it.
+        """
+        span = self.span(series)
+        if span is None:
+            return start, end
+        if start < span[0]:
+            # Fetch up to the stored span so the covered range stays contiguous
+            return start, max(end, span[0])
+        last = self.last_date(series)
+        if last is not None and last >= end:
+            return None
+        # Recent periods may have been published since the span was fetched
+        if end <= span[1] and not is_recent(end):
+            return None
+        # Fetch from the end of the stored span even when the request starts
+        # later, so the covered range stays contiguous
+        tail_start = next_period(last, period) if last and last >= span[0] else span[0]
+        return tail_start, end
+
+    def merge(self, series: str, data: dict, period: str, start: str, end: str):
+        """
+        Appends fetched points and extends the covered span to include [start, end].
+        """
+        conn = self._connect()
+        conn.executemany(
+            "INSERT OR REPLACE INTO points (series, date, key, value) VALUES (?, ?, ?, ?)",
+            [(series, normalize_date(key, period), key, value) for key, value in data.items()],
+        )
+        span = self.span(series)
+        if span is not None:
+            start, end = min(start, span[0]), max(end, span[1])
+        conn.execute("INSERT OR REPLACE INTO spans (series, start, end) VALUES (?, ?, ?)", (series, start, end))
+        conn.commit()
+
+    def read(self, series: str, start: str, end: str) -> dict:
+        """
+        Returns the stored date/value pairs of `series` within [start, end].
+        """
+        rows = self._connect().execute(
+            "SELECT key, value FROM points WHERE series = ? AND date >= ? AND date <= ? ORDER BY date",
+            (series, start, end),
+        )
+        return dict(rows)
+
+
+timeseries_store = TimeseriesStore(TIMESERIES_STORE_PATH)
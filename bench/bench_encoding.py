@@ -0,0 +1,54 @@
+"""
+Compares the size and serialization time of the timeseries payload sent to the
+frontend in each encoding.
+
+    dict/json: date/value pairs through FastAPI's jsonable_encoder and json.dumps (the old path)
+    dict/orjson: the same pairs serialized by orjson
+    compact/orjson: first date, period and base64 float32 values
+    npy: the .npy body of GET /timeseries?format=npy
+
+Usage:
+    python -m bench.bench_encoding --repeat 20
+"""
+import argparse
+import json
+import time
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+from app.encoding import decode_series, encode_series, series_npy
+from bench.bench_summarize import synthetic_series
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return out, (time.perf_counter() - start) / repeat * 1000
+
+
+def main(repeat):
+    print(f"{'series':<22} {'encoding':<16} {'bytes':>10} {'ms':>8}")
+    for period, datatype in (("month", "rainfall"), ("day", "rainfall"), ("day", "temperature")):
+        data = {key: round(value, 4) for key, value in synthetic_series(period, datatype).items()}
+        label = f"{datatype}/{period} ({len(data)})"
+        encodings = {
+            "dict/json": lambda: json.dumps(jsonable_encoder({"data": data})).encode(),
+            "dict/orjson": lambda: orjson.dumps({"data": data}),
+            "compact/orjson": lambda: orjson.dumps({"data": encode_series(data, period)}),
+            "npy": lambda: series_npy(data, period)[0],
+        }
+        for name, fn in encodings.items():
+            body, ms = timed(fn, repeat)
+            print(f"{label:<22} {name:<16} {len(body):>10} {ms:>8.2f}")
+        decoded = decode_series(encode_series(data, period))
+        error = max(abs(decoded[key] - value) for key, value in data.items())
+        assert decoded.keys() == data.keys(), "compact round trip lost dates"
+        print(f"{label:<22} compact round trip max error {error:.2g}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args().repeat)
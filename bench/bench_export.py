@@ -0,0 +1,102 @@
+"""
+Compares ways of downloading a bulk export from the local fake HCDP server,
+whose downloads are limited to a fixed bandwidth per connection.
+
+    content: /genzip/instant/content, the whole zip in one body
+    link: the single file of /genzip/instant/link, streamed
+    splitlink: the ordered parts of /genzip/instant/splitlink through
+               export.stream_parts, one window size after another
+
+Each run reports the time, throughput, the most bytes held at once and the
+downloads it took, and checks the bytes match the zip. --break-rate cuts
+downloads off halfway to exercise resumed parts.
+
+Usage:
+    python -m bench.bench_export --parts 16 --part-size 2097152 --bandwidth 8388608 --break-rate 0.2
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import time
+
+from bench.fake_hcdp import FakeHCDP
+
+os.environ.setdefault("HTTP_RETRY_BACKOFF", "0.05")
+
+DATA = [{
+    "datatype": "rainfall", "production": "new", "period": "day", "extent": "statewide",
+    "range": {"start": "2000-01-01", "end": "2020-12-31"}, "files": ["data_map"],
+}]
+
+
+async def consume(chunks, buffered):
+    """
+    Hashes streamed chunks, sampling how many bytes the exporter buffers.
+
+    Returns:
+        tuple[str, int, int]: The digest, the size and the peak bytes held.
+    """
+    digest = hashlib.sha256()
+    size = peak = 0
+    async for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+        peak = max(peak, buffered() + len(chunk))
+    return digest.hexdigest(), size, peak
+
+
+async def run(args):
+    server = FakeHCDP(
+        export_parts=args.parts, export_part_size=args.part_size, bandwidth=args.bandwidth, break_rate=args.break_rate,
+    )
+    os.environ["HCDP_BASE_URL"] = await server.start()
+    from app import export, hcdp
+    from app.metrics import EXPORT_BUFFERED
+
+    expected = hashlib.sha256(server.export_body("full")).hexdigest()
+    total = args.parts * args.part_size
+    print(f"export of {args.parts} x {args.part_size} bytes, {args.bandwidth} B/s per connection, "
+          f"{args.break_rate:.0%} of downloads cut off")
+    print(f"{'method':<16} {'s':>7} {'MB/s':>7} {'peak held MB':>13} {'downloads':>10} {'ok':>4}")
+
+    def downloads():
+        paths = ("/files/explore/export", "/genzip/instant/content")
+        return sum(count for path, count in server.requests.items() if path.startswith(paths))
+
+    async def report(label, chunks, buffered=lambda: 0):
+        sent = downloads()
+        start = time.perf_counter()
+        try:
+            digest, size, peak = await consume(chunks, buffered)
+        except Exception as e:
+            print(f"{label:<16} failed: {type(e).__name__}: {e}")
+            return
+        elapsed = time.perf_counter() - start
+        print(f"{label:<16} {elapsed:>7.2f} {size / elapsed / 1e6:>7.1f} {peak / 1e6:>13.1f} "
+              f"{downloads() - sent:>10} {'yes' if digest == expected and size == total else 'NO':>4}")
+
+    async def content():
+        body = await hcdp.post_genzip_instant_content("bench@example.com", DATA)
+        yield body
+
+    try:
+        await report("content", content())
+        link = await hcdp.post_genzip_instant_link("bench@example.com", DATA)
+        await report("link", export.stream_parts([link], window=1), EXPORT_BUFFERED.total)
+        for window in args.windows:
+            links = await export.export_links("bench@example.com", DATA)
+            await report(f"splitlink x{window}", export.stream_parts(links, window=window), EXPORT_BUFFERED.total)
+    finally:
+        await hcdp.close_session()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--parts", type=int, default=16)
+    parser.add_argument("--part-size", type=int, default=2 * 2**20)
+    parser.add_argument("--bandwidth", type=int, default=8 * 2**20)
+    parser.add_argument("--break-rate", type=float, default=0.0)
+    parser.add_argument("--windows", type=int, nargs="+", default=[1, 4, 8])
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,87 @@
+"""
+Measures how often the local parameter extractor answers /chat questions
+without the first Gemini round-trip, how often it gets them right, and how
+much latency that saves.
+
+Each question in the corpus is run through extract_parameters; questions at or
+above FAST_EXTRACT_CONFIDENCE are fast-path hits, the rest still go to the model.
+The corpus lists the arguments each question should yield, or null for
+questions the model must handle (explanations, comparisons, questions that
+aren't about climate data). Precision is the share of hits with the expected
+arguments, accuracy the share of data questions extracted correctly whatever
+the confidence. Relative dates are resolved against --today.
+Saved latency is correct hits x the model extraction latency passed on the
+command line. Exits non-zero if a question meant for the model takes the fast path.
+
+Usage:
+    python -m bench.bench_extract --llm-latency 0.8 -v
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+from app.extract import FAST_EXTRACT_CONFIDENCE, extract_parameters
+
+CORPUS = os.path.join(os.path.dirname(__file__), "data", "extract_expected.jsonl")
+# Arguments compared with the expected ones
+COMPARED = ("datatype", "aggregation", "period", "location", "time_start", "time_end")
+
+
+def load_corpus(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip() and not line.startswith("#")]
+
+
+def main(args):
+    cases = load_corpus(args.corpus)
+    today = datetime.date.fromisoformat(args.today)
+    hits = correct_hits = correct = 0
+    wrong_hits, model_only_hits = [], []
+    elapsed = 0.0
+    for case in cases:
+        question, expected = case["question"], case["args"]
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            params, confidence = extract_parameters(question, today)
+        elapsed += (time.perf_counter() - start) / args.repeat
+        hit = confidence >= FAST_EXTRACT_CONFIDENCE
+        right = expected is not None and all(params.get(key) == expected.get(key) for key in COMPARED)
+        hits += hit
+        correct += right
+        correct_hits += hit and right
+        if hit and expected is None:
+            model_only_hits.append(question)
+        elif hit and not right:
+            wrong_hits.append(question)
+        if args.verbose:
+            label = ("HIT " if hit else "LLM ") + ("ok   " if right or (expected is None and not hit) else "WRONG")
+            print(f"{label} {confidence:.2f}  {question}\n      {params}")
+
+    data_questions = sum(case["args"] is not None for case in cases)
+    print(f"questions:            {len(cases)} ({data_questions} data requests)")
+    print(f"fast-path hits:       {hits} ({100 * hits / len(cases):.0f}%) at confidence >= {FAST_EXTRACT_CONFIDENCE}")
+    print(f"precision:            {correct_hits}/{hits} hits with the expected arguments")
+    print(f"accuracy:             {correct}/{data_questions} data requests extracted correctly")
+    print(f"mean extraction time: {elapsed / len(cases) * 1e6:.0f} us")
+    print(f"latency saved:        {correct_hits * args.llm_latency:.1f} s total, "
+          f"{correct_hits * args.llm_latency / len(cases) * 1000:.0f} ms per question "
+          f"(model extraction assumed at {args.llm_latency * 1000:.0f} ms)")
+    for question in wrong_hits:
+        print(f"wrong arguments:      {question}")
+    for question in model_only_hits:
+        print(f"taken from the model: {question}")
+    if model_only_hits:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--today", default="2025-06-15", help="reference date of the expected arguments")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="seconds per model extraction call")
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    main(parser.parse_args())
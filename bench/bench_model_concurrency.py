@@ -0,0 +1,106 @@
+"""
+Load benchmark for /chat and /funfact against a local fake model.
+
+The fake model answers after a fixed delay without touching Vertex AI, so the
+measured throughput only reflects how well a single worker overlaps model calls.
+With the async SDK path, requests/sec should grow roughly linearly with the
+number of concurrent clients until MODEL_CONCURRENCY is reached. The answer
+cache and the fun fact pools are disabled so every request reaches the model.
+
+Usage:
+    python -m bench.bench_model_concurrency --latency 0.2 --requests 64
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "bench")
+os.environ.setdefault("GOOGLE_CLOUD_LOCATION", "us-central1")
+os.environ.setdefault("ANSWER_CACHE_SIZE", "0")
+os.environ.setdefault("FUNFACT_POOL_SIZE", "0")
+# Per-request INFO lines (app and httpx) would drown the results
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import httpx
+from google.genai import types
+
+from app import main
+
+
+class FakeModels:
+    """
+    Stand-in for client.aio.models that sleeps instead of calling Gemini.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    @staticmethod
+    def _response(text):
+        return types.GenerateContentResponse(
+            candidates=[
+                types.Candidate(
+                    content=types.Content(role="model", parts=[types.Part(text=text)])
+                )
+            ]
+        )
+
+    async def generate_content(self, model, contents, config=None):
+        await asyncio.sleep(self.latency)
+        return self._response("Aloha from the fake model.")
+
+    async def generate_content_stream(self, model, contents, config=None):
+        await asyncio.sleep(self.latency)
+
+        async def chunks():
+            for text in ("Aloha ", "from the ", "fake model."):
+                yield self._response(text)
+
+        return chunks()
+
+
+class FakeClient:
+    def __init__(self, latency):
+        self.aio = type("FakeAio", (), {"models": FakeModels(latency)})()
+
+
+async def run_level(http, concurrency, total, method, url, **kwargs):
+    """
+    Sends `total` requests with at most `concurrency` in flight and returns req/s.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            response = await http.request(method, url, **kwargs)
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+async def main_async(args):
+    main.client = FakeClient(args.latency)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        print(f"fake model latency: {args.latency * 1000:.0f} ms, MODEL_CONCURRENCY={main.MODEL_CONCURRENCY}")
+        print(f"{'clients':>8} {'/funfact req/s':>16} {'/chat req/s':>14}")
+        for concurrency in args.levels:
+            funfact = await run_level(
+                http, concurrency, args.requests, "GET", "/funfact", params={"island": "Maui"}
+            )
+            chat = await run_level(
+                http, concurrency, args.requests, "POST", "/chat",
+                json={"messages": [{"role": "user", "content": "Is it windy on Oahu?"}]},
+            )
+            print(f"{concurrency:>8} {funfact:>16.1f} {chat:>14.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model latency in seconds")
+    parser.add_argument("--requests", type=int, default=64, help="requests per concurrency level")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    asyncio.run(main_async(parser.parse_args()))
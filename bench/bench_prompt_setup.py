@@ -0,0 +1,71 @@
+"""
+Measures the per-request cost of preparing the Gemini calls of /chat.
+
+    rebuilt: the tools and every config built from scratch on each request
+    precompiled: the shared tools and the per-day configs looked up from their caches
+
+It also compares the size of the extraction request prefix sent with every
+call: the short instructions, the instructions plus hcdp_API.txt, and a
+reference to the context cache holding them.
+
+Usage:
+    python -m bench.bench_prompt_setup --repeat 2000
+"""
+import argparse
+import os
+import time
+
+os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "bench")
+os.environ.setdefault("GOOGLE_CLOUD_LOCATION", "us-central1")
+
+from google.genai.types import GenerateContentConfig, GoogleSearch, Tool
+
+from app import main
+
+
+def rebuilt(today):
+    """
+    The setup every request paid before: fresh tools, instructions and configs.
+    """
+    extraction = GenerateContentConfig(
+        temperature=0, tools=main.get_tools(), system_instruction=main.EXTRACTION_INSTRUCTION.format(today=today)
+    )
+    commentary = GenerateContentConfig(system_instruction=main.COMMENTARY_INSTRUCTION.format(today=today))
+    fallback = GenerateContentConfig(
+        tools=[Tool(google_search=GoogleSearch())], system_instruction=main.FALLBACK_INSTRUCTION.format(today=today)
+    )
+    return extraction, commentary, fallback
+
+
+def precompiled(today):
+    return main.extraction_config(today), main.commentary_config(today), main.fallback_config(today)
+
+
+def timed(fn, repeat):
+    today = main.current_date()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(today)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def run(repeat):
+    print(f"{'setup':<14} {'us/request':>10}")
+    for name, fn in (("rebuilt", rebuilt), ("precompiled", precompiled)):
+        print(f"{name:<14} {timed(fn, repeat):>10.1f}")
+
+    today = main.current_date()
+    short = main.extraction_config(today).model_dump_json(exclude_none=True)
+    full = main.GenerateContentConfig(
+        temperature=0, tools=main.TOOLS, system_instruction=main.CACHED_EXTRACTION_INSTRUCTION + main.text
+    ).model_dump_json(exclude_none=True)
+    cached = main.cached_extraction_config("projects/bench/locations/us-central1/cachedContents/0").model_dump_json(exclude_none=True)
+    print(f"\n{'extraction prefix':<28} {'bytes':>8} {'~tokens':>8}")
+    for name, body in (("short instructions", short), ("with hcdp_API.txt", full), ("context cache reference", cached)):
+        print(f"{name:<28} {len(body):>8} {len(body) // 4:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    run(parser.parse_args().repeat)
@@ -0,0 +1,511 @@
+"""
+End-to-end load benchmark of /chat and /funfact replaying recorded upstream traffic.
+
+`record` runs the backend behind recording proxies in front of HCDP, Nominatim
+and Vertex AI, sends it the sample questions and fun fact requests one by one
+and saves every exchange, the client requests included, to a gzipped JSON
+lines fixture. `run` serves those exchanges from local replay servers with
+the recorded (or a fixed) latency per service, starts the backend under
+uvicorn in a subprocess pointed at them and drives the recorded /chat and
+/funfact requests at increasing concurrency. For each level it reports
+p50/p95/p99 latency, throughput and errors, the time per /chat request spent
+in each pipeline stage and upstream service (from /metrics) and the peak RSS
+of the server process. No network access or credentials are needed to replay.
+
+Replayed requests are matched to the recorded request of the same service,
+method and path whose query and body are most alike, so dates that moved
+since the recording still find their exchange; requests nothing matches are
+answered 404 and counted. The answer cache is disabled so every request runs
+the pipeline; unless --cold is given, one pass of the workload warms the
+HCDP and geocode caches first.
+
+Usage:
+    python -m bench.bench_replay record --upstream live --questions 20
+    python -m bench.bench_replay record --upstream fake
+    python -m bench.bench_replay run --levels 1 4 16 --requests 64 --model-latency 0.8 --output before.json
+"""
+import argparse
+import asyncio
+import base64
+import gzip
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import httpx
+import numpy as np
+from aiohttp import web
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "data", "replay.jsonl.gz")
+QUESTIONS = os.path.join(os.path.dirname(__file__), "data", "questions.txt")
+ISLANDS = ["Oahu", "Maui", "Kauai", "Hawaii", "Molokai", "Lanai"]
+SERVICES = ("hcdp", "nominatim", "model")
+# Request and response headers that describe one hop, not the exchange
+HOP_HEADERS = {"host", "content-length", "accept-encoding", "connection", "transfer-encoding", "content-encoding"}
+
+
+def load_fixtures(path: str) -> list[dict]:
+    with gzip.open(path, "rt") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def save_fixtures(path: str, exchanges: list[dict]):
+    with gzip.open(path, "wt") as file:
+        for exchange in exchanges:
+            file.write(json.dumps(exchange, sort_keys=True) + "\n")
+
+
+def normalize_path(path: str) -> str:
+    # Vertex paths carry the project and region the recording ran with
+    return re.sub(r"/projects/[^/]+/locations/[^/]+/", "/projects/-/locations/-/", path)
+
+
+def decode_body(raw: bytes, content_type: str):
+    """
+    Returns a body as JSON, text or base64, whichever keeps it readable.
+    """
+    if not raw:
+        return None, None
+    if "json" in content_type:
+        try:
+            return json.loads(raw), "json"
+        except ValueError:
+            pass
+    try:
+        return raw.decode("utf-8"), "text"
+    except UnicodeDecodeError:
+        return base64.b64encode(raw).decode("ascii"), "base64"
+
+
+def encode_body(body, encoding: str | None) -> bytes:
+    if encoding == "json":
+        return json.dumps(body).encode()
+    if encoding == "base64":
+        return base64.b64decode(body)
+    return (body or "").encode()
+
+
+def features(query: dict, body) -> set:
+    """
+    Flattens a request's query and body into (path, value) leaves to compare requests by.
+    """
+    leaves = set()
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(f"{prefix}.{key}", item)
+        elif isinstance(value, list):
+            for index, item in enumerate(value):
+                walk(f"{prefix}.{index}", item)
+        else:
+            leaves.add((prefix, json.dumps(value)))
+
+    walk("query", query)
+    walk("body", body)
+    return leaves
+
+
+async def start_site(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+
+class Recorder:
+    """
+    Proxy to an upstream service that records every exchange passing through.
+    """
+
+    def __init__(self, service: str, upstream: str, exchanges: list[dict]):
+        self.service = service
+        self.upstream = upstream.rstrip("/")
+        self.exchanges = exchanges
+        self.app = web.Application(client_max_size=2**30)
+        self.app.router.add_route("*", "/{path:.*}", self.forward)
+        self.session = None
+
+    async def forward(self, request):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=300))
+        raw = await request.read()
+        headers = {key: value for key, value in request.headers.items() if key.lower() not in HOP_HEADERS}
+        start = time.perf_counter()
+        async with self.session.request(
+            request.method, f"{self.upstream}{request.path_qs}", data=raw or None, headers=headers,
+        ) as response:
+            content = await response.read()
+            status = response.status
+            content_type = response.headers.get("Content-Type", "")
+        elapsed = time.perf_counter() - start
+        body, _ = decode_body(raw, request.headers.get("Content-Type", "json"))
+        response_body, encoding = decode_body(content, content_type)
+        self.exchanges.append({
+            "service": self.service, "method": request.method, "path": normalize_path(request.path),
+            "query": dict(request.query), "body": body, "status": status, "content_type": content_type,
+            "response": response_body, "encoding": encoding, "elapsed": round(elapsed, 4),
+        })
+        return web.Response(body=content, status=status, headers={"Content-Type": content_type} if content_type else None)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+class Replayer:
+    """
+    Serves the recorded exchanges of one service after the recorded (or a fixed) latency.
+    """
+
+    def __init__(self, service: str, exchanges: list[dict], latency: float | None = None, jitter: float = 0.0):
+        self.service = service
+        self.latency = latency
+        self.jitter = jitter
+        self.index = {}
+        for exchange in exchanges:
+            key = (exchange["method"], exchange["path"])
+            self.index.setdefault(key, []).append((features(exchange["query"], exchange["body"]), exchange))
+        self.matches = {}
+        self.misses = 0
+        self.app = web.Application(client_max_size=2**30)
+        self.app.router.add_route("*", "/{path:.*}", self.reply)
+
+    def match(self, method: str, path: str, query: dict, body) -> dict | None:
+        """
+        Returns the recorded exchange most like the request, by Jaccard similarity of their features.
+        """
+        key = (method, normalize_path(path), json.dumps(query, sort_keys=True), json.dumps(body, sort_keys=True))
+        if key not in self.matches:
+            candidates = self.index.get(key[:2], [])
+            leaves = features(query, body)
+            best = max(candidates, key=lambda item: len(leaves & item[0]) / (len(leaves | item[0]) or 1), default=None)
+            self.matches[key] = best[1] if best is not None else None
+        return self.matches[key]
+
+    async def reply(self, request):
+        body, _ = decode_body(await request.read(), request.headers.get("Content-Type", "json"))
+        exchange = self.match(request.method, request.path, dict(request.query), body)
+        if exchange is None:
+            self.misses += 1
+            return web.json_response({"error": f"no recorded {self.service} exchange"}, status=404)
+        latency = exchange["elapsed"] if self.latency is None else self.latency
+        await asyncio.sleep(latency + random.uniform(0, self.jitter))
+        return web.Response(
+            body=encode_body(exchange["response"], exchange["encoding"]), status=exchange["status"],
+            headers={"Content-Type": exchange["content_type"]} if exchange["content_type"] else None,
+        )
+
+
+class AppServer:
+    """
+    The backend under uvicorn in a subprocess, so its RSS and metrics are its own.
+    """
+
+    def __init__(self, hcdp_url: str, nominatim_url: str, model_url: str, token: str | None, env: dict | None = None):
+        self.workdir = tempfile.mkdtemp(prefix="bench-replay-")
+        self.port = None
+        self.process = None
+        self.env = {
+            **os.environ,
+            "HCDP_BASE_URL": hcdp_url,
+            "NOMINATIM_URL": nominatim_url,
+            "TIMESERIES_STORE_PATH": os.path.join(self.workdir, "timeseries.sqlite3"),
+            "GEOCODE_CACHE_PATH": os.path.join(self.workdir, "geocode.sqlite3"),
+            "RASTER_CACHE_DIR": "",
+            "PREFETCH_INTERVAL": "0",
+            "ANSWER_CACHE_SIZE": "0",
+            "MODEL_CONTEXT_CACHE_TTL": "0",
+            **(env or {}),
+        }
+        self.env.setdefault("GOOGLE_CLOUD_PROJECT", "bench")
+        self.env.setdefault("GOOGLE_CLOUD_LOCATION", "us-central1")
+        self.command = [sys.executable, "-m", "bench.bench_replay", "serve", "--model-url", model_url]
+        if token:
+            self.command += ["--token", token]
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self, timeout: float = 60):
+        self.port = free_port()
+        log = open(os.path.join(self.workdir, "server.log"), "w")
+        self.process = subprocess.Popen(self.command + ["--port", str(self.port)], env=self.env, stdout=log, stderr=log)
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient() as http:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    break
+                try:
+                    if (await http.get(f"{self.url}/cache/stats")).status_code == 200:
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"The backend didn't start, see {log.name}")
+
+    def peak_rss(self) -> int:
+        """
+        Returns the peak resident set size of the server so far, in bytes (Linux only).
+        """
+        with open(f"/proc/{self.process.pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(args):
+    """
+    Runs the backend with its Gemini client pointed at `--model-url`.
+    """
+    import uvicorn
+    from google import genai
+    from google.genai.types import HttpOptions
+    from google.oauth2.credentials import Credentials
+
+    from app import main
+
+    main.client = genai.Client(
+        vertexai=True,
+        http_options=HttpOptions(api_version="v1", base_url=args.model_url),
+        project=main.PROJECT_ID,
+        location=main.LOCATION,
+        # A replay server accepts any token; recording uses the default credentials
+        credentials=Credentials(token=args.token) if args.token else None,
+    )
+    main.extraction_cache.client = main.client
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def stage_totals(metrics: str) -> dict:
+    """
+    Sums seconds and counts per chat stage and per upstream service from /metrics.
+    """
+    totals = {}
+    for line in metrics.splitlines():
+        found = re.match(r'(chat_stage_seconds|upstream_request_seconds)_(sum|count)\{(\w+)="([^"]+)"[^}]*\} (\S+)$', line)
+        if found:
+            metric, kind, _, name, value = found.groups()
+            label = name if metric == "chat_stage_seconds" else f"upstream:{name}"
+            totals.setdefault(label, [0.0, 0.0])[kind == "count"] += float(value)
+    return totals
+
+
+async def drive(http, requests: list[dict], total: int, concurrency: int) -> dict:
+    """
+    Sends `total` requests cycling through `requests`, at most `concurrency` at a time.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(request):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await http.request(request["method"], request["path"], params=request["query"] or None, json=request["body"])
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(requests[i % len(requests)]) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {"p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "rps": total / elapsed, "errors": errors}
+
+
+async def record(args):
+    exchanges = []
+    upstreams = {
+        "hcdp": os.getenv("HCDP_BASE_URL", "https://api.hcdp.ikewai.org"),
+        "nominatim": os.getenv("NOMINATIM_URL", "https://nominatim.openstreetmap.org"),
+        "model": f"https://{os.getenv('GOOGLE_CLOUD_LOCATION', 'us-central1')}-aiplatform.googleapis.com",
+    }
+    fakes = []
+    if args.upstream == "fake":
+        from bench.fake_gemini import FakeGemini
+        from bench.fake_hcdp import FakeHCDP
+
+        fake_hcdp, fake_gemini = FakeHCDP(latency=0.15, jitter=0.1), FakeGemini(latency=0.6, jitter=0.4)
+        fakes = [fake_hcdp, fake_gemini]
+        hcdp_url = await fake_hcdp.start()
+        upstreams = {"hcdp": hcdp_url, "nominatim": hcdp_url, "model": await fake_gemini.start()}
+    recorders = {service: Recorder(service, upstream, exchanges) for service, upstream in upstreams.items()}
+    runners, urls = [], {}
+    for service, recorder in recorders.items():
+        runner, urls[service] = await start_site(recorder.app)
+        runners.append(runner)
+    token = "fake" if args.upstream == "fake" else None
+    server = AppServer(urls["hcdp"], urls["nominatim"], urls["model"], token)
+    with open(QUESTIONS) as file:
+        questions = [line.strip() for line in file if line.strip() and not line.startswith("#")][:args.questions]
+    workload = [
+        {"service": "client", "method": "POST", "path": "/chat", "query": {},
+         "body": {"messages": [{"role": "user", "content": question}]}}
+        for question in questions
+    ] + [
+        {"service": "client", "method": "GET", "path": "/funfact", "query": {"island": island}, "body": None}
+        for island in ISLANDS
+    ]
+    try:
+        await server.start()
+        async with httpx.AsyncClient(base_url=server.url, timeout=300) as http:
+            for request in workload:
+                response = await http.request(request["method"], request["path"], params=request["query"] or None, json=request["body"])
+                print(f"{response.status_code} {request['path']} {request['body'] or request['query']}"[:120])
+            # Lets background work (fun fact pools, station index) finish
+            await asyncio.sleep(args.settle)
+    finally:
+        server.stop()
+        for runner in runners:
+            await runner.cleanup()
+        for recorder in recorders.values():
+            await recorder.close()
+        for fake in fakes:
+            await fake.stop()
+    save_fixtures(args.fixtures, workload + exchanges)
+    counts = {service: sum(exchange["service"] == service for exchange in exchanges) for service in SERVICES}
+    print(f"saved {len(workload)} client requests and {counts} upstream exchanges to {args.fixtures}")
+
+
+def latency_arg(value: str) -> float | None:
+    return None if value == "recorded" else float(value)
+
+
+async def run(args):
+    fixtures = load_fixtures(args.fixtures)
+    workload = {path: [item for item in fixtures if item["service"] == "client" and item["path"] == path] for path in ("/chat", "/funfact")}
+    latencies = {"hcdp": args.hcdp_latency, "nominatim": args.nominatim_latency, "model": args.model_latency}
+    replayers = {
+        service: Replayer(service, [item for item in fixtures if item["service"] == service], latency_arg(latencies[service]), args.jitter)
+        for service in SERVICES
+    }
+    runners, urls = [], {}
+    for service, replayer in replayers.items():
+        runner, urls[service] = await start_site(replayer.app)
+        runners.append(runner)
+    print(f"{len(fixtures)} fixtures from {args.fixtures}; latency hcdp={args.hcdp_latency} "
+          f"nominatim={args.nominatim_latency} model={args.model_latency} jitter={args.jitter}")
+
+    results = []
+    server = None
+    try:
+        for level, concurrency in enumerate(args.levels):
+            if server is None or args.cold:
+                if server is not None:
+                    server.stop()
+                server = AppServer(urls["hcdp"], urls["nominatim"], urls["model"], "replay")
+                await server.start()
+                if not args.cold:
+                    async with httpx.AsyncClient(base_url=server.url, timeout=300) as http:
+                        for path, requests in workload.items():
+                            await drive(http, requests, len(requests), 4)
+            limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+            async with httpx.AsyncClient(base_url=server.url, timeout=300, limits=limits) as http:
+                result = {"concurrency": concurrency}
+                before = stage_totals((await http.get("/metrics")).text)
+                result["chat"] = await drive(http, workload["/chat"], args.requests, concurrency)
+                after = stage_totals((await http.get("/metrics")).text)
+                result["stages_ms"] = {
+                    name: (after[name][0] - before.get(name, [0.0, 0.0])[0]) / args.requests * 1000
+                    for name in after if after[name][1] > before.get(name, [0.0, 0.0])[1]
+                }
+                if workload["/funfact"]:
+                    result["funfact"] = await drive(http, workload["/funfact"], args.requests, concurrency)
+            result["peak_rss_mb"] = server.peak_rss() / 2**20
+            results.append(result)
+            print_level(result, header=level == 0)
+    finally:
+        if server is not None:
+            server.stop()
+        for runner in runners:
+            await runner.cleanup()
+
+    print_stages(results)
+    misses = {service: replayer.misses for service, replayer in replayers.items() if replayer.misses}
+    if misses:
+        print(f"requests without a recorded exchange (answered 404): {misses}; re-record the fixtures")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"args": vars(args), "results": results, "misses": misses}, file, indent=2, default=str)
+
+
+def print_level(result: dict, header: bool):
+    if header:
+        print(f"{'clients':>8} {'endpoint':<9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'errors':>7} {'peak RSS MB':>12}")
+    for endpoint in ("chat", "funfact"):
+        if endpoint in result:
+            stats = result[endpoint]
+            print(f"{result['concurrency']:>8} {'/' + endpoint:<9} {stats['p50_ms']:>8.0f} {stats['p95_ms']:>8.0f} "
+                  f"{stats['p99_ms']:>8.0f} {stats['rps']:>8.1f} {stats['errors']:>7} {result['peak_rss_mb']:>12.0f}")
+
+
+def print_stages(results: list[dict]):
+    names = sorted({name for result in results for name in result["stages_ms"]})
+    print("\n/chat time per request by stage (ms, summed over concurrent calls)")
+    print(f"{'stage':<28}" + "".join(f"{result['concurrency']:>9}" for result in results))
+    for name in names:
+        print(f"{name:<28}" + "".join(f"{result['stages_ms'].get(name, 0.0):>9.1f}" for result in results))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="record fixtures through proxies in front of the upstreams")
+    record_parser.add_argument("--upstream", choices=("live", "fake"), default="live",
+                               help="the real services (needs OAUTH_TOKEN and Google credentials) or the local stand-ins")
+    record_parser.add_argument("--questions", type=int, default=50, help="sample questions to ask")
+    record_parser.add_argument("--settle", type=float, default=3.0, help="seconds left for background work before saving")
+    record_parser.add_argument("--fixtures", default=FIXTURES)
+
+    run_parser = commands.add_parser("run", help="replay the fixtures under load")
+    run_parser.add_argument("--fixtures", default=FIXTURES)
+    run_parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="concurrent clients")
+    run_parser.add_argument("--requests", type=int, default=64, help="requests per endpoint and level")
+    for service in SERVICES:
+        run_parser.add_argument(f"--{service}-latency", default="recorded", help="seconds, or 'recorded'")
+    run_parser.add_argument("--jitter", type=float, default=0.0, help="extra latency drawn uniformly up to this many seconds")
+    run_parser.add_argument("--cold", action="store_true", help="start a fresh server with empty caches for each level")
+    run_parser.add_argument("--output", help="also write the results to this JSON file")
+
+    serve_parser = commands.add_parser("serve", help=argparse.SUPPRESS)
+    serve_parser.add_argument("--port", type=int, required=True)
+    serve_parser.add_argument("--model-url", required=True)
+    serve_parser.add_argument("--token")
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args)
+    else:
+        asyncio.run(record(args) if args.command == "record" else run(args))
@@ -0,0 +1,137 @@
+"""
+Exercises the HCDP resilience layer against the local fake HCDP server.
+
+Three scenarios, each reporting what reached the fake upstream and asserting
+the behaviour it exercises, so a regression exits non-zero:
+    coalescing: many concurrent identical timeseries requests while HCDP is slow
+    retries: distinct requests while a share of responses are 503s, with and without retries
+    outage: HCDP drops every connection; the circuit opens, stale data is served,
+            failures answer fast with 503, and the circuit closes once HCDP is back
+
+Usage:
+    python -m bench.bench_resilience --callers 50 --latency 0.3 --error-rate 0.3
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from bench.fake_hcdp import FakeHCDP
+
+os.environ.setdefault("TIMESERIES_STORE_PATH", os.path.join(tempfile.mkdtemp(), "timeseries.sqlite3"))
+os.environ.setdefault("RASTER_CACHE_DIR", "")
+os.environ.setdefault("HTTP_RETRY_BACKOFF", "0.05")
+os.environ.setdefault("CIRCUIT_FAILURES", "5")
+os.environ.setdefault("CIRCUIT_RESET", "1")
+
+
+def series_params(lat):
+    return {
+        "start": "2000-01", "end": "2020-12", "lat": lat, "lng": -157.8,
+        "datatype": "rainfall", "extent": "statewide", "period": "month", "production": "new",
+    }
+
+
+async def coalescing(server, hcdp, callers, latency):
+    server.faults.update(latency=latency, error_rate=0.0)
+    server.requests.clear()
+    start = time.perf_counter()
+    results = await asyncio.gather(*(hcdp.fetch_timeseries(series_params(21.3)) for _ in range(callers)))
+    elapsed = time.perf_counter() - start
+    print(f"coalescing: {callers} concurrent callers -> {server.requests['/raster/timeseries']} upstream request(s), "
+          f"{elapsed * 1000:.0f} ms, {len(results[0])} points each")
+    assert server.requests["/raster/timeseries"] == 1, "concurrent identical requests were not coalesced"
+    assert results[0] and all(result == results[0] for result in results), "coalesced callers got different data"
+
+
+async def retries(server, hcdp, requests, error_rate):
+    server.faults.update(latency=0.0, error_rate=error_rate, error_status=503)
+    succeeded = []
+    for label, attempts in (("no retries", 0), (f"{hcdp.HTTP_RETRIES} retries", hcdp.HTTP_RETRIES)):
+        server.requests.clear()
+        ok = 0
+        for i in range(requests):
+            try:
+                await hcdp.request_json(
+                    f"{hcdp.BASE_URL}/raster/timeseries", params=series_params(20 + i / 1000),
+                    raise_for_status=True, retries=attempts,
+                )
+                ok += 1
+            except Exception:
+                pass
+            # Keep the breaker from opening, this scenario is about retries
+            hcdp.circuit_breaker("hcdp").record(True)
+        print(f"retries ({label}): {ok}/{requests} succeeded with {error_rate:.0%} errors, "
+              f"{server.requests['/raster/timeseries']} upstream requests")
+        succeeded.append(ok)
+    server.faults.update(error_rate=0.0)
+    # All attempts of a request fail with probability error_rate ** (retries + 1)
+    expected = requests * (1 - error_rate ** (hcdp.HTTP_RETRIES + 1))
+    assert succeeded[1] > succeeded[0] or error_rate == 0, "retries did not recover any failed request"
+    assert succeeded[1] >= 0.95 * expected, f"only {succeeded[1]}/{requests} succeeded with retries"
+
+
+async def outage(server, hcdp):
+    key_params = series_params(19.7)
+    await hcdp.fetch_timeseries(key_params)
+    server.faults.update(down=True)
+    server.requests.clear()
+
+    # Extending the range needs HCDP, so what the store holds is served instead
+    stale = await hcdp.fetch_timeseries({**key_params, "end": "2030-12"})
+    print(f"outage: served {len(stale)} stale points, breaker {hcdp.circuit_breaker('hcdp').state}")
+    assert stale, "no stale data served during the outage"
+    breaker = hcdp.circuit_breaker("hcdp")
+    # Every failed attempt counts, retries and the stale fetch above included
+    for i in range(hcdp.CIRCUIT_FAILURES):
+        if breaker.state != "closed":
+            break
+        try:
+            await hcdp.fetch_timeseries(series_params(18 + i / 100))
+        except Exception:
+            pass
+    sent = server.requests["/raster/timeseries"]
+    start = time.perf_counter()
+    try:
+        await hcdp.fetch_timeseries(series_params(18.5))
+        status = 200
+    except Exception as e:
+        status = hcdp.upstream_status(e)
+    elapsed = time.perf_counter() - start
+    print(f"outage: breaker {breaker.state} after {sent} upstream attempts; "
+          f"next request failed with {status} in {elapsed * 1000:.2f} ms without reaching upstream "
+          f"({server.requests['/raster/timeseries'] - sent} sent)")
+    assert breaker.state == "open", f"breaker still {breaker.state} after {breaker.count} failures"
+    assert breaker.count == hcdp.CIRCUIT_FAILURES, f"breaker opened after {breaker.count} failures"
+    assert status == 503, f"open breaker answered {status}"
+    assert server.requests["/raster/timeseries"] == sent, "open breaker let a request through"
+
+    server.faults.update(down=False)
+    await asyncio.sleep(breaker.reset)
+    data = await hcdp.fetch_timeseries(series_params(18.5))
+    print(f"recovery: probe returned {len(data)} points, breaker {breaker.state}")
+    assert data and breaker.state == "closed", "breaker did not close once HCDP was back"
+
+
+async def run(args):
+    server = FakeHCDP()
+    os.environ["HCDP_BASE_URL"] = await server.start()
+    from app import hcdp
+
+    try:
+        await coalescing(server, hcdp, args.callers, args.latency)
+        await retries(server, hcdp, args.requests, args.error_rate)
+        await outage(server, hcdp)
+    finally:
+        await hcdp.close_session()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--callers", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.3)
+    asyncio.run(run(parser.parse_args()))
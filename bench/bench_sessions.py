@@ -0,0 +1,77 @@
+"""
+Checks how sessions resolve follow-up questions against the local fake HCDP
+server, and times the resolution.
+
+    follow-up: "how about Hilo?" after a Kona answer must geocode Hilo afresh
+               instead of carrying Kona's coordinates over
+    reuse: a coordinate-only question is answered from the session only when
+           it falls in the grid cell of the series fetched before
+
+Any broken check exits non-zero.
+
+Usage:
+    python -m bench.bench_sessions --repeat 2000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from bench.fake_hcdp import FakeHCDP
+
+os.environ.setdefault("TIMESERIES_STORE_PATH", os.path.join(tempfile.mkdtemp(), "timeseries.sqlite3"))
+os.environ.setdefault("RASTER_CACHE_DIR", "")
+
+KONA = {"location": "Kona", "datatype": "rainfall", "time_start": "2010-01-01", "time_end": "2015-12-31"}
+POINT = {"lat": 21.3, "lng": -157.8, "datatype": "rainfall", "time_start": "2010-01-01", "time_end": "2015-12-31"}
+
+
+async def follow_up(hcdp, sessions, repeat):
+    first = await hcdp.request_from_params(KONA)
+    kona = first["extra_params"]
+    session = sessions.Session("bench")
+    # What the model sends back once it has seen Kona's coordinates
+    session.remember([{**KONA, "lat": kona["lat"], "lng": kona["lng"]}], [{**kona, "data": first["data"]}])
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        calls = session.follow_up_calls("how about Hilo?")
+    elapsed = time.perf_counter() - start
+    result = await hcdp.request_from_params(calls[0])
+    hilo = (await hcdp.get_location("Hilo"))[0]
+    got = (result["extra_params"]["lat"], result["extra_params"]["lng"])
+    print(f"follow-up: {calls[0]} -> {got}, {elapsed / repeat * 1e6:.1f} µs per resolution")
+    assert calls[0]["location"] == "Hilo", "follow-up did not switch the location"
+    assert got == (float(hilo["lat"]), float(hilo["lon"])), f"Hilo resolved to {got}, Kona is {(kona['lat'], kona['lng'])}"
+
+
+async def reuse(hcdp, sessions):
+    first = await hcdp.request_from_params(POINT)
+    session = sessions.Session("bench")
+    session.remember([POINT], [{**first["extra_params"], "data": first["data"]}])
+    year = {"time_start": "2012-01-01", "time_end": "2012-12-31"}
+    same_cell = session.reusable_result({**POINT, **year, "lat": 21.3001, "lng": -157.8001})
+    elsewhere = session.reusable_result({**POINT, **year, "lat": 19.7, "lng": -155.1})
+    print(f"reuse: same cell {'reused' if same_cell else 'fetched'}, other point {'reused' if elsewhere else 'fetched'}")
+    assert same_cell is not None and len(same_cell["data"]) == 12, "a point in the same cell was not reused"
+    assert elsewhere is None, "another point reused the stored series"
+
+
+async def run(args):
+    server = FakeHCDP()
+    os.environ["HCDP_BASE_URL"] = await server.start()
+    from app import hcdp, sessions
+
+    try:
+        await follow_up(hcdp, sessions, args.repeat)
+        await reuse(hcdp, sessions)
+    finally:
+        await hcdp.close_session()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=2000)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,57 @@
+"""
+Measures how much the timeseries summary shrinks the function response sent to
+Gemini, and what it costs to compute.
+
+A synthetic HCDP-shaped series from 1990 to today is summarized for monthly and
+daily rainfall and temperature. Tokens are estimated at ~4 characters each.
+
+Usage:
+    python -m bench.bench_summarize
+"""
+import argparse
+import datetime
+import json
+import time
+
+import numpy as np
+
+from app.summarize import summarize_timeseries
+
+
+def synthetic_series(period, datatype, start="1990-01-01"):
+    """
+    Builds date/value pairs shaped like a /raster/timeseries response.
+    """
+    unit = "M" if period == "month" else "D"
+    dates = np.arange(np.datetime64(start, unit), np.datetime64(datetime.date.today(), unit))
+    rng = np.random.default_rng(0)
+    months = dates.astype("datetime64[M]").astype(int) % 12
+    seasonal = np.cos(2 * np.pi * months / 12)
+    if datatype == "rainfall":
+        values = np.maximum(0, 150 + 100 * seasonal + rng.normal(0, 60, len(dates)))
+        if period == "day":
+            values /= 30
+    else:
+        values = 23 - 2 * seasonal + rng.normal(0, 0.8, len(dates))
+    return {f"{d.astype('datetime64[D]')}T00:00:00.000Z": float(v) for d, v in zip(dates, values)}
+
+
+def main(repeat):
+    print(f"{'series':<22} {'points':>7} {'raw bytes':>10} {'summary':>8} {'~tokens':>16} {'ms':>6}")
+    for period in ("month", "day"):
+        for datatype in ("rainfall", "temperature"):
+            data = synthetic_series(period, datatype)
+            raw = json.dumps({"results": data})
+            start = time.perf_counter()
+            for _ in range(repeat):
+                summary = summarize_timeseries(data, datatype, period)
+            elapsed = (time.perf_counter() - start) / repeat * 1000
+            compact = json.dumps({"results": summary}, ensure_ascii=False)
+            tokens = f"{len(raw) // 4}->{len(compact) // 4}"
+            print(f"{period + ' ' + datatype:<22} {len(data):>7} {len(raw):>10} {len(compact):>8} {tokens:>16} {elapsed:>6.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    main(parser.parse_args().repeat)
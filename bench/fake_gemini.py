@@ -0,0 +1,141 @@
+"""
+Local stand-in for the Vertex AI generateContent API with injectable latency.
+
+Answers generateContent and streamGenerateContent (?alt=sse) for any model.
+When the request offers get_api_parameters and the last turn is a user
+question, it calls the function with the arguments the local extractor finds
+in the question, like the real model would for a data request; otherwise it
+answers with a few sentences of text. Point a genai.Client at it with
+HttpOptions(base_url=...) and any bearer token.
+
+Usage:
+    python -m bench.fake_gemini --port 8766 --latency 0.8
+"""
+import argparse
+import asyncio
+import collections
+import json
+import random
+
+from aiohttp import web
+
+from app.extract import extract_parameters
+
+SENTENCES = [
+    "Rainfall in Hawaii varies sharply over short distances because of the trade winds and the terrain.",
+    "Windward slopes catch most of the moisture while leeward coasts stay much drier.",
+    "The wet season usually runs from November to April, when winter storms and cold fronts pass through.",
+    "Dry summers are typical on leeward sides, and drought years often follow El Niño winters.",
+    "Temperatures change little through the year near the coast but drop steadily with elevation.",
+    "The series shows clear seasonal swings along with a few unusually wet or dry periods.",
+    "Comparing recent years with the long-term record helps put individual extremes in context.",
+]
+
+
+def answer_text(prompt: str, sentences: int = 5) -> str:
+    rng = random.Random(prompt)
+    return " ".join(rng.sample(SENTENCES, sentences))
+
+
+def user_text(content: dict) -> str | None:
+    if content.get("role", "user") != "user":
+        return None
+    texts = [part["text"] for part in content.get("parts", []) if "text" in part]
+    return texts[-1] if texts and len(texts) == len(content.get("parts", [])) else None
+
+
+def offers_function(body: dict, name: str) -> bool:
+    return any(
+        declaration.get("name") == name
+        for tool in body.get("tools", [])
+        for declaration in tool.get("functionDeclarations", [])
+    )
+
+
+def respond(body: dict) -> dict:
+    """
+    Builds the candidate content answering a generateContent request body.
+    """
+    contents = body.get("contents", [])
+    prompt = user_text(contents[-1]) if contents else None
+    if prompt is not None and offers_function(body, "get_api_parameters"):
+        args, _ = extract_parameters(prompt)
+        if "datatype" in args or "location" in args:
+            return {"role": "model", "parts": [{"functionCall": {"name": "get_api_parameters", "args": args}}]}
+    return {"role": "model", "parts": [{"text": answer_text(json.dumps(contents, sort_keys=True))}]}
+
+
+class FakeGemini:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = collections.Counter()
+        self.app = web.Application()
+        self.app.router.add_post("/{version}/{path:.*}:generateContent", self.generate_content)
+        self.app.router.add_post("/{version}/{path:.*}:streamGenerateContent", self.stream_generate_content)
+        self._runner = None
+        self.url = None
+
+    async def _answer(self, request) -> dict:
+        body = await request.json()
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        content = respond(body)
+        return {
+            "candidates": [{"content": content, "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": len(json.dumps(body)) // 4, "candidatesTokenCount": 50},
+        }
+
+    async def generate_content(self, request):
+        self.requests["generateContent"] += 1
+        return web.json_response(await self._answer(request))
+
+    async def stream_generate_content(self, request):
+        self.requests["streamGenerateContent"] += 1
+        answer = await self._answer(request)
+        parts = answer["candidates"][0]["content"]["parts"]
+        chunks = [answer]
+        if "text" in parts[0]:
+            # A few chunks, like the real stream
+            words = parts[0]["text"].split(" ")
+            step = max(1, len(words) // 3)
+            chunks = [
+                {"candidates": [{"content": {"role": "model", "parts": [{"text": " ".join(words[i:i + step]) + " "}]}}]}
+                for i in range(0, len(words), step)
+            ]
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for chunk in chunks:
+            await response.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode())
+        await response.write_eof()
+        return response
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Starts serving in the running event loop and returns the base URL.
+        """
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    args = parser.parse_args()
+    web.run_app(FakeGemini(args.latency, args.jitter).app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Local stand-in for the HCDP API (and Nominatim's /search) with injectable latency and errors.
+
+Serves /raster/timeseries, /stations, /production/list and the /genzip/instant
+endpoints with synthetic data shaped like the real responses, and counts the
+requests it receives. Generated zips are random bytes served from
+/files/explore/export/, honouring Range requests. Faults
+are set on start and can be changed at runtime with POST /_faults, e.g.
+{"latency": 0.5, "error_rate": 0.2, "down": true}; GET /_stats returns the
+request counts.
+
+Faults:
+    latency, jitter: seconds added to every response (jitter drawn uniformly)
+    error_rate: share of requests answered with error_status
+    timeout_rate: share of requests that hang for `hang` seconds
+    down: drop every connection without answering
+    export_parts, export_part_size: how /genzip/instant/splitlink splits a zip
+    bandwidth: bytes per second of each zip download (0 for unlimited)
+    break_rate: share of zip downloads cut off halfway
+
+Usage:
+    python -m bench.fake_hcdp --port 8765 --latency 0.2 --error-rate 0.1
+    HCDP_BASE_URL=http://127.0.0.1:8765 uvicorn app.main:app
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import math
+import random
+
+from aiohttp import web
+
+DEFAULT_FAULTS = {
+    "latency": 0.0,
+    "jitter": 0.0,
+    "error_rate": 0.0,
+    "error_status": 503,
+    "timeout_rate": 0.0,
+    "hang": 60.0,
+    "down": False,
+    "export_parts": 8,
+    "export_part_size": 2**20,
+    "bandwidth": 0,
+    "break_rate": 0.0,
+}
+
+
+def synthetic_timeseries(start: str, end: str, period: str, lat: float, lng: float) -> dict:
+    """
+    Builds date/value pairs like /raster/timeseries, seasonal and deterministic per location.
+    """
+    day = datetime.date.fromisoformat(f"{start}-01"[:10])
+    last = datetime.date.fromisoformat(f"{end}-01"[:10] if len(end) == 7 else end[:10])
+    if period == "month":
+        day = day.replace(day=1)
+    rng = random.Random(f"{lat:.4f},{lng:.4f}")
+    data = {}
+    while day <= last:
+        seasonal = math.cos(2 * math.pi * (day.month - 1) / 12)
+        data[f"{day.isoformat()}T00:00:00.000Z"] = round(max(0.0, 150 + 100 * seasonal + rng.gauss(0, 40)), 4)
+        if period == "month":
+            day = (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        else:
+            day += datetime.timedelta(days=1)
+    return data
+
+
+class FakeHCDP:
+    def __init__(self, **faults):
+        self.faults = {**DEFAULT_FAULTS, **faults}
+        self.requests = collections.Counter()
+        self.app = web.Application(middlewares=[self._inject_faults])
+        self.app.add_routes([
+            web.get("/raster/timeseries", self.raster_timeseries),
+            web.get("/stations", self.stations),
+            web.get("/production/list", self.production_list),
+            web.post("/genzip/instant/content", self.genzip_content),
+            web.post("/genzip/instant/link", self.genzip_link),
+            web.post("/genzip/instant/splitlink", self.genzip_splitlink),
+            web.get("/files/explore/export/{name}", self.export_file),
+            web.get("/search", self.search),
+            web.post("/_faults", self.set_faults),
+            web.get("/_stats", self.stats),
+        ])
+        self._runner = None
+        self.url = None
+
+    @web.middleware
+    async def _inject_faults(self, request, handler):
+        if request.path.startswith("/_"):
+            return await handler(request)
+        self.requests[request.path] += 1
+        faults = self.faults
+        if faults["down"]:
+            request.transport.close()
+            raise web.HTTPServiceUnavailable()
+        delay = faults["latency"] + random.uniform(0, faults["jitter"])
+        if random.random() < faults["timeout_rate"]:
+            delay = faults["hang"]
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if random.random() < faults["error_rate"]:
+            return web.json_response({"error": "injected"}, status=faults["error_status"])
+        return await handler(request)
+
+    async def raster_timeseries(self, request):
+        q = request.query
+        lat = float(q.get("lat", 19.5))
+        lng = float(q.get("lng", -155.5))
+        if "row" in q:
+            lat, lng = float(q["row"]), float(q["col"])
+        return web.json_response(synthetic_timeseries(q["start"], q["end"], q.get("period", "month"), lat, lng))
+
+    async def stations(self, request):
+        limit = int(request.query.get("limit", 10000))
+        offset = int(request.query.get("offset", 0))
+        docs = [
+            {"name": "hcdp_station_metadata", "value": {"skn": str(i), "name": f"Station {i}", "lat": 19 + i / 100, "lng": -156 + i / 100}}
+            for i in range(offset, min(offset + limit, 500))
+        ]
+        return web.json_response(docs)
+
+    async def production_list(self, request):
+        return web.json_response(["https://example.invalid/map.tif"])
+
+    def export_body(self, name: str) -> bytes:
+        """
+        Returns an export file: "part<i>" or "full", the parts concatenated.
+        """
+        size = self.faults["export_part_size"]
+        if name == "full":
+            return b"".join(self.export_body(f"part{i}") for i in range(self.faults["export_parts"]))
+        return random.Random(f"{name}:{size}").randbytes(size)
+
+    async def genzip_content(self, request):
+        await request.json()
+        return await self.send_export(request, self.export_body("full"))
+
+    async def genzip_link(self, request):
+        await request.json()
+        return web.json_response(f"{self.url}/files/explore/export/full")
+
+    async def genzip_splitlink(self, request):
+        await request.json()
+        return web.json_response([f"{self.url}/files/explore/export/part{i}" for i in range(self.faults["export_parts"])])
+
+    async def export_file(self, request):
+        return await self.send_export(request, self.export_body(request.match_info["name"]))
+
+    async def send_export(self, request, body):
+        """
+        Streams a zip at the configured bandwidth from the start of its Range,
+        closing the connection halfway for a `break_rate` share of downloads.
+        """
+        start = 0
+        response = web.StreamResponse(headers={"Content-Type": "application/zip", "Accept-Ranges": "bytes"})
+        if "Range" in request.headers:
+            start = request.http_range.start or 0
+            response.set_status(206)
+            response.headers["Content-Range"] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+        response.content_length = len(body) - start
+        await response.prepare(request)
+        cut = (start + len(body)) // 2 if random.random() < self.faults["break_rate"] else len(body)
+        chunk = 64 * 2**10
+        try:
+            for offset in range(start, len(body), chunk):
+                if offset >= cut:
+                    request.transport.close()
+                    break
+                await response.write(body[offset:offset + chunk])
+                if self.faults["bandwidth"]:
+                    await asyncio.sleep(chunk / self.faults["bandwidth"])
+            else:
+                await response.write_eof()
+        except ConnectionResetError:
+            # The client went away
+            pass
+        return response
+
+    async def search(self, request):
+        # Nominatim: every place is somewhere on the Big Island
+        rng = random.Random(request.query.get("q", ""))
+        lat, lng = 19.5 + rng.uniform(-0.5, 0.5), -155.5 + rng.uniform(-0.5, 0.5)
+        return web.json_response([{
+            "lat": f"{lat:.7f}", "lon": f"{lng:.7f}",
+            "display_name": f"{request.query.get('q', '')}, Hawaii County, Hawaii, United States",
+        }])
+
+    async def set_faults(self, request):
+        self.faults.update(await request.json())
+        return web.json_response(self.faults)
+
+    async def stats(self, request):
+        return web.json_response(dict(self.requests))
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Starts serving in the running event loop and returns the base URL.
+        """
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeHCDP(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        error_status=args.error_status, timeout_rate=args.timeout_rate,
+    )
+    web.run_app(server.app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()